@@ -5,20 +5,30 @@ Author: Parker Timmerman
 """
 from typing import List
 
-from constants import BS, Currency, Exchange, OrderType
+import logs
+import logging
+import tracing
+
+from constants import BS, Currency, Exchange, OrderType, transferLatencyPenalty, transferMap
 from graph import Graph, Edge
+from incremental_detector import IncrementalDetector
+from book_keeper import BookKeeper
 from market_engine import MarketEngine
-from math import log
+from math import log2
 from my_types import Order
-from pprint import pprint
-from time import sleep, time
-from utils import trimArbitragePath, getMinimumVolumeOfPath
+from parallel_search import ParallelCycleSearch
+from scheduler import ArbitrageScheduler
+from time import monotonic, sleep, time
+from utils import trimArbitragePath, getMinimumVolumeOfPath, getOptimalVolumeOfPath, hasTransfer, monotonicMs, nodeCurrency, walkPath
 from virtual_market import VirtualMarket
 
+log = logs.getLogger(__name__)
+
 class ArbitrageEngine():
     class _ArbitrageEngine():
-        def __init__(self, currencies, exchanges, pairs):
+        def __init__(self, currencies, exchanges, pairs, latencyPenalty: float = transferLatencyPenalty):
             self._graph = Graph()
+            self._detector = IncrementalDetector(self._graph)
 
             self._supported_currencies = currencies
             for currency in self._supported_currencies:
@@ -26,6 +36,33 @@ class ArbitrageEngine():
             self._supported_exchanges = exchanges
             self._supported_currency_pairs = pairs
 
+            # Unified graph, every node is an (Exchange, Currency) so no exchange's quotes get thrown away
+            self._unifiedGraph = Graph()
+            self._unifiedDetector = IncrementalDetector(self._unifiedGraph)
+            for exchange in self._supported_exchanges:
+                for currency in self._supported_currencies:
+                    self._unifiedGraph.addNode((exchange, currency))
+            self.addTransferEdges(transfers=transferMap, latencyPenalty=latencyPenalty)
+            self._search = None                 # ParallelCycleSearch, if cycle enumeration is spread over processes
+
+        def setMaxEdgeAge(self, maxAge: int = None) -> None:
+            """ Quotes older than maxAge milliseconds are left out of every search, None keeps them forever """
+            self._graph.setMaxAge(maxAge)
+            self._unifiedGraph.setMaxAge(maxAge)
+
+        def setParallelSearch(self, workers: int) -> None:
+            """
+            Spreads findAllArbitrage's cycle enumeration over a pool of worker processes, each searching from
+            its own share of the source nodes. The workers are started before this returns. 0 workers goes
+            back to searching on the calling thread
+            """
+            if self._search:
+                self._search.close()
+                self._search = None
+            if workers:
+                self._search = ParallelCycleSearch(workers=workers)
+
+        @tracing.traced('updateGraph')
         def updateGraph(self):
             """
             Public method to update our internal graph with data from the market.
@@ -33,10 +70,40 @@ class ArbitrageEngine():
             Requests ticker data for every supported pair on every supported exchange, and then updates the graph.
             """
             for exchange in self._supported_exchanges:
-                marketData = VirtualMarket.instance().getMarketData(exch=exchange)
-                for src, dest, edge in marketData.getEdges():
-                    self._graph.addEdge(src, dest, edge.xrate, edge.weight, edge.vol, edge.vol_sym, edge.pair, edge.ab, edge.exch, edge.timestamp)
+                self._graph.merge(VirtualMarket.instance().getMarketData(exch=exchange))
 
+        def addTransferEdges(self, transfers, latencyPenalty: float = transferLatencyPenalty):
+            """
+            Given a map of Currency -> (fraction lost to fees, latency in seconds), connects that currency on
+            every exchange to the same currency on every other exchange in the unified graph.
+
+            The weight of a transfer edge is -log2(1 - fee) plus latencyPenalty for every second it takes,
+            which lets slow transfers be made less attractive than fast ones.
+            """
+            for currency, (fee, latency) in transfers.items():
+                if currency not in self._supported_currencies:
+                    continue
+                xrate = 1 - fee
+                weight = -log2(xrate) + latencyPenalty * latency
+                for a in self._supported_exchanges:
+                    for b in self._supported_exchanges:
+                        if a == b:
+                            continue
+                        # Stamped in the future, transfer edges aren't quotes so they never expire
+                        self._unifiedGraph.addEdge((a, currency), (b, currency), xrate, weight, float('inf'), currency,
+                                                   (currency, currency), 'transfer', (a, b), float('inf'), latency=latency)
+
+        @tracing.traced('updateUnifiedGraph')
+        def updateUnifiedGraph(self):
+            """
+            Public method to update the unified graph with data from the market. Each exchange's edges go
+            between that exchange's own nodes, so nothing is discarded when two exchanges quote the same pair.
+            """
+            for exchange in self._supported_exchanges:
+                self._unifiedGraph.merge(VirtualMarket.instance().getMarketData(exch=exchange),
+                                         mapNode=lambda node, exchange=exchange: (exchange, node))
+
+        @tracing.traced('findArbitrage')
         def findArbitrage(self, graph: Graph, src: Currency):
             """
             Performs Bellman-Ford with traceback on a graph and returns the path that results in an arbitrage
@@ -48,36 +115,80 @@ class ArbitrageEngine():
             trimmedPath = trimArbitragePath(path)
             return trimmedPath
 
-        def verifyArbitrage(self, path):
+        @tracing.traced('findArbitrageIncremental')
+        def findArbitrageIncremental(self, unified: bool = False):
+            """
+            Checks our internal graph, or the unified graph, for a negative cycle, only re-relaxing the parts
+            of the graph that are reachable from edges which changed since the last call. Returns the path that
+            results in an arbitrage, or None
+            """
+            path = (self._unifiedDetector if unified else self._detector).update()
+            if not path:
+                return None
+
+            return trimArbitragePath(path)
+
+        @tracing.traced('findAllArbitrage')
+        def findAllArbitrage(self, graph: Graph, maxLength: int = 4, rankBy: str = 'growth', transfers: bool = True):
+            """
+            Enumerates every distinct negative cycle with at most maxLength edges, and returns a list of
+            (path, percentGrowth, volume, optimalVolume, profit, ages) tuples ranked best first. rankBy is either
+            'growth' or 'volume', whichever isn't used to rank breaks ties. optimalVolume and profit come from
+            walking the depth of the book along the path, and are in terms of the path's first currency. ages
+            is how many milliseconds old each edge of the path is. Set transfers to False to leave out cycles
+            that move funds between exchanges.
+            """
+            opportunities = []
+            now = monotonicMs()
+            for path, weight in graph.negativeCycles(maxLength=maxLength, search=self._search):
+                if not transfers and hasTransfer(path, graph):
+                    continue
+                percentGrowth = (2 ** -weight - 1) * 100        # weight = -log2(product of exchange rates)
+                volume = getMinimumVolumeOfPath(path, graph)
+                optimalVolume, profit = getOptimalVolumeOfPath(path, graph, VirtualMarket.instance().getFees())
+                opportunities.append((path, percentGrowth, volume, optimalVolume, profit, graph.pathAges(path, now=now)))
+
+            if rankBy == 'growth':
+                opportunities.sort(key=lambda x: (x[1], x[2]), reverse=True)
+            elif rankBy == 'volume':
+                opportunities.sort(key=lambda x: (x[2], x[1]), reverse=True)
+            else:
+                raise ValueError('unknown ranking {}, expected \'growth\' or \'volume\''.format(rankBy))
+            return opportunities
+
+        def verifyArbitrage(self, path, graph: Graph = None):
             """ 
             Given a path, check to make sure it results in an arbitrage
             
             Iterates through each element in the path getting it's edge weight and exchange rate.
-            Note: weight = -log2(exchange rate)
-            If the sum is < 0 then product of the exchange rate > 1 => Arbitrage oppurtunity!
+            Note: weight = -log2(exchange rate * (1 - fee))
+            If the sum is < 0 then product of the exchange rate after fees > 1 => Arbitrage oppurtunity!
             """
+            graph = graph or self._graph
             sum = 0
             product = 1
             for idx in range(len(path) - 1):
                 a = path[idx]
                 b = path[idx + 1]
-                edge = self._graph.getEdge(a, b)
+                edge = graph.getEdge(a, b)
 
                 weight = edge.getWeight()           # get the edge weight to verify sum of path < 0
                 sum += weight
 
                 xrate = edge.getExchangeRate()      # multiply all exhange rates to verify product > 1
                 product = product * xrate
-                percentGrowth = (product - 1) * 100
+                percentGrowth = (2 ** -sum - 1) * 100   # growth after fees, which are only in the weights
 
-                print("{0} -- {1} --> {2}".format(a, weight, b))
+                log.debug("%s -- %s --> %s", a, weight, b)
             if sum < 0.0:                           # Good
-                print("{0}Sum of cycle: {1}\tProduct of exhange rates: {2}\tGrowth: {3}%{4}".format('\033[92m', sum, product, percentGrowth, '\033[0m'))
+                log.info("Arbitrage verified, sum of cycle: %s product of exchange rates: %s growth: %s%%", sum, product, percentGrowth,
+                         extra={'fields': {'path': path, 'sum': sum, 'product': product, 'growth': percentGrowth}})
                 return percentGrowth
             else:                                   # Bad
-                print("{0}Sum of cycle: {1}{2}".format('\033[91m',sum,'\033[0m'))
+                log.info("Arbitrage rejected, sum of cycle: %s", sum, extra={'fields': {'path': path, 'sum': sum}})
                 return 0
 
+        @tracing.traced('pathToOrders')
         def pathToOrders(self, path, graph):
             """
             Given an path, will create a list of orders that need to be executed
@@ -101,13 +212,32 @@ class ArbitrageEngine():
                     volume: 120
                 }
             ]
+
+            Orders are sized from the amount of the starting currency that maximises the profit once the
+            books are walked, capped at what the Book Keeper says we hold. That amount is walked along the
+            path so every order trades what the leg before it leaves us with, sells are sized by what goes
+            into the leg and buys by what comes out of it, both in the base currency of the pair.
+
+            Paths through the unified graph have (Exchange, Currency) nodes, transfers between exchanges
+            don't create an order.
             """
             orders: List[Order] = []
-            volume = getMinimumVolumeOfPath(path, graph)
+            fees = VirtualMarket.instance().getFees()
+            volume, _ = getOptimalVolumeOfPath(path, graph, fees)
+            firstEdge = graph.getEdge(path[0], path[1])
+            if BookKeeper.INSTANCE and firstEdge.getAskOrBid() != 'transfer':
+                held = BookKeeper.instance().getValuePairOfCurrencyInExchange(
+                    exch=firstEdge.getExchange(),
+                    curr=nodeCurrency(path[0]))
+                volume = min(volume, held.amt)
+            amounts = walkPath(path, graph, volume, fees)
+
             for idx in range(len(path) - 1):
-                first = path[idx]
-                second = path[idx + 1]
-                edge = graph.getEdge(first, second)
+                edge = graph.getEdge(path[idx], path[idx + 1])
+                if edge.getAskOrBid() == 'transfer':
+                    continue
+                first = nodeCurrency(path[idx])
+                second = nodeCurrency(path[idx + 1])
                 pair = (first, second)
 
                 if pair in self._supported_currency_pairs:
@@ -117,7 +247,7 @@ class ArbitrageEngine():
                             orderType=OrderType.LIMIT,
                             pair=pair,
                             price=edge.getExchangeRate() - 0.0001,
-                            volume=volume,
+                            volume=amounts[idx],
                         )
                     )
                 else:
@@ -128,7 +258,7 @@ class ArbitrageEngine():
                             orderType=OrderType.LIMIT,
                             pair=pair,
                             price=(1/edge.getExchangeRate()) - 0.0001,
-                            volume=volume,
+                            volume=amounts[idx + 1],
                         )
                     )
             return orders
@@ -137,8 +267,7 @@ class ArbitrageEngine():
             if len(orders) == 2:
                 MarketEngine.instance().makeSafeTrades(orders)
             else:
-                print("Number of orders was larger than 2! That is currently not supported")
-                print(orders)
+                log.warning("Number of orders was larger than 2! That is currently not supported: %s", orders)
 
         def convertCurrency(self, amt: float, starting: Currency, ending: Currency):
             """
@@ -151,25 +280,43 @@ class ArbitrageEngine():
             return amt + edge.getExchangeRate()
 
                 
-        def run(self):
+        def _scan(self):
+            """ Scan used by run(), finds and prints arbitrage opportunities but never returns orders to place """
+            self.updateGraph()
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Graph:\n%s", self._graph.toString())
+            path = self.findArbitrageIncremental()
+            if path:
+                self.verifyArbitrage(path)
+                orders = self.pathToOrders(path, self._graph)
+                log.info("Orders: %s", orders)
+            return None
+
+        def run(self, interval: float = 0.5):
+            """
+            Polls the market at most once every interval seconds, so we stay under the exchanges' rate limits,
+            and scans for arbitrage as soon as new data lands, without placing any orders
+            """
+            scheduler = ArbitrageScheduler(scan=self._scan, execute=lambda orders: None)
+            scheduler.start()
             while True:
+                started = monotonic()
                 try:
-                    self.updateGraph()
-                    self._graph.print()
-                    path = self.findArbitrage(self._graph, Currency.USDT)
-                    if path:
-                        self.verifyArbitrage(path)
-                        orders = self.pathToOrders(path, self._graph)
-                        pprint(orders)
-                    sleep(5)
+                    marketData = MarketEngine.instance().fetchTickersConcurrent(
+                        exchanges=self._supported_exchanges,
+                        pairs=self._supported_currency_pairs,
+                        onStale=scheduler.markStale)
+                    for exchange, data in marketData.items():
+                        scheduler.submit(exch=exchange, marketData=data)
                 except Exception as e:
-                    pprint(e)
+                    log.exception("Fetching market data failed: %s", e)
                     sleep(120)
+                sleep(max(interval - (monotonic() - started), 0))
 
     INSTANCE = None
     @classmethod
-    def initialize(cls, currencies, exchanges, pairs):
-        ArbitrageEngine.INSTANCE = cls._ArbitrageEngine(currencies, exchanges, pairs)
+    def initialize(cls, currencies, exchanges, pairs, latencyPenalty: float = transferLatencyPenalty):
+        ArbitrageEngine.INSTANCE = cls._ArbitrageEngine(currencies, exchanges, pairs, latencyPenalty=latencyPenalty)
 
 
     @classmethod
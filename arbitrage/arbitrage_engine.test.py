@@ -0,0 +1,123 @@
+import unittest
+from arbitrage_engine import ArbitrageEngine
+from book_keeper import BookKeeper
+from constants import BS, Currency, Exchange, feeMap, transferLatencyPenalty, transferMap
+from math import log2
+from my_types import ValuePair
+from utils import hasTransfer
+from virtual_market import VirtualMarket
+
+CURRENCIES = [Currency.XRP, Currency.USDT]
+PAIR = (Currency.XRP, Currency.USDT)
+FEE = feeMap[Exchange.KRAKEN][1]
+PATH = [(Exchange.KRAKEN, Currency.XRP), (Exchange.KRAKEN, Currency.USDT), (Exchange.KRAKEN, Currency.XRP)]
+
+def book(bids, asks):
+    """ Market data for PAIR with the given levels, crossed so selling and buying back XRP is an arbitrage """
+    return {PAIR: {
+        'bid': bids[0][0], 'bid_vol': bids[0][1], 'ask': asks[0][0], 'ask_vol': asks[0][1],
+        'bids': bids, 'asks': asks,
+    }}
+
+class TestPathToOrders(unittest.TestCase):
+    def setUp(self):
+        VirtualMarket.initialize(CURRENCIES, [Exchange.KRAKEN], [PAIR])
+        ArbitrageEngine.initialize(CURRENCIES, [Exchange.KRAKEN], [PAIR])
+        BookKeeper.INSTANCE = None
+
+    def tearDown(self):
+        BookKeeper.INSTANCE = None
+
+    def orders(self, bids, asks):
+        VirtualMarket.instance().updateExchange(exch=Exchange.KRAKEN, marketData=book(bids, asks))
+        ArbitrageEngine.instance().updateUnifiedGraph()
+        return ArbitrageEngine.instance().pathToOrders(PATH, ArbitrageEngine.instance()._unifiedGraph)
+
+    def test_sizedFromTheBook(self):
+        # Both bid levels sell for more than it costs to buy the XRP back, so we sell through both
+        sell, buy = self.orders(bids=[(0.5, 100.0), (0.45, 50.0)], asks=[(0.4, 1000.0)])
+        self.assertEqual((sell.buyOrSell, sell.pair), (BS.SELL, PAIR))
+        self.assertEqual((buy.buyOrSell, buy.pair), (BS.BUY, PAIR))
+        self.assertAlmostEqual(sell.volume, 150.0)
+        # Buys are sized by the XRP that comes back, after the fee on both legs
+        self.assertAlmostEqual(buy.volume, (100.0 * 0.5 + 50.0 * 0.45) * (1 - FEE) / 0.4 * (1 - FEE))
+
+    def test_stopsAtTheLevelThatLoses(self):
+        sell, buy = self.orders(bids=[(0.5, 100.0), (0.3, 1000.0)], asks=[(0.4, 1000.0)])
+        self.assertAlmostEqual(sell.volume, 100.0)
+        self.assertAlmostEqual(buy.volume, 100.0 * 0.5 * (1 - FEE) / 0.4 * (1 - FEE))
+
+    def test_cappedAtWhatWeHold(self):
+        BookKeeper.initialize(CURRENCIES, [Exchange.KRAKEN])
+        BookKeeper.instance().updateCurrencyInExchange(Exchange.KRAKEN, Currency.XRP, ValuePair(40.0, 20.0))
+        sell, buy = self.orders(bids=[(0.5, 100.0), (0.45, 50.0)], asks=[(0.4, 1000.0)])
+        self.assertAlmostEqual(sell.volume, 40.0)
+        self.assertAlmostEqual(buy.volume, 40.0 * 0.5 * (1 - FEE) / 0.4 * (1 - FEE))
+
+class TestUnifiedGraph(unittest.TestCase):
+    EXCHANGES = [Exchange.KRAKEN, Exchange.BINANCE]
+
+    def setUp(self):
+        VirtualMarket.initialize(CURRENCIES, self.EXCHANGES, [PAIR])
+        ArbitrageEngine.initialize(CURRENCIES, self.EXCHANGES, [PAIR])
+        self.graph = ArbitrageEngine.instance()._unifiedGraph
+
+    def quote(self, exch, bid, ask):
+        VirtualMarket.instance().updateExchange(exch=exch, marketData={PAIR: {'bid': bid, 'ask': ask, 'bid_vol': 100.0, 'ask_vol': 100.0}})
+
+    def test_transferEdges(self):
+        fee, latency = transferMap[Currency.XRP]
+        edge = self.graph.getEdge((Exchange.KRAKEN, Currency.XRP), (Exchange.BINANCE, Currency.XRP))
+        self.assertEqual(edge.getAskOrBid(), 'transfer')
+        self.assertEqual(edge.getExchange(), (Exchange.KRAKEN, Exchange.BINANCE))
+        self.assertAlmostEqual(edge.getExchangeRate(), 1 - fee)
+        self.assertAlmostEqual(edge.getWeight(), -log2(1 - fee) + transferLatencyPenalty * latency)
+        self.assertEqual(self.graph.getEdge((Exchange.BINANCE, Currency.XRP), (Exchange.KRAKEN, Currency.XRP)).getWeight(), edge.getWeight())
+        self.assertIsNone(self.graph.getEdge((Exchange.KRAKEN, Currency.XRP), (Exchange.BINANCE, Currency.USDT)))
+
+    def test_latencyPenalty(self):
+        fee, latency = transferMap[Currency.USDT]
+        weights = []
+        for penalty in [0.0, 0.001]:
+            ArbitrageEngine.initialize(CURRENCIES, self.EXCHANGES, [PAIR], latencyPenalty=penalty)
+            edge = ArbitrageEngine.instance()._unifiedGraph.getEdge((Exchange.KRAKEN, Currency.USDT), (Exchange.BINANCE, Currency.USDT))
+            weights.append(edge.getWeight())
+        self.assertAlmostEqual(weights[0], -log2(1 - fee))
+        self.assertAlmostEqual(weights[1] - weights[0], 0.001 * latency)
+
+    def test_mergeKeepsEveryExchange(self):
+        self.quote(Exchange.KRAKEN, bid=0.5, ask=0.51)
+        self.quote(Exchange.BINANCE, bid=0.49, ask=0.5)
+        ArbitrageEngine.instance().updateUnifiedGraph()
+        self.assertEqual(self.graph.getEdge((Exchange.KRAKEN, Currency.XRP), (Exchange.KRAKEN, Currency.USDT)).getExchangeRate(), 0.5)
+        self.assertEqual(self.graph.getEdge((Exchange.BINANCE, Currency.XRP), (Exchange.BINANCE, Currency.USDT)).getExchangeRate(), 0.49)
+        self.assertEqual(self.graph.getEdge((Exchange.BINANCE, Currency.USDT), (Exchange.BINANCE, Currency.XRP)).getExchange(), Exchange.BINANCE)
+
+    def test_crossExchangeCycle(self):
+        # Neither book is crossed, but XRP sells on Kraken for 20% more than it costs on Binance
+        self.quote(Exchange.KRAKEN, bid=0.6, ask=0.61)
+        self.quote(Exchange.BINANCE, bid=0.49, ask=0.5)
+        ArbitrageEngine.instance().updateUnifiedGraph()
+        cycle = [
+            (Exchange.KRAKEN, Currency.XRP), (Exchange.KRAKEN, Currency.USDT), (Exchange.BINANCE, Currency.USDT),
+            (Exchange.BINANCE, Currency.XRP), (Exchange.KRAKEN, Currency.XRP),
+        ]
+        paths = [path for path, *_ in ArbitrageEngine.instance().findAllArbitrage(graph=self.graph)]
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(set(paths[0]), set(cycle))
+        self.assertTrue(hasTransfer(paths[0], self.graph))
+        self.assertIsNotNone(ArbitrageEngine.instance().findArbitrageIncremental(unified=True))
+
+        # We can't withdraw yet, so the same cycle is left out when transfers aren't allowed
+        self.assertEqual(ArbitrageEngine.instance().findAllArbitrage(graph=self.graph, transfers=False), [])
+
+    def test_hasTransfer(self):
+        self.quote(Exchange.KRAKEN, bid=0.5, ask=0.51)
+        ArbitrageEngine.instance().updateUnifiedGraph()
+        trade = [(Exchange.KRAKEN, Currency.XRP), (Exchange.KRAKEN, Currency.USDT), (Exchange.KRAKEN, Currency.XRP)]
+        transfer = [(Exchange.KRAKEN, Currency.XRP), (Exchange.BINANCE, Currency.XRP), (Exchange.KRAKEN, Currency.XRP)]
+        self.assertFalse(hasTransfer(trade, self.graph))
+        self.assertTrue(hasTransfer(transfer, self.graph))
+
+if __name__ == '__main__':
+    unittest.main()
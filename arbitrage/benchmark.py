@@ -0,0 +1,233 @@
+"""
+Benchmarks for graph construction, cycle detection and order generation on synthetic markets
+
+Generates a market with a configurable number of currencies and exchanges, plants a number of profitable
+cycles in it, times each stage of the pipeline and writes the results as JSON so regressions can be
+tracked over time.
+
+Usage: python benchmark.py --currencies 40 --exchanges 3 --cycles 5 --output results.json
+
+With --memory 10,20,40 it instead measures, for each of those currency counts, the memory the market and
+graphs take up and what a single tick allocates, using tracemalloc.
+
+Author: Parker Timmerman
+"""
+import argparse
+import json
+import random
+import sys
+import tracemalloc
+
+from graph import Graph, tracebackCycle
+from itertools import count
+from statistics import median
+from time import perf_counter
+from utils import trimArbitragePath
+from virtual_market import VirtualMarket
+
+def syntheticMarket(numCurrencies: int, numExchanges: int, plantedCycles: int, density: float = 0.5, seed: int = 0):
+    """
+    Generates a synthetic market.
+
+    Every currency gets a random value, and every pair is quoted around the ratio of the two values with
+    a small spread, so the market has no arbitrage until we plant some. A cycle is planted by picking
+    three currencies on one exchange and pushing the bid of one of their pairs up by a few percent.
+
+    Returns (currencies, exchanges, pairs, marketData, cycles) where marketData is in the format
+    VirtualMarket.updateMarket takes and cycles is a list of the planted (exchange, [a, b, c]) triangles
+    """
+    rng = random.Random(seed)
+    currencies = ['C{}'.format(i) for i in range(numCurrencies)]
+    exchanges = ['E{}'.format(i) for i in range(numExchanges)]
+    values = {currency: 10 ** rng.uniform(-2, 4) for currency in currencies}
+
+    pairs = [(a, b) for i, a in enumerate(currencies) for b in currencies[i + 1:] if rng.random() < density]
+    triangles = []
+    for _ in range(plantedCycles):
+        a, b, c = sorted(rng.sample(range(numCurrencies), 3))
+        triangle = [currencies[a], currencies[b], currencies[c]]
+        for pair in [(triangle[0], triangle[1]), (triangle[1], triangle[2]), (triangle[0], triangle[2])]:
+            if pair not in pairs:
+                pairs.append(pair)
+        triangles.append((rng.choice(exchanges), triangle))
+
+    marketData = {}
+    for exchange in exchanges:
+        marketData[exchange] = {}
+        for first, second in pairs:
+            price = values[first] / values[second] * rng.uniform(0.999, 1.001)
+            spread = rng.uniform(0.0005, 0.002)
+            marketData[exchange][(first, second)] = {
+                'ask': price * (1 + spread),
+                'bid': price * (1 - spread),
+                'ask_vol': rng.uniform(1, 100),
+                'bid_vol': rng.uniform(1, 100),
+            }
+
+    for exchange, (a, b, c) in triangles:
+        # a -> b -> c -> a, selling a for b and b for c, then buying a back with c on the cheap
+        quote = marketData[exchange][(a, b)]
+        quote['bid'] = quote['bid'] * 1.05
+
+    return (currencies, exchanges, pairs, marketData, triangles)
+
+def timeit(fn, repeat: int, setup=None):
+    """ Runs fn repeat times, returns a summary of the timings in microseconds """
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = perf_counter()
+        fn(*args)
+        timings.append((perf_counter() - start) * 1e6)
+    return {
+        'runs': repeat,
+        'mean_us': sum(timings) / repeat,
+        'p50_us': median(timings),
+        'min_us': min(timings),
+        'max_us': max(timings),
+    }
+
+def runBenchmarks(numCurrencies: int, numExchanges: int, plantedCycles: int, repeat: int, seed: int = 0, workers: int = 0):
+    """
+    Runs every benchmark and returns the results as a dictionary. If workers is given the cycle enumeration
+    is also timed on a ParallelCycleSearch with that many processes
+    """
+    from arbitrage_engine import ArbitrageEngine
+    from parallel_search import ParallelCycleSearch
+
+    currencies, exchanges, pairs, marketData, triangles = syntheticMarket(numCurrencies, numExchanges, plantedCycles, seed=seed)
+    VirtualMarket.initialize(currencies, exchanges, pairs)
+    ArbitrageEngine.initialize(currencies, exchanges, pairs)
+    VirtualMarket.instance().updateMarket(marketData=marketData, timestamp=1)
+    ArbitrageEngine.instance().updateGraph()
+    graph = ArbitrageEngine.instance()._graph
+    edges = [(src, dest, edge.xrate, edge.weight, edge.vol, edge.vol_sym, edge.pair, edge.ab, edge.exch, edge.timestamp)
+             for src, dest, edge in graph.getEdges()]
+    results = {}
+
+    def buildGraph():
+        built = Graph()
+        for currency in currencies:
+            built.addNode(currency)
+        for edge in edges:
+            built.addEdge(*edge)
+    results['Graph.addEdge'] = timeit(buildGraph, repeat)
+    results['Graph.addEdge']['edges'] = len(edges)
+
+    results['Graph.BellmanFordWithTraceback'] = timeit(lambda: graph.BellmanFordWithTraceback(currencies[0]), repeat)
+
+    unified = ArbitrageEngine.instance()._unifiedGraph
+    ArbitrageEngine.instance().updateUnifiedGraph()
+    results['Graph.negativeCycles'] = timeit(lambda: unified.negativeCycles(maxLength=4), max(1, repeat // 10))
+    if workers:
+        search = ParallelCycleSearch(workers=workers)
+        search.search(unified.weightMatrix(), 4)                # start the workers up before timing
+        results['ParallelCycleSearch.search'] = timeit(lambda: unified.negativeCycles(maxLength=4, search=search),
+                                                       max(1, repeat // 10))
+        results['ParallelCycleSearch.search']['workers'] = workers
+        search.close()
+
+    ring = [len(currencies) - 1] + list(range(len(currencies) - 1))
+    results['tracebackCycle'] = timeit(lambda: tracebackCycle(ring, 0), repeat)
+
+    tail = [currencies[idx] for idx in tracebackCycle(ring, 0)] + currencies[1:len(currencies) // 2]
+    results['trimArbitragePath'] = timeit(trimArbitragePath, repeat, setup=lambda: (list(tail),))
+
+    if triangles:
+        exchange, (a, b, c) = triangles[0]
+        path = [a, b, c, a]
+        results['ArbitrageEngine.pathToOrders'] = timeit(lambda: ArbitrageEngine.instance().pathToOrders(path, graph), repeat)
+
+    ticks = [(exchange, {pair: dict(values) for pair, values in data.items()}) for exchange, data in marketData.items()]
+    timestamps = count(2)
+    def updateExchanges():
+        timestamp = next(timestamps)
+        for exchange, data in ticks:
+            VirtualMarket.instance().updateExchange(exch=exchange, marketData=data, timestamp=timestamp)
+    results['VirtualMarket.updateExchange'] = timeit(updateExchanges, repeat)
+    results['VirtualMarket.updateExchange']['pairs'] = len(pairs) * len(exchanges)
+
+    return {
+        'config': {
+            'currencies': numCurrencies,
+            'exchanges': numExchanges,
+            'planted_cycles': plantedCycles,
+            'pairs': len(pairs),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+def memoryBenchmarks(sizes, numExchanges: int, ticks: int, seed: int = 0):
+    """
+    For each currency count in sizes, measures with tracemalloc the bytes held by the Virtual Market and the
+    engine's graphs once they are built, and the blocks and bytes allocated per tick of updating every
+    exchange and merging it into the graphs: the peak bytes allocated during the tick and the number of
+    blocks it left allocated. Returns the results as a dictionary
+    """
+    from arbitrage_engine import ArbitrageEngine
+
+    results = {}
+    for numCurrencies in sizes:
+        currencies, exchanges, pairs, marketData, _ = syntheticMarket(numCurrencies, numExchanges, 0, seed=seed)
+        quotes = [(exchange, {pair: dict(values) for pair, values in data.items()}) for exchange, data in marketData.items()]
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        VirtualMarket.initialize(currencies, exchanges, pairs)
+        ArbitrageEngine.initialize(currencies, exchanges, pairs)
+        VirtualMarket.instance().updateMarket(marketData=marketData, timestamp=1)
+        ArbitrageEngine.instance().updateGraph()
+        ArbitrageEngine.instance().updateUnifiedGraph()
+        resident = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+
+        retained, peaks = [], []
+        for timestamp in range(2, ticks + 2):
+            start = tracemalloc.take_snapshot()
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            for exchange, data in quotes:
+                VirtualMarket.instance().updateExchange(exch=exchange, marketData=data, timestamp=timestamp)
+            ArbitrageEngine.instance().updateGraph()
+            ArbitrageEngine.instance().updateUnifiedGraph()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+            retained.append(sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(start, 'filename')))
+        tracemalloc.stop()
+
+        results[numCurrencies] = {
+            'pairs': len(pairs) * numExchanges,
+            'resident_bytes': resident,
+            'tick_retained_blocks': median(retained),   # blocks a tick leaves behind, should stay around 0
+            'tick_peak_bytes': median(peaks),           # most memory a tick had allocated at once
+        }
+    return {
+        'config': {'currencies': list(sizes), 'exchanges': numExchanges, 'ticks': ticks, 'seed': seed},
+        'memory': results,
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the arbitrage pipeline on a synthetic market')
+    parser.add_argument('--currencies', type=int, default=20)
+    parser.add_argument('--exchanges', type=int, default=2)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=0, help='also time the cycle search on this many processes')
+    parser.add_argument('--memory', help='comma separated currency counts to run the memory benchmark for')
+    parser.add_argument('--output', help='file to write the JSON results to, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        sizes = [int(size) for size in args.memory.split(',')]
+        results = memoryBenchmarks(sizes, args.exchanges, ticks=min(args.repeat, 10), seed=args.seed)
+    else:
+        results = runBenchmarks(args.currencies, args.exchanges, args.cycles, args.repeat, seed=args.seed, workers=args.workers)
+    if args.output:
+        with open(args.output, 'w') as fs:
+            json.dump(results, fs, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
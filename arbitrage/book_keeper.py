@@ -3,9 +3,13 @@ Global singleton object that keeps an offline representation of our current asse
 
 Author: Parker Timmerman
 """
+import numpy as np
+import threading
+
 from typing import List
 
 from constants import BS, Currency, Exchange, OrderType
+from journal import TradeJournal, orderFromDict, orderToDict
 from my_types import Order, ValuePair
 from virtual_market import VirtualMarket
 
@@ -13,7 +17,11 @@ class BookKeeper():
     class _BookKeeper():
         def __init__(self, currencies, exchanges):
             """
-            Example of balances:
+            Balances are kept in a ledger, an (exchange x currency) matrix of amounts, next to a matrix of
+            what each of those amounts is worth in USD. Rows and columns are added as exchanges and
+            currencies are, and _held marks which currencies have been added to which exchange.
+
+            Example of getPositions():
             {
                 Exchange.BINANCE: {
                     Currency.BTC: (0.2, $1,267),
@@ -25,8 +33,18 @@ class BookKeeper():
                 },
             }
             """
-            self._balances = {}
             self._trades = []
+            self._journal = None
+            # Held from a change to the books through to it being journaled and snapshotted, so a snapshot
+            # always matches the sequence number it is written with
+            self._lock = threading.RLock()
+            self._exchanges = []                # row -> exchange
+            self._exchangeIndex = {}            # exchange -> row
+            self._currencies = []               # column -> currency
+            self._currencyIndex = {}            # currency -> column
+            self._held = np.zeros((0, 0), dtype=bool)
+            self._amounts = np.zeros((0, 0))
+            self._usd = np.zeros((0, 0))
 
             self._supportedExchanges = exchanges
             self._supportedCurrencies = currencies
@@ -44,50 +62,95 @@ class BookKeeper():
             print('Hello I\'m the Book Keeper, I\'ve said hi {} times'.format(self.count))
             self.count += 1
 
+        def _resize(self, rows: int, cols: int) -> None:
+            """ Grow the ledger to the given shape, keeping everything in it """
+            held = np.zeros((rows, cols), dtype=bool)
+            amounts = np.zeros((rows, cols))
+            usd = np.zeros((rows, cols))
+            r, c = self._amounts.shape
+            held[:r, :c] = self._held
+            amounts[:r, :c] = self._amounts
+            usd[:r, :c] = self._usd
+            self._held = held
+            self._amounts = amounts
+            self._usd = usd
+
+        def _cell(self, exch: Exchange, curr: Currency):
+            """ Returns the (row, column) of a currency in an exchange, raises if it was never added """
+            if not exch in self._exchangeIndex:
+                raise TypeError('Exchange is not in the balances map, please add it before trying to get a value from it')
+            row = self._exchangeIndex[exch]
+            col = self._currencyIndex.get(curr)
+            if col is None or not self._held[row, col]:
+                raise TypeError('Currency is not in the balances map for this exchange, please add it before trying to use it')
+            return (row, col)
+
+        @staticmethod
+        def _split(value_pair):
+            """ Returns (amount, amount in USD) of a ValuePair, or of an (amount, amount in USD) tuple """
+            if isinstance(value_pair, ValuePair):
+                return (value_pair.amt, value_pair.amt_usd)
+            return tuple(value_pair)
+
         def addExchange(self, exch: Exchange) -> None:
-            if exch in self._balances:
+            if exch in self._exchangeIndex:
                 raise TypeError('Exchange already exists in the balances map, check what you\'re doing')
             else:
-                self._balances[exch] = {}
+                self._exchangeIndex[exch] = len(self._exchanges)
+                self._exchanges.append(exch)
+                self._resize(len(self._exchanges), len(self._currencies))
 
         def addCurrencyToExchange(self, exch: Exchange, curr: Currency, value_pair: ValuePair = ValuePair(0,0)) -> None:
             """
             Given an exchange, and a currency, will add that currency value under the given exchange, with an initial value
             pair of (0, 0). Value pair can be override with the argument 'value_pair'
             """
-            if not exch in self._balances:
+            if not exch in self._exchangeIndex:
                 raise TypeError('Exchange is not in the balances map, please add it before trying to add a currency to it')
-            else:
-                if curr in self._balances[exch]:
-                    raise TypeError('Currency is already in this exchange, please use the updateCurrencyInExchange(...) method')
-                else:
-                    self._balances[exch][curr] = value_pair
+            if not curr in self._currencyIndex:
+                self._currencyIndex[curr] = len(self._currencies)
+                self._currencies.append(curr)
+                self._resize(len(self._exchanges), len(self._currencies))
+            row = self._exchangeIndex[exch]
+            col = self._currencyIndex[curr]
+            if self._held[row, col]:
+                raise TypeError('Currency is already in this exchange, please use the updateCurrencyInExchange(...) method')
+            self._held[row, col] = True
+            self._amounts[row, col], self._usd[row, col] = self._split(value_pair)
 
         def updateCurrencyInExchange(self, exch: Exchange, curr: Currency, value_pair: ValuePair) -> None:
             """
             Given an exchange, a currency, and a value pair, will update the amount of currency we have in that exchange
             with the given value pair.
             """
-            if not exch in self._balances:
-                raise TypeError('Exchange is not in the balances map, please add it before trying to add a currency to it')
-            else:
-                if not curr in self._balances[exch]:
-                    raise TypeError('Currency is not in the balances map for this exchange, please add it before trying to update it')
-                else:
-                    self._balances[exch][curr] = value_pair
+            row, col = self._cell(exch, curr)
+            self._amounts[row, col], self._usd[row, col] = self._split(value_pair)
+
+        def revalue(self) -> None:
+            """
+            Values every amount in the ledger in USD with the Virtual Market's current rates, one multiply for
+            the whole ledger. Amounts that can't be converted to USD on their exchange are valued at 0
+            """
+            with self._lock:
+                rates = np.zeros(self._amounts.shape)
+                for row, exch in enumerate(self._exchanges):
+                    rates[row] = VirtualMarket.instance().getConversionRates(exch=exch, currencies=self._currencies, end=Currency.USDT)
+                self._usd = self._amounts * rates
 
         def reportOrder(self, order=Order):
             """
             Given an order, updates the positions for that exchange
             """
-            exch = order.exchange
-            if not exch in self._balances:
-                raise TypeError('Exchange is not in the balances map, please add it before trying to add a currency to it')
-            
-            acq_curr = order.pair[0]
-            acq_amt = order.volume
+            with self._lock:
+                self._applyOrder(order)
+                self._journalEntry('order', order=orderToDict(order))
+                self.revalue()
 
-            los_curr = order.pair[1]
+        def _applyOrder(self, order: Order) -> None:
+            acq_row, acq_col = self._cell(order.exchange, order.pair[0])
+            los_row, los_col = self._cell(order.exchange, order.pair[1])
+
+            acq_amt = order.volume
             los_amt = order.volume * order.price
 
             if order.buyOrSell == BS.SELL:
@@ -95,31 +158,23 @@ class BookKeeper():
             else:
                 los_amt = los_amt * -1
 
-            new_acq_amt = acq_amt + self._balances[exch][acq_curr].amt
-            new_los_amt = los_amt + self._balances[exch][los_curr].amt
-
-            new_acq_amt_usd = VirtualMarket.instance().convertCurrency(
-                exch=order.exchange,
-                amt=new_acq_amt,
-                start=acq_curr,
-                end=Currency.USDT,
-            )
-            self._balances[exch][acq_curr] = ValuePair(
-                amt=new_acq_amt,
-                amt_usd=new_acq_amt_usd,
-            )
-
-            new_los_amt_usd = VirtualMarket.instance().convertCurrency(
-                exch=order.exchange,
-                amt=new_los_amt,
-                start=los_curr,
-                end=Currency.USDT,
-            )
-            self._balances[exch][los_curr] = ValuePair(
-                amt=new_los_amt,
-                amt_usd=new_los_amt_usd,
-            )
+            self._amounts[acq_row, acq_col] += acq_amt
+            self._amounts[los_row, los_col] += los_amt
 
+        def updateAmounts(self, exch: Exchange, amounts) -> None:
+            """
+            Given an exchange, and a map for that exchange of Currency -> amount held, updates our balances
+            and revalues the ledger
+            """
+            with self._lock:
+                self._applyAmounts(exch, amounts)
+                self._journalEntry('balance', exchange=exch.value, amounts={curr.value: amt for curr, amt in amounts.items()})
+                self.revalue()
+
+        def _applyAmounts(self, exch: Exchange, amounts) -> None:
+            for curr, amt in amounts.items():
+                row, col = self._cell(exch, curr)
+                self._amounts[row, col] = amt
 
         def updateBalance(self, exch: Exchange, balance: {}) -> None:
             """
@@ -131,7 +186,7 @@ class BookKeeper():
                 Currency.ETH: (100, 100),
             }
             """
-            if not exch in self._balances:
+            if not exch in self._exchangeIndex:
                 raise TypeError('Exchange is not in the balances map, please add it before trying to add a currency to it')
             for key in balance.keys():
                 self.updateCurrencyInExchange(exch=exch, curr=key, value_pair=balance[key])
@@ -140,48 +195,142 @@ class BookKeeper():
             """
             Given an exchange and a currency returns the value pair for that currency.
             """
-            if not exch in self._balances:
-                raise TypeError('Exchange is not in the balances map, please add it before trying to get a value from it')
-            else:
-                if not curr in self._balances[exch]:
-                    raise TypeError('Currency is not in the balances map for this exchange, please add it before trying to get its value pair')
-                else:
-                    return self._balances[exch][curr]
+            row, col = self._cell(exch, curr)
+            return ValuePair(float(self._amounts[row, col]), float(self._usd[row, col]))
+
+        def getTotalUSD(self) -> float:
+            """ Returns what everything in the ledger is worth in USD """
+            return float(self._usd.sum())
+
+        def getExchangeTotalsUSD(self):
+            """ Returns a dictionary of exchange -> what everything we hold on it is worth in USD """
+            totals = self._usd.sum(axis=1)
+            return {exch: float(totals[row]) for row, exch in enumerate(self._exchanges)}
 
         def getMaxOrderVolumeOfCurrency(self, curr: Currency) -> float:
             """
             Given a currency, returns the max order volume that could
             be fullfilled by every exchange
             """
-            max_volume = 1000000000
-            for exchange in self._balances.keys():
-                max_volume = min(max_volume, self._balances[exchange][curr])
-            return max_volume
+            col = self._currencyIndex.get(curr)
+            if col is None or not self._exchanges:
+                return 0.0
+            return float(np.where(self._held[:, col], self._amounts[:, col], 0.0).min())
 
         def getMaxOrdersVolume(self, orders: List[Order]) -> float:
             """
             Given a list of orders, determines max trade size we can make to fullfill all orders.
 
             For each order, determines the currency needed to fullfil the order. Then checks
-            the given exchange for how much of that currency we have.
+            the given exchange for how much of that currency we have, in terms of the order's volume.
             """
             volumes = []
             for order in orders:
                 required_currency = order.pair[0] if order.buyOrSell is BS.SELL else order.pair[1]
-                
+                row, col = self._cell(order.exchange, required_currency)
+                available = self._amounts[row, col]
+                volumes.append(available if order.buyOrSell is BS.SELL else available / order.price)
+            return float(min(volumes)) if volumes else 0.0
 
         def getPositions(self):
             """
             Returns the balances map
             """
-            return self._balances
+            return {exch: {curr: ValuePair(float(self._amounts[row, col]), float(self._usd[row, col]))
+                           for col, curr in enumerate(self._currencies) if self._held[row, col]}
+                    for row, exch in enumerate(self._exchanges)}
 
         def addOrder(self, trade: Order):
-            self._trades.append(trade)
+            """ Records a trade we placed """
+            with self._lock:
+                self._trades.append(trade)
+                self._journalEntry('trade', order=orderToDict(trade))
+
+        def getTrades(self) -> List[Order]:
+            return list(self._trades)
+
+        # ======== Persistence ========
+        def _journalEntry(self, kind: str, **fields) -> None:
+            """
+            Appends a change to the journal, if there is one, and snapshots the books when one is due. Must be
+            called with the lock held, after the change has been made to the books
+            """
+            if self._journal is None:
+                return
+            self._journal.append(kind, **fields)
+            if self._journal.snapshotDue():
+                self._journal.snapshot(self.getState())
+
+        def getState(self):
+            """ Returns the ledger and trades as a JSON serializable dictionary """
+            with self._lock:
+                return {
+                    'exchanges': [exch.value for exch in self._exchanges],
+                    'currencies': [curr.value for curr in self._currencies],
+                    'held': self._held.tolist(),
+                    'amounts': self._amounts.tolist(),
+                    'trades': [orderToDict(trade) for trade in self._trades],
+                }
+
+        def _loadState(self, state) -> None:
+            """ Merges a state from getState() into the ledger, adding any exchanges and currencies we are missing """
+            exchanges = [Exchange(value) for value in state['exchanges']]
+            currencies = [Currency(value) for value in state['currencies']]
+            for row, exch in enumerate(exchanges):
+                if not exch in self._exchangeIndex:
+                    self.addExchange(exch)
+                for col, curr in enumerate(currencies):
+                    if not state['held'][row][col]:
+                        continue
+                    amt = state['amounts'][row][col]
+                    if curr in self._currencyIndex and self._held[self._exchangeIndex[exch], self._currencyIndex[curr]]:
+                        self.updateCurrencyInExchange(exch, curr, ValuePair(amt, 0))
+                    else:
+                        self.addCurrencyToExchange(exch, curr, ValuePair(amt, 0))
+            self._trades = [orderFromDict(trade) for trade in state['trades']]
+
+        def recover(self, journal: TradeJournal) -> int:
+            """
+            Rebuilds the books from the journal's newest snapshot plus every entry after it, then journals
+            every change from here on to it. Returns the number of entries replayed on top of the snapshot.
+            The books are revalued if the Virtual Market is up, otherwise values are filled in on the next revalue
+            """
+            with self._lock:
+                self._journal = None
+                snapshot = journal.loadSnapshot()
+                seq = 0
+                if snapshot:
+                    self._loadState(snapshot['state'])
+                    seq = snapshot['seq']
+
+                entries = journal.entriesAfter(seq)
+                for entry in entries:
+                    if entry['kind'] == 'order':
+                        self._applyOrder(orderFromDict(entry['order']))
+                    elif entry['kind'] == 'trade':
+                        self._trades.append(orderFromDict(entry['order']))
+                    elif entry['kind'] == 'balance':
+                        self._applyAmounts(Exchange(entry['exchange']), {Currency(curr): amt for curr, amt in entry['amounts'].items()})
+
+                self._journal = journal
+                if VirtualMarket.INSTANCE:
+                    self.revalue()
+                return len(entries)
+
+        def attachJournal(self, journal: TradeJournal) -> None:
+            """ Journal every change to the books from here on, without loading anything from the journal """
+            with self._lock:
+                self._journal = journal
 
         def clear(self):
             """ DANGEROUS! Clears out the singleton object, losing all records. Primarily used for testing """
-            self._balances = {}
+            self._exchanges = []
+            self._exchangeIndex = {}
+            self._currencies = []
+            self._currencyIndex = {}
+            self._held = np.zeros((0, 0), dtype=bool)
+            self._amounts = np.zeros((0, 0))
+            self._usd = np.zeros((0, 0))
             self._trades = []
 
     INSTANCE = None
@@ -1,6 +1,8 @@
 import unittest
 from book_keeper import BookKeeper
-from constants import Currency, Exchange
+from constants import BS, Currency, Exchange, OrderType
+from my_types import Order
+from virtual_market import VirtualMarket
 
 class TestBookKeeper(unittest.TestCase):
     def test_addExchange(self):
@@ -64,5 +66,37 @@ class TestBookKeeper(unittest.TestCase):
             }
         })
 
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        currencies = [Currency.BTC, Currency.ETH, Currency.USDT]
+        exchanges = [Exchange.KRAKEN, Exchange.BINANCE]
+        pair = (Currency.BTC, Currency.USDT)
+        VirtualMarket.initialize(currencies, exchanges, [pair])
+        for exchange in exchanges:
+            VirtualMarket.instance().updateExchange(exch=exchange, timestamp=1, marketData={
+                pair: {'ask': 10000.0, 'bid': 10000.0, 'ask_vol': 1.0, 'bid_vol': 1.0}})
+        BookKeeper.initialize(currencies, exchanges)
+
+    def test_revalue(self):
+        BookKeeper.instance().updateAmounts(exch=Exchange.KRAKEN, amounts={Currency.BTC: 0.5, Currency.USDT: 100.0})
+        BookKeeper.instance().updateAmounts(exch=Exchange.BINANCE, amounts={Currency.BTC: 0.25, Currency.ETH: 2.0})
+        self.assertAlmostEqual(BookKeeper.instance().getValuePairOfCurrencyInExchange(Exchange.KRAKEN, Currency.BTC).amt_usd, 5000.0)
+        self.assertEqual(BookKeeper.instance().getValuePairOfCurrencyInExchange(Exchange.BINANCE, Currency.ETH).amt_usd, 0.0)   # no ETH market
+        self.assertAlmostEqual(BookKeeper.instance().getTotalUSD(), 7600.0)
+        totals = BookKeeper.instance().getExchangeTotalsUSD()
+        self.assertAlmostEqual(totals[Exchange.KRAKEN], 5100.0)
+        self.assertAlmostEqual(totals[Exchange.BINANCE], 2500.0)
+        self.assertEqual(BookKeeper.instance().getMaxOrderVolumeOfCurrency(Currency.BTC), 0.25)
+
+    def test_reportOrder(self):
+        BookKeeper.instance().updateAmounts(exch=Exchange.KRAKEN, amounts={Currency.USDT: 10000.0})
+        order = Order(Exchange.KRAKEN, BS.BUY, OrderType.LIMIT, (Currency.BTC, Currency.USDT), 10000.0, 0.5)
+        BookKeeper.instance().reportOrder(order=order)
+        positions = BookKeeper.instance().getPositions()
+        self.assertEqual(positions[Exchange.KRAKEN][Currency.BTC].amt, 0.5)
+        self.assertEqual(positions[Exchange.KRAKEN][Currency.USDT].amt, 5000.0)
+        self.assertAlmostEqual(BookKeeper.instance().getTotalUSD(), 10000.0)
+        self.assertEqual(BookKeeper.instance().getMaxOrdersVolume([order]), 0.5)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
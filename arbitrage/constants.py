@@ -41,6 +41,10 @@ class SafetyValues(Enum):
     MaximumOpenTrades = 1
     MinimumOpportunity = 0.9                # This value is in percent i.e. 0.5%
 
+class FeeType(Enum):
+    MAKER = 0               # index into the (Maker, Taker) tuples of feeMap
+    TAKER = 1
+
 class TimeUnit(Enum):
     Milliseconds = 'milliseconds'
     Seconds = 'seconds'
@@ -77,3 +81,29 @@ feeMap = {
     Exchange.KRAKEN: (0.0016, 0.0026),
     Exchange.BINANCE: (0.001, 0.001),
 }
+
+# Map of currency to the cost of moving it from one exchange to another
+# (Fraction of the amount lost to withdrawal fees, Latency in seconds)
+transferMap = {
+    Currency.BTC: (0.0005, 3600),
+    Currency.ETH: (0.001, 900),
+    Currency.LTC: (0.001, 1800),
+    Currency.XRP: (0.0005, 60),
+    Currency.USDT: (0.002, 900),
+}
+
+# Added to a transfer edge's weight for every second the transfer takes, to price in the market moving
+# while the funds are in flight. 1e-5 costs an hour long BTC transfer about 2.5% of growth, an XRP one 0.04%
+transferLatencyPenalty = 1e-5
+
+# Map of exchange to which of its fees we expect to pay, this is baked into the edge weights
+feeTypeMap = {
+    Exchange.KRAKEN: FeeType.TAKER,
+    Exchange.BINANCE: FeeType.TAKER,
+}
+
+# Map of exchange to the maximum number of requests we allow in flight at once
+concurrencyLimitMap = {
+    Exchange.KRAKEN: 2,
+    Exchange.BINANCE: 8,
+}
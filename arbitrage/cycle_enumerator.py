@@ -0,0 +1,71 @@
+"""
+Enumerates every negative cycle of a weight matrix up to a given length
+
+Bellman-Ford only ever hands back one cycle, this finds all of them. Every cycle is built starting from
+its lowest indexed node and only ever steps to higher indexed nodes, so each loop is found exactly once
+no matter how many rotations of it exist. Paths are extended a whole frontier at a time with NumPy, and
+a path is dropped as soon as even the lightest walk back to its start can't make the cycle negative.
+
+Author: Parker Timmerman
+"""
+import numpy as np
+
+from typing import List, Tuple
+
+def _returnBounds(weights, start, maxLength):
+    """
+    Returns a (maxLength + 1, V) array, bounds[r][x] is the weight of the lightest walk from x back to
+    start using at most r edges. Walks may repeat nodes, so this is a lower bound for any simple path.
+    """
+    num_nodes = weights.shape[0]
+    bounds = np.full((maxLength + 1, num_nodes), np.inf)
+    bounds[0][start] = 0
+    for r in range(1, maxLength + 1):
+        bounds[r] = np.minimum(bounds[r - 1], (weights + bounds[r - 1][None, :]).min(axis=1))
+    return bounds
+
+def enumerateNegativeCycles(weights, maxLength: int, starts=None, tolerance: float = 0.0) -> List[Tuple[List[int], float]]:
+    """
+    Given a (V, V) weight matrix, where missing edges have a weight of infinity, returns a list of
+    (cycle, weight) tuples for every simple cycle with at most maxLength edges whose weight is below
+    -tolerance. Each cycle is a list of node indices which starts and ends on the same node.
+
+    starts restricts the search to cycles whose lowest indexed node is one of the given nodes, which lets
+    the search be split up across workers without any two of them finding the same cycle.
+    """
+    num_nodes = weights.shape[0]
+    columns = np.arange(num_nodes)
+    cycles = []
+
+    for start in (range(num_nodes) if starts is None else starts):
+        # Nodes below start belong to some other start's search
+        sub = weights.copy()
+        sub[:start, :] = np.inf
+        sub[:, :start] = np.inf
+        bounds = _returnBounds(sub, start, maxLength)
+
+        paths = np.array([[start]])
+        sums = np.zeros(1)
+        for length in range(1, maxLength + 1):
+            candidate = sums[:, None] + sub[paths[:, -1]]
+
+            # Close the loop back to the start
+            if length > 1:
+                closing = np.flatnonzero(candidate[:, start] < -tolerance)
+                for row in closing:
+                    cycles.append((paths[row].tolist() + [start], float(candidate[row, start])))
+
+            remaining = maxLength - length
+            if not remaining:
+                break
+
+            # Step to any unvisited higher node that can still make it back with a negative total
+            visited = (paths[:, :, None] == columns[None, None, :]).any(axis=1)
+            keep = (columns[None, :] > start) & ~visited & (candidate + bounds[remaining][None, :] < -tolerance)
+            rows, cols = np.nonzero(keep)
+            if not len(rows):
+                break
+            paths = np.concatenate([paths[rows], cols[:, None]], axis=1)
+            sums = candidate[rows, cols]
+
+    return cycles
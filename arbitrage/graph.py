@@ -1,58 +1,148 @@
 """
 Graph objects used for Money Man Spiff's arbitrage engine
-At it's core is a 2D Dictionary aka Dictionary of Dictionaries
+At it's core is an adjacency matrix, nodes (currencies) are mapped to integer indices and the
+weights, exchange rates, and volumes of the edges are stored in contiguous NumPy arrays
 
 Author: Parker Timmerman
 """
-from decimal import *
-from sys import float_info
+import logs
+import numpy as np
+
+from cycle_enumerator import enumerateNegativeCycles
 from typing import List, Tuple
+from utils import monotonicMs
+
+INITIAL_CAPACITY = 8
+
+log = logs.getLogger(__name__)
+
+def tracebackCycle(pred, start):
+    """
+    Follows an array of predecessor indices, -1 for none, back from start and returns the indices of the cycle
+    they run into in forward order, [entry, ..., entry] where entry is the first node of the cycle reached from
+    start. Returns None if the predecessors run out first.
+
+    Iterative, so long chains can't hit the recursion limit, and it only allocates the path it returns: the
+    cycle length comes from walking around it once, then two pointers that length apart meet at the entry.
+    """
+    # Any chain of len(pred) predecessors has to repeat a node, so this lands on the cycle
+    node = start
+    for _ in range(len(pred)):
+        node = pred[node]
+        if node < 0:
+            return None
 
-MAX_FLOAT = float_info.max
+    length = 1
+    current = pred[node]
+    while current != node:
+        current = pred[current]
+        length += 1
+
+    ahead = start
+    for _ in range(length):
+        ahead = pred[ahead]
+    entry = start
+    while entry != ahead:
+        entry = pred[entry]
+        ahead = pred[ahead]
+
+    path = [entry]
+    for _ in range(length):
+        path.append(pred[path[-1]])
+    path.reverse()
+    return path
 
 class Edge():
-    """ An edge object to be used for arbitrage """
-
-    def __init__(self, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp):
-        self.xrate = xrate                      # exchange rate from the market, generally bid or 1/ask
-        self.weight = weight                    # edge weight used for neg cycle detection, -log(xrate)
-        self.vol = vol                          # volume associated with bid or ask price
-        self.vol_sym = vol_sym                  # currency which the volume is in terms of
-        self.pair = pair
-        self.ab = ab                            # ask or buy price
-        self.exch = exch                        # echange for which this edge comes from
-        self.timestamp = timestamp
+    """
+    An edge object to be used for arbitrage
+
+    Edges do not own any data, they are a view into the arrays of the graph they belong to, so
+    reading or writing through an edge reads or writes the graph directly.
+    """
+    __slots__ = ('_graph', '_src', '_dest')
+
+    def __init__(self, graph, src, dest):
+        self._graph = graph
+        self._src = src                         # index of the source node
+        self._dest = dest                       # index of the destination node
+
+    def _meta(self, idx):
+        return self._graph._meta[self._src, self._dest][idx]
+
+    def _setMeta(self, idx, value):
+        meta = list(self._graph._meta[self._src, self._dest])
+        meta[idx] = value
+        self._graph._meta[self._src, self._dest] = tuple(meta)
+
+    @property
+    def xrate(self):                            # exchange rate from the market, generally bid or 1/ask
+        return float(self._graph._xrates[self._src, self._dest])
+
+    @property
+    def weight(self):                           # edge weight used for neg cycle detection, -log(xrate)
+        return float(self._graph._weights[self._src, self._dest])
+
+    @property
+    def vol(self):                              # volume associated with bid or ask price
+        return float(self._graph._vols[self._src, self._dest])
+
+    @property
+    def vol_sym(self):                          # currency which the volume is in terms of
+        return self._meta(0)
+
+    @property
+    def pair(self):
+        return self._meta(1)
+
+    @property
+    def ab(self):                               # ask or buy price
+        return self._meta(2)
+
+    @property
+    def exch(self):                             # echange for which this edge comes from
+        return self._meta(3)
+
+    @property
+    def timestamp(self):
+        return float(self._graph._timestamps[self._src, self._dest])
+
+    @property
+    def stale(self):                            # stale edges are kept but ignored for cycle detection
+        return bool(self._graph._stale[self._src, self._dest])
 
     # Getters and Setters
     def getExchangeRate(self):
         return self.xrate
     def setExchangeRate(self, xrate):           # Note: Exchange rate and weight should always be changed together
-        self.xrate = xrate                      # because weight is a derivative of exhange rate
+        self._graph._xrates[self._src, self._dest] = xrate  # because weight is a derivative of exhange rate
+        self._graph._version += 1
 
     def getWeight(self):
         return self.weight
     def setWeight(self, weight):
-        self.weight = weight
-    
+        self._graph._weights[self._src, self._dest] = weight
+        self._graph._changed.add((self._src, self._dest))
+        self._graph._version += 1
+
     def getVolume(self):
         return self.vol
     def setVolume(self, vol):
-        self.vol = vol
+        self._graph._vols[self._src, self._dest] = vol
 
     def getVolumeSymbol(self):
         return self.vol_sym
     def setVolumeSymbol(self, vol_sym):
-        self.vol_sym = vol_sym
-    
+        self._setMeta(0, vol_sym)
+
     def getPair(self):
         return self.pair
     def setPair(self, pair):
-        self.pair = pair
+        self._setMeta(1, pair)
 
     def getAskOrBid(self):
         return self.ab
     def setAskOrBid(self, ab):
-        self.ab = ab
+        self._setMeta(2, ab)
 
     def Volume(self):
         return (self.vol, self.vol_sym)
@@ -63,108 +153,397 @@ class Edge():
     def getTimestamp(self):
         return self.timestamp
 
+    def getLatency(self):
+        """ Returns how long in seconds it takes for this edge to complete, i.e. moving funds between exchanges """
+        return float(self._graph._latencies[self._src, self._dest])
+
+    def getLevels(self):
+        """ Returns a (K, 2) array of the (xrate, vol) of each level of the book, best first """
+        return self._graph._levels[self._src, self._dest]
+
+    def isStale(self):
+        return self.stale
+
+    def isExpired(self):
+        """ Whether the edge was older than the graph's max age the last time expired edges were checked """
+        return bool(self._graph._expired[self._src, self._dest])
+
+    def getAge(self, now: int = None):
+        """ Returns how many milliseconds old the edge is, now defaults to utils.monotonicMs() """
+        return (monotonicMs() if now is None else now) - self.timestamp
+
 class Graph():
-    """ A graph data structure represented as a 2D Dictionary"""
+    """
+    A graph data structure represented as an adjacency matrix
+
+    Node i and node j are connected if _present[i, j] is set, in which case _weights[i, j], _xrates[i, j],
+    _vols[i, j] and _timestamps[i, j] describe the edge. Missing edges have a weight of infinity so they
+    never win a relaxation. Edges flagged in _stale are kept around, but are treated as missing when
+    searching for cycles. _version is bumped on every write, so anything derived from the edges can tell
+    when it is out of date.
+
+    Timestamps are milliseconds on the monotonic clock. With a max age set, edges older than it are flagged
+    in _expired, which like _stale hides them from cycle detection without removing them, until a newer
+    quote for the edge comes in.
+    """
 
     def __init__(self):
-        self.G = {}
+        self._nodes = []                        # index -> node
+        self._index = {}                        # node -> index
+        self._changed = set()                   # (src, dest) indices of edges whose weight changed
+        self._version = 0
+        self._maxAge = None                     # milliseconds, edges older than this are expired
+        self._allocate(INITIAL_CAPACITY)
+
+    def _allocate(self, capacity):
+        """ (Re)allocate the edge arrays with the given capacity, keeping any existing edges """
+        weights = np.full((capacity, capacity), np.inf)
+        xrates = np.zeros((capacity, capacity))
+        vols = np.zeros((capacity, capacity))
+        timestamps = np.zeros((capacity, capacity))
+        latencies = np.zeros((capacity, capacity))
+        present = np.zeros((capacity, capacity), dtype=bool)
+        stale = np.zeros((capacity, capacity), dtype=bool)
+        expired = np.zeros((capacity, capacity), dtype=bool)
+        meta = np.empty((capacity, capacity), dtype=object)
+        levels = np.empty((capacity, capacity), dtype=object)
+
+        n = len(self._nodes)
+        if n:
+            weights[:n, :n] = self._weights[:n, :n]
+            xrates[:n, :n] = self._xrates[:n, :n]
+            vols[:n, :n] = self._vols[:n, :n]
+            timestamps[:n, :n] = self._timestamps[:n, :n]
+            latencies[:n, :n] = self._latencies[:n, :n]
+            present[:n, :n] = self._present[:n, :n]
+            stale[:n, :n] = self._stale[:n, :n]
+            expired[:n, :n] = self._expired[:n, :n]
+            meta[:n, :n] = self._meta[:n, :n]
+            levels[:n, :n] = self._levels[:n, :n]
+
+        self._weights = weights
+        self._xrates = xrates
+        self._vols = vols
+        self._timestamps = timestamps
+        self._latencies = latencies
+        self._present = present
+        self._stale = stale
+        self._expired = expired
+        self._meta = meta                       # (vol_sym, pair, ab, exch) for each edge
+        self._levels = levels                   # (K, 2) array of (xrate, vol) book levels for each edge
 
     def addNode(self, name) -> bool:
         """ Add a node to the graph, if the node already exists, return false """
-        if name in self.G:
-            print("Node already exists!")
+        if name in self._index:
+            log.debug("Node %s already exists", name)
             return False
-        else:
-            self.G[name] = {}
+        if len(self._nodes) == self._weights.shape[0]:
+            self._allocate(2 * self._weights.shape[0])
+        self._index[name] = len(self._nodes)
+        self._nodes.append(name)
         return True
 
-    def addEdge(self, src, dest, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp) -> bool:
-        """ Add an edge to the graph """
-        if src not in self.G:
-            print("Source node ({}) does not exist!".format(src))
+    def addEdge(self, src, dest, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp, levels=None, latency=0.0) -> bool:
+        """
+        Add an edge to the graph
+
+        levels is a list of (xrate, vol) for each level of the book, best first. If it isn't given the
+        edge has a single level made from xrate and vol. latency is how long in seconds the edge takes
+        to complete, which is 0 for trades.
+        """
+        if src not in self._index:
+            log.warning("Source node (%s) does not exist", src)
             return False
-        if dest not in self.G:
-            print("Destination node ({}) does not exist!".format(dest))
+        if dest not in self._index:
+            log.warning("Destination node (%s) does not exist", dest)
             return False
-        if dest not in self.G[src]:
-            self.G[src][dest] = Edge(xrate, weight, vol, vol_sym, pair, ab, exch, timestamp)
-        elif timestamp > self.G[src][dest].getTimestamp():
-            # If the given edge is newer than the existing, replace it, no questions asked
-            self.G[src][dest] = Edge(xrate, weight, vol, vol_sym, pair, ab, exch, timestamp)
+        i = self._index[src]
+        j = self._index[dest]
+        if not self._present[i, j] or self._stale[i, j]:
+            self._setEdge(i, j, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp, levels, latency)
+        elif timestamp > self._timestamps[i, j] or (timestamp == self._timestamps[i, j] and exch == self._meta[i, j][3]):
+            # If the given edge is newer than the existing, or a fresh quote from the same exchange, replace it
+            self._setEdge(i, j, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp, levels, latency)
             return True
-        elif weight < self.G[src][dest].getWeight():
+        elif weight < self._weights[i, j]:
             # An edge already exists with the same timestamp, but we found an edge with a lower weight!
-            self.G[src][dest] = Edge(xrate, weight, vol, vol_sym, pair, ab, exch, timestamp)
+            self._setEdge(i, j, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp, levels, latency)
             return True
         # If we reach here it means the edge we were trying to update is from the same cycle
         # and we already had an edge that was cheaper
         return False
-    
+
+    def _setEdge(self, i, j, xrate, weight, vol, vol_sym, pair, ab, exch, timestamp, levels, latency):
+        """ Write an edge into the arrays in place """
+        if not self._present[i, j] or self._stale[i, j] or weight != self._weights[i, j]:
+            self._changed.add((i, j))
+        self._version += 1
+        self._present[i, j] = True
+        self._stale[i, j] = False
+        self._weights[i, j] = weight
+        self._xrates[i, j] = xrate
+        self._vols[i, j] = vol
+        self._timestamps[i, j] = timestamp
+        self._latencies[i, j] = latency
+        self._meta[i, j] = (vol_sym, pair, ab, exch)
+        if levels is None:
+            levels = ((xrate, vol),)
+        self._setLevels(i, j, levels)
+
+    def _setLevels(self, i, j, levels):
+        """
+        Copies book levels into the edge's own (K, 2) array, reusing it when the depth hasn't changed so a
+        tick doesn't allocate a new array for every edge. The edge never keeps a reference to levels itself
+        """
+        current = self._levels[i, j]
+        levels = np.asarray(levels, dtype=float)
+        if current is not None and current.size == levels.size:
+            current.flat[:] = levels.flat
+        else:
+            self._levels[i, j] = levels.reshape(-1, 2).copy()
+
+    def merge(self, other, mapNode=None) -> int:
+        """
+        Merges every edge of another graph into this one in a single vectorized pass, with the same rules
+        as calling addEdge for each fresh edge and markStale (for the same exchange) for each stale one.
+        mapNode maps a node of the other graph to ours, edges between nodes we don't have are skipped.
+        Returns the number of edges written.
+        """
+        n = len(other._nodes)
+        names = other._nodes if mapNode is None else [mapNode(node) for node in other._nodes]
+        index = np.array([self._index.get(name, -1) for name in names], dtype=int).reshape(-1)
+        src, dest = np.nonzero(other._present[:n, :n])
+        i, j = index[src], index[dest]
+        known = (i >= 0) & (j >= 0)
+        if not known.all():
+            log.debug("Skipping %d edges between nodes missing from the graph", int((~known).sum()))
+            src, dest, i, j = src[known], dest[known], i[known], j[known]
+        if not len(src):
+            return 0
+
+        present = self._present[i, j]
+        stale = self._stale[i, j]
+        oldWeights = self._weights[i, j]
+        oldTimestamps = self._timestamps[i, j]
+        weights = other._weights[src, dest]
+        timestamps = other._timestamps[src, dest]
+        incomingStale = other._stale[src, dest]
+        oldMeta = self._meta[i, j]
+        meta = other._meta[src, dest]
+        sameExchange = np.fromiter((a is not None and a[3] == b[3] for a, b in zip(oldMeta, meta)),
+                                   dtype=bool, count=len(meta))
+
+        fresh = ~present | stale
+        write = ~incomingStale & (fresh | (timestamps > oldTimestamps)
+                                  | ((timestamps == oldTimestamps) & sameExchange) | (weights < oldWeights))
+        expire = incomingStale & present & ~stale & sameExchange
+
+        ei, ej = i[expire], j[expire]
+        self._stale[ei, ej] = True
+        changed = expire.copy()
+
+        ws, wd, wi, wj = src[write], dest[write], i[write], j[write]
+        changed |= write & (fresh | (weights != oldWeights))
+        self._present[wi, wj] = True
+        self._stale[wi, wj] = False
+        self._weights[wi, wj] = weights[write]
+        self._xrates[wi, wj] = other._xrates[ws, wd]
+        self._vols[wi, wj] = other._vols[ws, wd]
+        self._timestamps[wi, wj] = timestamps[write]
+        self._latencies[wi, wj] = other._latencies[ws, wd]
+        self._meta[wi, wj] = meta[write]
+        for a, b, s, d in zip(wi.tolist(), wj.tolist(), ws.tolist(), wd.tolist()):
+            self._setLevels(a, b, other._levels[s, d])
+
+        self._changed.update(zip(i[changed].tolist(), j[changed].tolist()))
+        if changed.any() or write.any():
+            self._version += 1
+        return int(write.sum())
+
     def getEdge(self, a, b):
         """ Get the edge from a to b """
-        if b not in self.G[a]:
-            print("Edge between {0} and {1} does not exist!".format(a, b))
+        i = self._index[a]
+        j = self._index[b]
+        if not self._present[i, j]:
+            log.debug("Edge between %s and %s does not exist", a, b)
             return
         else:
-            return self.G[a][b]
+            return Edge(self, i, j)
+
+    def markStale(self, src, dest, exch=None) -> bool:
+        """
+        Flag the edge from src to dest as stale so it is ignored when searching for cycles, until it gets
+        updated again. If an exchange is given the edge is only flagged if it came from that exchange.
+        """
+        i = self._index[src]
+        j = self._index[dest]
+        if not self._present[i, j] or self._stale[i, j]:
+            return False
+        if exch is not None and self._meta[i, j][3] != exch:
+            return False
+        self._stale[i, j] = True
+        self._changed.add((i, j))
+        self._version += 1
+        return True
 
     def getEdges(self):
         """ Get a list of the edges in the graph """
-        return list([(src, dest, self.G[src][dest]) for src in self.G.keys() for dest in self.G[src].keys()])
+        return list([(self._nodes[i], self._nodes[j], Edge(self, i, j)) for i, j in self._edgeIndices()])
 
+    def _edgeIndices(self):
+        """ Returns an (E, 2) array of the (src, dest) indices of every edge in the graph """
+        n = len(self._nodes)
+        return np.argwhere(self._present[:n, :n])
 
     def getNodes(self) -> List[str]:
         """" Returns a list of all the nodes in the graph """
-        return list(self.G.keys())
+        return list(self._nodes)
 
     def getWeights(self) -> List[Tuple[str, str, float]]:
         """ Returns a list of tuples in the following format (first node, second node, arbitrage weight) """
-        return list([(src, dest, self.G[src][dest].getWeight()) for src in self.G.keys() for dest in self.G[src].keys()])
+        return list([(self._nodes[i], self._nodes[j], float(self._weights[i, j])) for i, j in self._edgeIndices()])
 
-    def print(self):
+    def popChangedEdges(self):
+        """ Returns a (k, 2) array of the (src, dest) indices of every edge changed since the last call """
+        self.expireEdges()
+        changed = np.array(sorted(self._changed), dtype=int).reshape(-1, 2)
+        self._changed.clear()
+        return changed
+
+    def version(self) -> int:
+        """ Returns a counter which changes every time an edge is added, updated or marked stale """
+        return self._version
+
+    def hasNode(self, node) -> bool:
+        return node in self._index
+
+    def indexOf(self, node) -> int:
+        """ Returns the integer index of a node """
+        return self._index[node]
+
+    def nodeAt(self, idx):
+        """ Returns the node stored at an integer index """
+        return self._nodes[idx]
+
+    def setMaxAge(self, maxAge: int = None) -> None:
+        """ Edges older than maxAge milliseconds are left out of cycle detection, None keeps them forever """
+        self._maxAge = maxAge
+        self.expireEdges()
+
+    def expireEdges(self, now: int = None) -> int:
+        """
+        Recomputes which edges are older than the max age as of now, which defaults to utils.monotonicMs().
+        Edges which expired, or came back with a newer quote, since the last check count as changed.
+        Returns how many edges are expired
+        """
+        n = len(self._nodes)
+        if self._maxAge is None:
+            if not self._expired[:n, :n].any():
+                return 0
+            expired = np.zeros((n, n), dtype=bool)
+        else:
+            cutoff = (monotonicMs() if now is None else now) - self._maxAge
+            expired = self._present[:n, :n] & (self._timestamps[:n, :n] < cutoff)
+        flipped = np.argwhere(expired != self._expired[:n, :n])
+        if len(flipped):
+            self._expired[:n, :n] = expired
+            self._changed.update(map(tuple, flipped.tolist()))
+            self._version += 1
+        return int(expired.sum())
+
+    def pathAges(self, path, now: int = None) -> List[int]:
+        """ Returns the age in milliseconds of every edge along a path, edges stamped in the future are 0 """
+        now = monotonicMs() if now is None else now
+        return [int(max(now - self._timestamps[self._index[a], self._index[b]], 0)) for a, b in zip(path, path[1:])]
+
+    def weightMatrix(self):
+        """ Returns the (V, V) matrix of edge weights, missing, stale and expired edges have a weight of infinity """
+        self.expireEdges()
+        n = len(self._nodes)
+        return np.where(self._stale[:n, :n] | self._expired[:n, :n], np.inf, self._weights[:n, :n])
+
+    def xrateMatrix(self):
+        """ Returns the (V, V) matrix of exchange rates, missing, stale and expired edges have a rate of 0 """
+        self.expireEdges()
+        n = len(self._nodes)
+        return np.where(self._present[:n, :n] & ~self._stale[:n, :n] & ~self._expired[:n, :n], self._xrates[:n, :n], 0.0)
+
+    def toString(self) -> str:
         """ String representation of the graph """
-        for src in self.G.keys():
-            print("{}:".format(src))
-            for dest in self.G[src].keys():
-                print("\t{0} -- weight: {1} on {2} --> {3}".format(src, self.G[src][dest].getWeight(), 
-                                                                   self.G[src][dest].getExchange(), dest)
-                    )
+        lines = []
+        for src in self._nodes:
+            lines.append("{}:".format(src))
+            i = self._index[src]
+            for j in np.flatnonzero(self._present[i, :len(self._nodes)]):
+                lines.append("\t{0} -- weight: {1} on {2} --> {3}".format(src, self._weights[i, j],
+                                                                         self._meta[i, j][3], self._nodes[j]))
+        return "\n".join(lines)
 
-    def traceback(self, start, preds):
-        """ Given a starting node and a dictionary of predecessors, performs a traceback to ID a negative loop """
-        traveled = {node: False for node in self.G.keys()}
-        path = []
+    def print(self):
+        """ Print the string representation of the graph """
+        print(self.toString())
 
-        def aux(start, traveled, preds, path):
-            if traveled[start] == True:
-                path.append(start)
-                return list(reversed(path))
-            else:
-                traveled[start] = True
-                path.append(start)
-                return aux(preds[start], traveled, preds, path)
+    def traceback(self, start, preds):
+        """
+        Given a starting node and a dictionary of node -> predecessor, returns the loop the predecessors run into
+        as [first node of the loop reached from start, ..., that node again], or None if they don't form one
+        """
+        pred = [self._index.get(preds.get(node), -1) for node in self._nodes]
+        cycle = tracebackCycle(pred, self._index[start])
+        return [self._nodes[idx] for idx in cycle] if cycle else None
 
-        return aux(start, traveled, preds, path)
+    def negativeCycles(self, maxLength: int, search=None):
+        """
+        Returns a list of (path, weight) tuples for every distinct negative cycle with at most maxLength edges.
+        Rotations of the same loop are only returned once. If a ParallelCycleSearch is given the search is
+        split across its worker processes.
+        """
+        weights = self.weightMatrix()
+        cycles = search.search(weights, maxLength) if search else enumerateNegativeCycles(weights, maxLength)
+        return list([([self._nodes[idx] for idx in cycle], weight) for cycle, weight in cycles])
 
     def BellmanFordWithTraceback(self, src):
-        """ Perform Bellman-Ford on graph and test for negative cycle """
+        """
+        Perform Bellman-Ford on graph and test for negative cycle
+
+        Each pass relaxes every edge at once, dist[:, None] + W is the distance to every node through
+        every possible predecessor, so the column minimum is the best new distance for each node.
+        Stops early once a pass no longer improves any distance.
+        """
+        if src not in self._index:
+            return None
 
         # Initalize distance to all nodes to be infinity, then set distance to souce node to be 0
-        dist = {node: MAX_FLOAT for node in self.G.keys()}
-        pred = {node: None for node in self.G.keys()}
-        dist[src] = 0
-        num_nodes = len(self.G.keys())
+        num_nodes = len(self._nodes)
+        weights = self.weightMatrix()
+        dist = np.full(num_nodes, np.inf)
+        pred = np.full(num_nodes, -1)
+        dist[self._index[src]] = 0
+        columns = np.arange(num_nodes)
 
         # Find shortest path
-        for _ in range (num_nodes - 1):
-            for u, v, w, in self.getWeights():
-                if dist[u] != MAX_FLOAT and dist[u] + w < dist[v]:
-                    dist[v] = dist[u] + w
-                    pred[v] = u
-       
-        # This is a really slow way to find negative cycles, but ya gotta start somewhere
-        # Loop for number of edges
-        for u, v, w in self.getWeights():
-            if dist[u] != MAX_FLOAT and dist[u] + w + 0.001 < dist[v]:
-                print("Graph contains a negative cycle!")
-                return self.traceback(v, pred)
+        for _ in range(num_nodes - 1):
+            through = dist[:, None] + weights
+            best = through.argmin(axis=0)
+            candidate = through[best, columns]
+            improved = candidate < dist
+            if not improved.any():
+                break
+            dist[improved] = candidate[improved]
+            pred[improved] = best[improved]
+
+        # Any edge that can still be relaxed is part of, or leads out of, a negative cycle
+        violations = np.argwhere(dist[:, None] + weights + 0.001 < dist[None, :])
+        if not len(violations):
+            return None
+
+        log.debug("Graph contains a negative cycle")
+        u, v = violations[0]
+        pred[v] = u
+        # Walk back far enough that we are guaranteed to be on the cycle itself
+        for _ in range(num_nodes):
+            if pred[v] < 0:
+                return None
+            v = pred[v]
+        cycle = tracebackCycle(pred, v)
+        return [self._nodes[idx] for idx in cycle] if cycle else None
@@ -0,0 +1,142 @@
+import random
+import unittest
+from graph import Graph, tracebackCycle
+from incremental_detector import IncrementalDetector
+from math import log
+from utils import monotonicMs
+
+def buildGraph(rates):
+    """ Builds a graph from a map of (src, dest) -> exchange rate """
+    graph = Graph()
+    for (src, dest) in rates.keys():
+        for node in (src, dest):
+            if node not in graph.getNodes():
+                graph.addNode(node)
+    for (src, dest), xrate in rates.items():
+        graph.addEdge(src, dest, xrate, -log(xrate, 2), 1.0, src, (src, dest), 'bid', 'test', 0)
+    return graph
+
+def recursiveTraceback(start, preds):
+    """ The original recursive traceback followed by trimming the path, kept to check tracebackCycle against """
+    traveled = {node: False for node in preds}
+    path = []
+
+    def aux(start):
+        if traveled[start]:
+            path.append(start)
+            return list(reversed(path))
+        traveled[start] = True
+        path.append(start)
+        return aux(preds[start])
+
+    path = aux(start)
+    while not path[-1] == path[0]:
+        path.remove(path[-1])
+    return path
+
+class TestGraph(unittest.TestCase):
+    def test_addEdge(self):
+        graph = buildGraph({('USD', 'EUR'): 0.8, ('EUR', 'USD'): 1.2})
+        edge = graph.getEdge('USD', 'EUR')
+        self.assertEqual(edge.getExchangeRate(), 0.8)
+        self.assertEqual(edge.getPair(), ('USD', 'EUR'))
+        self.assertIsNone(graph.getEdge('USD', 'USD'))
+
+    def test_addEdgeKeepsNewestThenCheapest(self):
+        graph = buildGraph({('USD', 'EUR'): 0.8})
+        self.assertFalse(graph.addEdge('USD', 'EUR', 0.7, -log(0.7, 2), 1.0, 'USD', ('USD', 'EUR'), 'bid', 'other', 0))
+        self.assertTrue(graph.addEdge('USD', 'EUR', 0.9, -log(0.9, 2), 1.0, 'USD', ('USD', 'EUR'), 'bid', 'other', 0))
+        self.assertTrue(graph.addEdge('USD', 'EUR', 0.5, -log(0.5, 2), 1.0, 'USD', ('USD', 'EUR'), 'bid', 'newer', 1))
+        self.assertEqual(graph.getEdge('USD', 'EUR').getExchange(), 'newer')
+
+    def test_growsPastInitialCapacity(self):
+        rates = {(str(i), str(i + 1)): 1.0 for i in range(20)}
+        graph = buildGraph(rates)
+        self.assertEqual(len(graph.getNodes()), 21)
+        self.assertEqual(len(graph.getEdges()), 20)
+        self.assertEqual(graph.getEdge('0', '1').getExchangeRate(), 1.0)
+
+    def test_tracebackMatchesRecursive(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            n = rng.randint(1, 30)
+            pred = [rng.randrange(n) for _ in range(n)]
+            start = rng.randrange(n)
+            self.assertEqual(tracebackCycle(pred, start), recursiveTraceback(start, dict(enumerate(pred))))
+
+    def test_tracebackDeepChain(self):
+        n = 20000                               # far past the recursion limit
+        pred = [n - 1] + list(range(n - 1))     # i <- i - 1, so the whole graph is one loop
+        cycle = tracebackCycle(pred, n // 2)
+        self.assertEqual(len(cycle), n + 1)
+        self.assertEqual(cycle[0], cycle[-1])
+        self.assertIsNone(tracebackCycle([-1, 0, 1], 2))
+
+    def test_expiry(self):
+        graph = buildGraph({('USD', 'EUR'): 0.8, ('EUR', 'BTC'): 2.0, ('BTC', 'USD'): 0.8})
+        detector = IncrementalDetector(graph)
+        self.assertIsNotNone(detector.update())
+        now = monotonicMs()
+        graph.addEdge('USD', 'EUR', 0.8, -log(0.8, 2), 1.0, 'USD', ('USD', 'EUR'), 'bid', 'test', now)
+        graph.addEdge('EUR', 'BTC', 2.0, -log(2.0, 2), 1.0, 'EUR', ('EUR', 'BTC'), 'bid', 'test', now - 5000)
+
+        graph.setMaxAge(1000)                   # BTC -> USD was stamped at 0, EUR -> BTC 5 seconds ago
+        self.assertTrue(graph.getEdge('BTC', 'USD').isExpired())
+        self.assertFalse(graph.getEdge('USD', 'EUR').isExpired())
+        self.assertIsNone(detector.update())
+        self.assertEqual(graph.negativeCycles(maxLength=3), [])
+        self.assertEqual(graph.pathAges(['USD', 'EUR', 'BTC'], now=now + 10), [10, 5010])
+
+        # A fresh quote brings the edge back without rebuilding anything
+        graph.addEdge('BTC', 'USD', 0.8, -log(0.8, 2), 1.0, 'BTC', ('BTC', 'USD'), 'bid', 'test', now)
+        graph.addEdge('EUR', 'BTC', 2.0, -log(2.0, 2), 1.0, 'EUR', ('EUR', 'BTC'), 'bid', 'test', now)
+        self.assertIsNotNone(detector.update())
+        graph.setMaxAge(None)
+        self.assertEqual(graph.expireEdges(), 0)
+
+    def test_merge(self):
+        graph = buildGraph({('USD', 'EUR'): 0.8, ('EUR', 'USD'): 1.2})
+        market = buildGraph({('USD', 'EUR'): 0.9, ('EUR', 'USD'): 1.1, ('USD', 'BTC'): 0.1})
+        market.markStale('EUR', 'USD')
+        self.assertEqual(graph.merge(market), 1)                # USD -> BTC is skipped, we don't have BTC
+        self.assertEqual(graph.getEdge('USD', 'EUR').getExchangeRate(), 0.9)
+        self.assertTrue(graph.getEdge('EUR', 'USD').isStale())
+
+        levels = graph.getEdge('USD', 'EUR').getLevels()
+        market.addEdge('USD', 'EUR', 0.7, -log(0.7, 2), 2.0, 'USD', ('USD', 'EUR'), 'bid', 'test', 1)
+        graph.merge(market)
+        self.assertIs(graph.getEdge('USD', 'EUR').getLevels(), levels)  # updated in place
+        self.assertEqual(levels.tolist(), [[0.7, 2.0]])
+        self.assertIsNot(levels, market.getEdge('USD', 'EUR').getLevels())
+
+    def test_BellmanFordNoCycle(self):
+        graph = buildGraph({('USD', 'EUR'): 0.8, ('EUR', 'USD'): 1.2, ('EUR', 'BTC'): 0.0002, ('BTC', 'EUR'): 4000})
+        self.assertIsNone(graph.BellmanFordWithTraceback('USD'))
+
+    def test_BellmanFordFindsCycle(self):
+        graph = buildGraph({
+            ('USD', 'EUR'): 0.8, ('EUR', 'USD'): 1.2,
+            ('EUR', 'BTC'): 0.0002, ('BTC', 'EUR'): 4000,
+            ('BTC', 'USD'): 6500, ('USD', 'BTC'): 0.00015,
+        })
+        path = graph.BellmanFordWithTraceback('USD')
+        self.assertEqual(path[0], path[-1])
+        product = 1
+        for a, b in zip(path, path[1:]):
+            product *= graph.getEdge(a, b).getExchangeRate()
+        self.assertGreater(product, 1)
+
+    def test_negativeCyclesDeduplicatesRotations(self):
+        graph = buildGraph({
+            ('USD', 'EUR'): 0.8, ('EUR', 'USD'): 1.2,
+            ('EUR', 'BTC'): 0.0002, ('BTC', 'EUR'): 4000,
+            ('BTC', 'USD'): 6500, ('USD', 'BTC'): 0.00015,
+        })
+        cycles = graph.negativeCycles(maxLength=3)
+        loops = [frozenset(zip(path, path[1:])) for path, weight in cycles]
+        self.assertEqual(len(loops), len(set(loops)))
+        self.assertIn(frozenset([('USD', 'EUR'), ('EUR', 'BTC'), ('BTC', 'USD')]), loops)
+        self.assertTrue(all(weight < 0 for path, weight in cycles))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Incremental negative cycle detection for the arbitrage graph
+
+Between ticks only a handful of edges change, so instead of re-running Bellman-Ford from scratch we keep
+a set of shortest-path potentials from the previous tick. A potential p is feasible when
+p[v] <= p[u] + w(u, v) for every edge, which is only possible if the graph has no negative cycle.
+Raising an edge weight can never break feasibility, so on each update we only have to re-relax the
+nodes reachable from edges whose weight went down. Any new negative cycle has to pass through one of
+those edges and shows up as a loop in the predecessor pointers while we relax.
+
+Author: Parker Timmerman
+"""
+import numpy as np
+
+from collections import deque
+from graph import Graph
+
+class IncrementalDetector():
+    """ Finds negative cycles in a graph, doing work proportional to what changed since the last update """
+
+    def __init__(self, graph: Graph, tolerance: float = 0.001):
+        self._graph = graph
+        self._tolerance = tolerance             # same slack Graph.BellmanFordWithTraceback allows
+        self._potentials = None
+        self._preds = None
+        self._needsFullScan = True
+
+    def update(self):
+        """
+        Public method to check the graph for a negative cycle after some of its edges changed
+
+        Returns the cycle as a list of nodes which starts and ends on the same node, or None
+        """
+        changed = self._graph.popChangedEdges()
+        if self._needsFullScan or len(self._potentials) != len(self._graph.getNodes()):
+            return self.fullScan()
+        if not len(changed):
+            return None
+        return self._relaxFrom(changed)
+
+    def fullScan(self):
+        """
+        Recompute the potentials from scratch using Bellman-Ford from a virtual source which has a zero
+        weight edge to every node, so every node starts with a potential of 0.
+        """
+        weights = self._graph.weightMatrix()
+        num_nodes = weights.shape[0]
+        columns = np.arange(num_nodes)
+        self._potentials = np.zeros(num_nodes)
+        self._preds = np.full(num_nodes, -1)
+        self._needsFullScan = False
+        if not num_nodes:
+            return None
+
+        for _ in range(num_nodes):
+            through = self._potentials[:, None] + weights
+            best = through.argmin(axis=0)
+            candidate = through[best, columns]
+            improved = candidate + self._tolerance < self._potentials
+            if not improved.any():
+                return None
+            self._potentials[improved] = candidate[improved]
+            self._preds[improved] = best[improved]
+
+        # Still improving after V passes, so the predecessor pointers contain a negative cycle
+        self._needsFullScan = True
+        node = np.flatnonzero(improved)[0]
+        for _ in range(num_nodes):
+            if self._preds[node] < 0:
+                return None
+            node = self._preds[node]
+        return self._cycleThrough(node)
+
+    def _relaxFrom(self, changed):
+        """ Re-relax only the nodes reachable from the changed edges whose weight went down """
+        weights = self._graph.weightMatrix()
+        num_nodes = weights.shape[0]
+        src, dest = changed[:, 0], changed[:, 1]
+
+        # An edge whose weight went up can no longer be the tight edge into its destination
+        loosened = (self._preds[dest] == src) & (self._potentials[src] + weights[src, dest] > self._potentials[dest])
+        self._preds[dest[loosened]] = -1
+
+        queue = deque()
+        queued = np.zeros(num_nodes, dtype=bool)
+        relaxations = np.zeros(num_nodes, dtype=int)
+        violated = self._potentials[src] + weights[src, dest] + self._tolerance < self._potentials[dest]
+        for u, v in zip(src[violated], dest[violated]):
+            if self._potentials[u] + weights[u, v] + self._tolerance < self._potentials[v]:
+                cycle = self._relax(u, v, self._potentials[u] + weights[u, v])
+                if cycle:
+                    return cycle
+                if not queued[v]:
+                    queue.append(v)
+                    queued[v] = True
+
+        while queue:
+            u = queue.popleft()
+            queued[u] = False
+            candidate = self._potentials[u] + weights[u]
+            for v in np.flatnonzero(candidate + self._tolerance < self._potentials):
+                cycle = self._relax(u, v, candidate[v])
+                if cycle:
+                    return cycle
+                relaxations[v] += 1
+                if relaxations[v] > num_nodes:
+                    # Should never happen, but if the predecessors ever get out of sync fall back to a full scan
+                    return self.fullScan()
+                if not queued[v]:
+                    queue.append(v)
+                    queued[v] = True
+        return None
+
+    def _relax(self, u, v, potential):
+        """
+        Lower the potential of v through u. If v is already an ancestor of u then we just closed a loop
+        in the predecessor pointers, which is a negative cycle.
+        """
+        node = u
+        for _ in range(len(self._preds)):
+            if node == v:
+                self._preds[v] = u
+                cycle = self._cycleThrough(v)
+                if cycle:
+                    self._needsFullScan = True
+                    return cycle
+                break
+            node = self._preds[node]
+            if node < 0:
+                break
+        self._potentials[v] = potential
+        self._preds[v] = u
+        return None
+
+    def _cycleThrough(self, node):
+        """ Follows the predecessors from a node known to be on a cycle, returns the cycle if it is negative """
+        indices = [node]
+        current = self._preds[node]
+        while current != node:
+            if current < 0 or len(indices) > len(self._preds):
+                return None
+            indices.append(current)
+            current = self._preds[current]
+        indices.append(node)
+        indices.reverse()
+
+        weights = self._graph.weightMatrix()
+        total = sum(weights[a, b] for a, b in zip(indices, indices[1:]))
+        if total >= 0.0:
+            return None
+        return [self._graph.nodeAt(idx) for idx in indices]
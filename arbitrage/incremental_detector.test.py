@@ -0,0 +1,41 @@
+import unittest
+from graph import Graph
+from incremental_detector import IncrementalDetector
+from math import log
+
+def setRate(graph, src, dest, xrate, timestamp=0):
+    graph.addEdge(src, dest, xrate, -log(xrate, 2), 1.0, src, (src, dest), 'bid', 'test', timestamp)
+
+class TestIncrementalDetector(unittest.TestCase):
+    def setUp(self):
+        self.graph = Graph()
+        for node in ['USD', 'EUR', 'BTC']:
+            self.graph.addNode(node)
+        setRate(self.graph, 'USD', 'EUR', 0.8)
+        setRate(self.graph, 'EUR', 'USD', 1.2)
+        setRate(self.graph, 'EUR', 'BTC', 0.0002)
+        setRate(self.graph, 'BTC', 'EUR', 4000)
+        setRate(self.graph, 'BTC', 'USD', 6000)
+        setRate(self.graph, 'USD', 'BTC', 0.00016)
+        self.detector = IncrementalDetector(self.graph)
+
+    def test_noCycle(self):
+        self.assertIsNone(self.detector.update())
+        self.assertIsNone(self.detector.update())
+
+    def test_detectsCycleFromChangedEdge(self):
+        self.assertIsNone(self.detector.update())
+        setRate(self.graph, 'BTC', 'USD', 6500, timestamp=1)
+        path = self.detector.update()
+        self.assertEqual(path[0], path[-1])
+        self.assertIn('BTC', path)
+        self.assertIn('USD', path)
+
+    def test_cycleDisappears(self):
+        setRate(self.graph, 'BTC', 'USD', 6500, timestamp=1)
+        self.assertIsNotNone(self.detector.update())
+        setRate(self.graph, 'BTC', 'USD', 6000, timestamp=2)
+        self.assertIsNone(self.detector.update())
+
+if __name__ == '__main__':
+    unittest.main()
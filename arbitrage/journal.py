@@ -0,0 +1,202 @@
+"""
+Durable, append-only journal of everything that changes our books. Each entry is one line of JSON with an
+increasing sequence number. Writes are buffered and flushed to disk together by a background thread every
+syncInterval seconds, so a trade never waits on an fsync. Every snapshotEvery entries the owner is asked
+for a snapshot of its whole state, which is written atomically, and the journal starts a new segment so
+old segments can be deleted.
+
+Recovering is loading the newest snapshot and replaying the entries after it, no exchange API involved.
+
+Files in the journal directory:
+    snapshot.json           newest snapshot, {'seq': sequence number of the last entry in it, 'state': ...}
+    journal-<seq>.log       segment whose first entry has sequence number seq + 1
+
+Author: Parker Timmerman
+"""
+import glob
+import json
+import os
+import threading
+
+from constants import BS, Currency, Exchange, OrderType
+from my_types import Order
+from time import time
+
+SNAPSHOT_FILE = 'snapshot.json'
+SEGMENT_FORMAT = 'journal-{:012d}.log'
+
+def orderToDict(order: Order):
+    return {
+        'exchange': order.exchange.value,
+        'side': order.buyOrSell.value,
+        'type': order.orderType.value,
+        'pair': [order.pair[0].value, order.pair[1].value],
+        'price': order.price,
+        'volume': order.volume,
+    }
+
+def orderFromDict(entry) -> Order:
+    return Order(
+        exchange=Exchange(entry['exchange']),
+        buyOrSell=BS(entry['side']),
+        orderType=OrderType(entry['type']),
+        pair=(Currency(entry['pair'][0]), Currency(entry['pair'][1])),
+        price=entry['price'],
+        volume=entry['volume'],
+    )
+
+def _fsyncDirectory(directory: str) -> None:
+    """ Makes renames and new files in a directory durable, not every platform allows opening a directory """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class TradeJournal():
+    """ Append-only journal with batched fsync and periodic snapshots, safe to use from multiple threads """
+
+    def __init__(self, directory: str, syncInterval: float = 0.2, snapshotEvery: int = 1000):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._syncInterval = syncInterval
+        self._snapshotEvery = snapshotEvery
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._closed = False
+
+        segments = self._segments()
+        if segments:
+            self._repairTail(segments[-1])
+        self._seq = self._lastSequence()
+        self._sinceSnapshot = self._seq - self._snapshotSequence()
+        self._file = open(segments[-1] if segments else self._segmentPath(self._seq), 'a')
+
+        self._wakeup = threading.Event()
+        self._syncer = threading.Thread(target=self._syncLoop, name='journal', daemon=True)
+        self._syncer.start()
+
+    def _segments(self):
+        """ Returns the paths of every segment, oldest first """
+        return sorted(glob.glob(os.path.join(self._directory, 'journal-*.log')))
+
+    def _segmentPath(self, seq: int) -> str:
+        """ Path of the segment starting after seq """
+        return os.path.join(self._directory, SEGMENT_FORMAT.format(seq))
+
+    @staticmethod
+    def _repairTail(path: str) -> None:
+        """ Cuts off a partially written final line left by a crash, so new entries start on a fresh line """
+        with open(path, 'rb+') as fs:
+            data = fs.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                fs.truncate(end)
+
+    def _snapshotSequence(self) -> int:
+        snapshot = self.loadSnapshot()
+        return snapshot['seq'] if snapshot else 0
+
+    def _lastSequence(self) -> int:
+        seq = self._snapshotSequence()
+        for entry in self._readSegments():
+            seq = max(seq, entry['seq'])
+        return seq
+
+    def _readSegments(self):
+        """ Generator of every entry in every segment, a torn final line from a crash is skipped """
+        for path in self._segments():
+            with open(path) as fs:
+                for line in fs:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        break
+
+    def append(self, kind: str, **fields) -> int:
+        """ Appends an entry of the given kind, returns its sequence number. It is on disk within syncInterval """
+        with self._lock:
+            if self._closed:
+                raise ValueError('journal is closed')
+            self._seq += 1
+            entry = {'seq': self._seq, 'ts': time(), 'kind': kind}
+            entry.update(fields)
+            self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self._dirty = True
+            self._sinceSnapshot += 1
+            return self._seq
+
+    def snapshotDue(self) -> bool:
+        return self._sinceSnapshot >= self._snapshotEvery
+
+    def sync(self) -> None:
+        """
+        Flushes every appended entry to disk. Only handing the entries to the OS happens under the lock, the
+        fsync is on a duplicate of the file descriptor after it is released, so appends never wait on the disk
+        """
+        with self._lock:
+            if not self._dirty or self._closed:
+                return
+            self._file.flush()
+            fd = os.dup(self._file.fileno())    # stays open even if a snapshot starts a new segment meanwhile
+            self._dirty = False
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _syncLoop(self):
+        while not self._closed:
+            self._wakeup.wait(self._syncInterval)
+            self.sync()
+
+    def snapshot(self, state) -> None:
+        """
+        Writes state as the snapshot of everything journaled so far, then starts a new segment and deletes
+        the segments the snapshot covers. state must be JSON serializable
+        """
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+            seq = self._seq
+
+            path = os.path.join(self._directory, SNAPSHOT_FILE)
+            tmp = '{}.tmp'.format(path)
+            with open(tmp, 'w') as fs:
+                json.dump({'seq': seq, 'ts': time(), 'state': state}, fs, separators=(',', ':'))
+                fs.flush()
+                os.fsync(fs.fileno())
+            os.replace(tmp, path)
+
+            old = self._segments()
+            self._file.close()
+            self._file = open(self._segmentPath(seq), 'a')
+            _fsyncDirectory(self._directory)
+            for segment in old:
+                if segment != self._file.name:
+                    os.remove(segment)
+            self._sinceSnapshot = 0
+
+    def loadSnapshot(self):
+        """ Returns the newest snapshot as {'seq': ..., 'state': ...}, or None if there isn't one """
+        path = os.path.join(self._directory, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as fs:
+            return json.load(fs)
+
+    def entriesAfter(self, seq: int):
+        """ Returns every journaled entry with a sequence number above seq, in order """
+        return [entry for entry in self._readSegments() if entry['seq'] > seq]
+
+    def close(self) -> None:
+        self.sync()
+        with self._lock:
+            self._closed = True
+            self._file.close()
+        self._wakeup.set()
+        self._syncer.join()
@@ -0,0 +1,120 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from book_keeper import BookKeeper
+from constants import BS, Currency, Exchange, OrderType
+from journal import TradeJournal
+from my_types import Order
+from virtual_market import VirtualMarket
+
+CURRENCIES = [Currency.BTC, Currency.USDT]
+EXCHANGES = [Exchange.KRAKEN]
+
+def buy(volume):
+    return Order(Exchange.KRAKEN, BS.BUY, OrderType.LIMIT, (Currency.BTC, Currency.USDT), 10000.0, volume)
+
+class TestTradeJournal(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def test_appendAndRead(self):
+        journal = TradeJournal(self.directory)
+        self.assertEqual(journal.append('note', text='a'), 1)
+        self.assertEqual(journal.append('note', text='b'), 2)
+        journal.close()
+
+        journal = TradeJournal(self.directory)
+        self.assertEqual([entry['text'] for entry in journal.entriesAfter(1)], ['b'])
+        self.assertEqual(journal.append('note', text='c'), 3)
+        journal.close()
+
+    def test_tornTail(self):
+        journal = TradeJournal(self.directory)
+        journal.append('note', text='a')
+        journal.close()
+        segment = [name for name in os.listdir(self.directory) if name.startswith('journal-')][0]
+        with open(os.path.join(self.directory, segment), 'a') as fs:
+            fs.write('{"seq": 2, "ki')      # crashed halfway through a write
+
+        journal = TradeJournal(self.directory)
+        self.assertEqual(journal.append('note', text='b'), 2)
+        journal.close()
+        self.assertEqual([entry['text'] for entry in TradeJournal(self.directory).entriesAfter(0)], ['a', 'b'])
+
+    def test_appendDuringSync(self):
+        journal = TradeJournal(self.directory, syncInterval=60)
+        journal.append('note', text='a')
+        syncing = threading.Event()
+        release = threading.Event()
+        def slowFsync(fd):
+            syncing.set()
+            release.wait(timeout=5)
+        with mock.patch('journal.os.fsync', slowFsync):
+            sync = threading.Thread(target=journal.sync)
+            sync.start()
+            self.assertTrue(syncing.wait(timeout=5))
+            # The disk is still busy with the first entry, appending must not wait for it
+            appended = threading.Thread(target=journal.append, args=('note',), kwargs={'text': 'b'})
+            appended.start()
+            appended.join(timeout=1)
+            self.assertFalse(appended.is_alive())
+            release.set()
+            sync.join()
+        journal.close()
+        self.assertEqual([entry['text'] for entry in TradeJournal(self.directory).entriesAfter(0)], ['a', 'b'])
+
+class TestRecovery(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        VirtualMarket.initialize(CURRENCIES, EXCHANGES, [(Currency.BTC, Currency.USDT)])
+
+    def test_recoverFromSnapshotAndTail(self):
+        BookKeeper.initialize(CURRENCIES, EXCHANGES)
+        journal = TradeJournal(self.directory, snapshotEvery=3)
+        BookKeeper.instance().recover(journal)
+        BookKeeper.instance().updateAmounts(exch=Exchange.KRAKEN, amounts={Currency.USDT: 10000.0})
+        for volume in [0.1, 0.2]:
+            BookKeeper.instance().addOrder(trade=buy(volume))
+            BookKeeper.instance().reportOrder(order=buy(volume))
+        journal.close()
+        self.assertIsNotNone(TradeJournal(self.directory).loadSnapshot())
+
+        BookKeeper.initialize(CURRENCIES, EXCHANGES)
+        replayed = BookKeeper.instance().recover(TradeJournal(self.directory))
+        self.assertEqual(replayed, 2)           # the snapshot covers the first three entries
+        position = BookKeeper.instance().getPositions()[Exchange.KRAKEN]
+        self.assertAlmostEqual(position[Currency.BTC].amt, 0.3)
+        self.assertAlmostEqual(position[Currency.USDT].amt, 7000.0)
+        self.assertEqual([trade.volume for trade in BookKeeper.instance().getTrades()], [0.1, 0.2])
+
+    def test_recoverAfterConcurrentWriters(self):
+        BookKeeper.initialize(CURRENCIES, EXCHANGES)
+        journal = TradeJournal(self.directory, snapshotEvery=5)
+        BookKeeper.instance().recover(journal)
+        BookKeeper.instance().updateAmounts(exch=Exchange.KRAKEN, amounts={Currency.USDT: 100000.0})
+
+        def report():
+            for _ in range(50):
+                BookKeeper.instance().reportOrder(order=buy(0.01))
+        switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)             # switch threads as often as possible to shake out races
+        threads = [threading.Thread(target=report) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(switchInterval)
+        journal.close()
+
+        # Every snapshot has to match the sequence it was written with, or recovery double counts orders
+        BookKeeper.initialize(CURRENCIES, EXCHANGES)
+        BookKeeper.instance().recover(TradeJournal(self.directory))
+        position = BookKeeper.instance().getPositions()[Exchange.KRAKEN]
+        self.assertAlmostEqual(position[Currency.BTC].amt, 2.0)
+        self.assertAlmostEqual(position[Currency.USDT].amt, 80000.0)
+
+if __name__ == '__main__':
+    unittest.main()
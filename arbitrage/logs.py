@@ -0,0 +1,89 @@
+"""
+Logging for everything in the arbitrage arm. Modules get a logger from getLogger(__name__) and log through
+the standard library, configure() then decides how much of it is kept and where it goes.
+
+Records are handed to a queue and formatted and written by a background thread, so a slow terminal or a
+backed up pipe never blocks the trading loop. Production runs should use the JSON lines sink, one compact
+object per record, which is cheap to write and easy to parse later.
+
+Until configure() is called only warnings and errors are shown, on stderr.
+
+Author: Parker Timmerman
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+ROOT = 'moneyman'
+HUMAN_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """ Formats a record as a single line of JSON, any fields passed with extra={'fields': {...}} are included """
+
+    def format(self, record) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+_listener = None
+_settings = {}
+
+def getLogger(name: str):
+    """ Returns the logger for a module, all of them live under the moneyman logger """
+    return logging.getLogger('{0}.{1}'.format(ROOT, name))
+
+def configure(level=logging.INFO, path: str = None, jsonLines: bool = False):
+    """
+    Sends every record at or above level to path, or stderr if no path is given, through a background
+    writer thread. With jsonLines set each record is written as one line of JSON, otherwise in a human
+    readable format. Calling configure again replaces the previous configuration.
+    """
+    global _listener, _settings
+    shutdown()
+    _settings = {'level': level, 'path': path, 'jsonLines': jsonLines}
+
+    if path:
+        sink = logging.FileHandler(path)
+    else:
+        sink = logging.StreamHandler(sys.stderr)
+    sink.setFormatter(JsonFormatter() if jsonLines else logging.Formatter(HUMAN_FORMAT))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger(ROOT)
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(level)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, sink)
+    _listener.start()
+
+def settings():
+    """
+    Returns the arguments of the last call to configure(), so a child process which doesn't inherit our
+    writer thread can configure its own the same way
+    """
+    return dict(_settings)
+
+def shutdown():
+    """ Writes out every queued record and stops the writer thread """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+atexit.register(shutdown)
@@ -0,0 +1,41 @@
+import json
+import logging
+import logs
+import os
+import tempfile
+import unittest
+
+class TestLogs(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'moneyman.log')
+
+    def tearDown(self):
+        logs.shutdown()
+
+    def test_jsonLines(self):
+        logs.configure(level=logging.INFO, path=self.path, jsonLines=True)
+        log = logs.getLogger('test')
+        log.debug("dropped %s", 1)
+        log.info("kept %s", 2, extra={'fields': {'growth': 1.5}})
+        logs.shutdown()
+
+        with open(self.path) as fs:
+            lines = fs.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        entry = json.loads(lines[0])
+        self.assertEqual(entry['msg'], 'kept 2')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'moneyman.test')
+        self.assertEqual(entry['growth'], 1.5)
+
+    def test_reconfigure(self):
+        logs.configure(level=logging.WARNING, path=self.path)
+        logs.configure(level=logging.DEBUG, path=self.path)
+        logs.getLogger('test').debug("once")
+        logs.shutdown()
+
+        with open(self.path) as fs:
+            self.assertEqual(fs.read().count('once'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+On-disk cache of exchange metadata, the markets and currencies ccxt loads, with their precision rules, and
+the pair lists we derive from them. That metadata changes rarely, so a restart can use the cached copy
+instead of downloading it again, and anything older than the TTL is refreshed in the background.
+
+The cache is a single JSON file:
+    {'version': CACHE_VERSION, 'entries': {key: {'fetched': time it was stored, 'value': ...}}}
+A file written by a different CACHE_VERSION is ignored, bump it whenever the shape of a value changes.
+
+Author: Parker Timmerman
+"""
+import json
+import os
+import threading
+
+from time import time
+
+CACHE_VERSION = 1
+DEFAULT_PATH = 'market_cache.json'
+DEFAULT_TTL = 24 * 60 * 60                      # seconds
+
+class MarketCache():
+    """ Versioned key -> JSON value store with a TTL, safe to use from multiple threads """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = DEFAULT_TTL):
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return {}
+        try:
+            with open(self._path) as fs:
+                data = json.load(fs)
+        except ValueError:
+            return {}                           # a corrupt cache is just an empty one
+        if data.get('version') != CACHE_VERSION:
+            return {}
+        return data.get('entries', {})
+
+    def _save(self) -> None:
+        tmp = '{}.tmp'.format(self._path)
+        with open(tmp, 'w') as fs:
+            json.dump({'version': CACHE_VERSION, 'entries': self._entries}, fs, default=str)
+        os.replace(tmp, self._path)
+
+    def get(self, key: str):
+        """ Returns (value, isFresh) for a key, or None if it isn't cached """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return (entry['value'], time() - entry['fetched'] < self._ttl)
+
+    def put(self, key: str, value) -> None:
+        """ Stores a JSON serializable value under a key and writes the cache out """
+        with self._lock:
+            self._entries[key] = {'fetched': time(), 'value': value}
+            self._save()
+
+    def invalidate(self, key: str = None) -> None:
+        """ Forget a key, or everything if no key is given """
+        with self._lock:
+            if key is None:
+                self._entries = {}
+            else:
+                self._entries.pop(key, None)
+            self._save()
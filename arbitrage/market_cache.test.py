@@ -0,0 +1,35 @@
+import json
+import os
+import tempfile
+import unittest
+from market_cache import CACHE_VERSION, MarketCache
+
+class TestMarketCache(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'market_cache.json')
+
+    def test_persists(self):
+        MarketCache(self.path).put('pairs', [['ETH', 'BTC']])
+        self.assertEqual(MarketCache(self.path).get('pairs'), ([['ETH', 'BTC']], True))
+        self.assertIsNone(MarketCache(self.path).get('markets'))
+
+    def test_ttl(self):
+        MarketCache(self.path).put('pairs', [])
+        self.assertEqual(MarketCache(self.path, ttl=0).get('pairs'), ([], False))
+
+    def test_otherVersionIgnored(self):
+        with open(self.path, 'w') as fs:
+            json.dump({'version': CACHE_VERSION + 1, 'entries': {'pairs': {'fetched': 0, 'value': []}}}, fs)
+        self.assertIsNone(MarketCache(self.path).get('pairs'))
+
+    def test_invalidate(self):
+        cache = MarketCache(self.path)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.invalidate('a')
+        self.assertIsNone(MarketCache(self.path).get('a'))
+        cache.invalidate()
+        self.assertIsNone(MarketCache(self.path).get('b'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,14 @@ Singleton object used to make trades and query the exchanges for information
 Author: Parker Timmerman
 """
 import ccxt
+import logs
+import tracing
 
 from book_keeper import BookKeeper
+from concurrent.futures import ThreadPoolExecutor, wait
 from constants import (
     BS,
+    concurrencyLimitMap,
     Currency,
     Exchange,
     kTOn,
@@ -15,37 +19,73 @@ from constants import (
     SafetyValues,
     TimeUnit
 )
-from functools import partial
-from utils import loadKrakenKeys, loadBinanceKeys, splitPair, timestamp, validPair
-from my_types import ApiError, Order, ValuePair
-from pprint import pprint
+from market_cache import MarketCache
+from symbol_index import resolveSymbol
+from utils import getSafeScale, loadKrakenKeys, loadBinanceKeys, monotonicMs, timestamp
+from my_types import ApiError, Order
 from time import time
 from typing import List
 from virtual_market import VirtualMarket
 
+log = logs.getLogger(__name__)
+
 class MarketEngine():
     class _MarketEngine():
-        def __init__(self, currencies, exchanges, pairs):
-            krakenKeys = loadKrakenKeys()
-            self._kraken = ccxt.kraken({
-                'apiKey': krakenKeys[0],
-                'secret': krakenKeys[1],
-                'verbose': False,
-            })
-            self._kraken.load_markets()
-
-            binanceKeys = loadBinanceKeys()
-            self._binance = ccxt.binance({
-                'apiKey': binanceKeys[0],
-                'secret': binanceKeys[1],
-                'verbose': False,
-            })
-            self._binance.load_markets()
-
+        def __init__(self, currencies, exchanges, pairs, cache: MarketCache = None):
             self._supportedExchanges = exchanges
             self._supportedCurrencies = currencies
             self._supportedCurrencyPairs = pairs
 
+            # Every exchange gets its own pool for ticker requests, as big as its limit on requests in flight, so
+            # a slow exchange only ever holds up its own requests. Startup and refreshes get a pool of their own
+            self._tickerPools = {exch: ThreadPoolExecutor(max_workers=concurrencyLimitMap.get(exch, 1),
+                                                          thread_name_prefix='tickers-{}'.format(exch.value))
+                                 for exch in exchanges}
+            self._inFlight = {}                 # (exchange, pairs) -> ticker request that outlived its deadline
+            self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='market-engine')
+
+            # Market metadata and tradeable pairs rarely change, so they come from the cache when it has them
+            self._cache = cache or MarketCache()
+
+            # Building a client and loading its markets are a few round trips each, so do both exchanges at once,
+            # and look up Kraken's tradeable pairs as soon as its client is ready, while Binance's may still be loading
+            kraken = self._pool.submit(self._createClient, Exchange.KRAKEN, ccxt.kraken, loadKrakenKeys())
+            binance = self._pool.submit(self._createClient, Exchange.BINANCE, ccxt.binance, loadBinanceKeys())
+            self._kraken = kraken.result()
+            if not self._supportedCurrencyPairs:
+                tradeablePairs = self._pool.submit(self._getTradeablePairsCached)
+            self._binance = binance.result()
+            if not self._supportedCurrencyPairs:
+                self._supportedCurrencyPairs = tradeablePairs.result()
+
+            self._recorder = None
+
+        def _createClient(self, exch: Exchange, exchangeClass, keys):
+            """
+            Builds a ccxt client with the given (key, secret) and gives it its markets, from the cache if they
+            are there, otherwise by loading them. Cached markets past their TTL are reloaded in the background
+            """
+            client = exchangeClass({
+                'apiKey': keys[0],
+                'secret': keys[1],
+                'verbose': False,
+            })
+            cached = self._cache.get('markets.{}'.format(exch.value))
+            if cached is None:
+                self._refreshMarkets(exch, client)
+            else:
+                metadata, fresh = cached
+                client.set_markets(metadata['markets'], metadata['currencies'])
+                if not fresh:
+                    self._pool.submit(self._refreshMarkets, exch, client)
+            return client
+
+        def _refreshMarkets(self, exch: Exchange, client) -> None:
+            """ Loads a client's markets from the exchange and caches them """
+            client.load_markets(reload=True)
+            self._cache.put('markets.{}'.format(exch.value), {'markets': client.markets, 'currencies': client.currencies})
+            log.info("Refreshed market metadata for %s", exch)
+
     # ======== Query for information ========
         
         # ======== Fetch Balances ========
@@ -72,18 +112,10 @@ class MarketEngine():
                 supported_currencies_string = list(map(lambda x: nTOk[x.value], self._supportedCurrencies))
                 for (curr, amt) in balances.items():
                     if curr in supported_currencies_string:
-                        currency = Currency[kTOn[curr]]
-                        amount = float(amt)
-                        usd_amount = VirtualMarket.instance().convertCurrency(
-                            exch=Exchange.KRAKEN,
-                            amt=amount,
-                            start=currency,
-                            end=Currency.USDT
-                        )
-                        position[currency] = ValuePair(amount, usd_amount)
-                BookKeeper.instance().updateBalance(
+                        position[Currency[kTOn[curr]]] = float(amt)
+                BookKeeper.instance().updateAmounts(
                     exch=Exchange.KRAKEN,
-                    balance=position
+                    amounts=position
                 )
                 return position
 
@@ -127,18 +159,10 @@ class MarketEngine():
                 supported_currencies_string = self.supportedCurrenciesString()
                 for entry in balances:
                     if entry['asset'] in supported_currencies_string:
-                        currency = Currency[entry['asset']]
-                        amount = float(entry['free'])
-                        usd_amount = VirtualMarket.instance().convertCurrency(
-                            exch=Exchange.BINANCE,
-                            amt=amount,
-                            start=currency,
-                            end=Currency.USDT
-                        )
-                        position[currency] = ValuePair(amount, usd_amount)
-                BookKeeper.instance().updateBalance(
+                        position[Currency[entry['asset']]] = float(entry['free'])
+                BookKeeper.instance().updateAmounts(
                     exch=Exchange.BINANCE,
-                    balance=position
+                    amounts=position
                 )
                 return position
 
@@ -171,11 +195,31 @@ class MarketEngine():
                 'bid_vol': float(data['b'][2]),      # i.e. 742.4 gets returned as 743.00
             })
 
-        def _fetchTickerBinance(self, first: Currency, second: Currency):
+        def _fetchBookKraken(self, first: Currency, second: Currency, depth: int):
+            """
+            Private function to query kraken for the top depth levels of the book for a pair of currencies
+            """
+            resp = self._kraken.publicGetDepth({'pair': '{0}{1}'.format(nTOk[first.value], nTOk[second.value]), 'count': depth})
+            if resp['error']:
+                raise ApiError('kraken api returned an error:\n{}'.format(resp['error']))
+
+            book = list(resp['result'].values())[0]
+            asks = [(float(level[0]), float(level[1])) for level in book['asks']]
+            bids = [(float(level[0]), float(level[1])) for level in book['bids']]
+            return ((first, second), {
+                'ask': asks[0][0],
+                'bid': bids[0][0],
+                'ask_vol': asks[0][1],
+                'bid_vol': bids[0][1],
+                'asks': asks,
+                'bids': bids,
+            })
+
+        def _fetchTickerBinance(self, first: Currency, second: Currency, depth: int = 5):
             """
-            Private function to query binance for ticker data for a pair of currencies
+            Private function to query binance for the top depth levels of the book for a pair of currencies
             """
-            resp = self._binance.publicGetDepth({'symbol': '{0}{1}'.format(first.value, second.value), 'limit': 5})
+            resp = self._binance.publicGetDepth({'symbol': '{0}{1}'.format(first.value, second.value), 'limit': depth})
             if not 'asks' in resp or not 'bids' in resp:
                 raise ApiError('binance api returned an error:\n{}'.format(resp))
             return ((first, second), {
@@ -183,9 +227,11 @@ class MarketEngine():
                 'bid': float(resp['bids'][0][0]),
                 'ask_vol': float(resp['asks'][0][1]),
                 'bid_vol': float(resp['bids'][0][1]),
+                'asks': [(float(price), float(vol)) for price, vol in resp['asks']],
+                'bids': [(float(price), float(vol)) for price, vol in resp['bids']],
             })
 
-        def fetchTicker(self, exch: Exchange, first: Currency, second: Currency):
+        def fetchTicker(self, exch: Exchange, first: Currency, second: Currency, depth: int = 0):
             """
             Public function to query an exchange for ticker data for a pair of currencies
 
@@ -197,15 +243,67 @@ class MarketEngine():
 
             return[0] = (<Currency.XRP: 'XRP'>, <Currency.USDT: 'USDT'>)
             return[1] = {'ask': 0.51003000, 'bid': 0.50960000, 'ask_vol': 195.000, 'bid_vol': 30.000}
+
+            With depth set the values also have 'asks' and 'bids', the top depth levels of the book
             """
             if exch is Exchange.KRAKEN:
+                if depth:
+                    return self._fetchBookKraken(first=first, second=second, depth=depth)
                 return self._fetchTickerKraken(first=first, second=second)
             if exch is Exchange.BINANCE:
-                return self._fetchTickerBinance(first=first, second=second)
+                return self._fetchTickerBinance(first=first, second=second, depth=depth or 5)
             else:
                 raise NotImplementedError('fetch ticker data not implemented for {}'.format(exch))
 
-        def fetchTickers(self, exch: Exchange, pairs):
+        def _fetchTickersKraken(self, pairs):
+            """
+            Private function to query kraken for ticker data for a list of pairs in a single request,
+            the ticker endpoint accepts a comma separated list of pairs
+            """
+            requested = {'{0}{1}'.format(nTOk[first.value], nTOk[second.value]): (first, second) for first, second in pairs}
+            resp = self._kraken.publicGetTicker({'pair': ','.join(requested.keys())})
+            if resp['error']:
+                raise ApiError('kraken api returned an error:\n{}'.format(resp['error']))
+
+            data = {}
+            for krakenPair, values in resp['result'].items():
+                # Kraken doesn't always answer with the name we asked for, so map it back to our symbols
+                pair = requested.get(krakenPair) or resolveSymbol(Exchange.KRAKEN, krakenPair)
+                if not pair:
+                    continue
+                data[pair] = {
+                    'ask': float(values['a'][0]),
+                    'bid': float(values['b'][0]),
+                    'ask_vol': float(values['a'][2]),
+                    'bid_vol': float(values['b'][2]),
+                }
+            return data
+
+        def _fetchTickersBinance(self, pairs):
+            """
+            Private function to query binance for ticker data for a list of pairs in a single request,
+            the book ticker endpoint returns the top of the book for every symbol when no symbol is given
+            """
+            requested = {'{0}{1}'.format(first.value, second.value): (first, second) for first, second in pairs}
+            resp = self._binance.publicGetTickerBookTicker()
+            if not isinstance(resp, list):
+                raise ApiError('binance api returned an error:\n{}'.format(resp))
+
+            data = {}
+            for entry in resp:
+                pair = requested.get(entry['symbol'])
+                if not pair:
+                    continue
+                data[pair] = {
+                    'ask': float(entry['askPrice']),
+                    'bid': float(entry['bidPrice']),
+                    'ask_vol': float(entry['askQty']),
+                    'bid_vol': float(entry['bidQty']),
+                }
+            return data
+
+        @tracing.traced('fetchTickers')
+        def fetchTickers(self, exch: Exchange, pairs, batch: bool = True, depth: int = 0):
             """
             Public function to query an exchange for a list of pairs
 
@@ -215,18 +313,105 @@ class MarketEngine():
                 (<Currency.EOS: 'EOS'>, <Currency.USDT: 'USDT'>): {'ask': '0.51003000', 'bid': '0.50960000', 'ask_vol': '195.000', 'bid_vol': '30.000'}
             }
 
-            NOTE: This is not optimal, if possible batch requests
+            With batch set every pair is fetched in a single request, pairs the exchange doesn't list are
+            left out of the result. Otherwise each pair is requested one at a time. The batch endpoints only
+            return the top of the book, so with depth set each pair's book is requested depth levels deep
+            instead, one pair at a time, and the values also have 'asks' and 'bids'.
+
+            Every pair's values also have the 'timestamp' it came back at, in monotonic milliseconds, which
+            the Virtual Market stamps its edges with however long the data waits before it is applied.
+
+            If a recorder is set, every result is also appended to its log.
             """
-            data = {}
             for pair in pairs:
                 if len(pair) != 2:
                     raise AttributeError('pair formatted incorrectly! {}'.format(pair))
-                currencies, values = self.fetchTicker(
-                    exch=exch,
-                    first=pair[0],
-                    second=pair[1]
-                )
-                data[currencies] = values
+            if batch and not depth and exch is Exchange.KRAKEN:
+                data = self._fetchTickersKraken(pairs)
+            elif batch and not depth and exch is Exchange.BINANCE:
+                data = self._fetchTickersBinance(pairs)
+            if batch and not depth:
+                received = monotonicMs()
+                for values in data.values():
+                    values['timestamp'] = received
+            else:
+                data = {}
+                for pair in pairs:
+                    currencies, values = self.fetchTicker(
+                        exch=exch,
+                        first=pair[0],
+                        second=pair[1],
+                        depth=depth
+                    )
+                    values['timestamp'] = monotonicMs()
+                    data[currencies] = values
+
+            if self._recorder:
+                self._recorder.record(exch=exch, marketData=data)
+            return data
+
+        def setRecorder(self, recorder):
+            """
+            Given a MarketRecorder, capture every fetchTickers result to its log. Pass None to stop recording
+            """
+            self._recorder = recorder
+
+        def fetchTickersConcurrent(self, exchanges: List[Exchange], pairs, deadline: float = 2.0, batch: bool = True,
+                                   depth: int = 0, onStale=None):
+            """
+            Public function to query every pair on every given exchange at once
+
+            Requests go out on each exchange's own pool, at most concurrencyLimitMap of them at once. With batch
+            set, and no depth, there is a single request per exchange, otherwise a request per pair per exchange,
+            see fetchTickers. Anything that hasn't come back within deadline seconds, or that failed, is dropped
+            and onStale(exch, pairs) is called with its pairs. A request that is still running from an earlier
+            call isn't sent again until it finishes, its pairs are stale too, so a slow exchange doesn't pile up
+            requests behind the ones it hasn't answered. onStale defaults to marking them stale in the
+            Virtual Market, pass the scheduler's markStale when the data goes through a scheduler so the two
+            are applied in order.
+
+            Example return value:
+            {
+                Exchange.KRAKEN: {
+                    (<Currency.XRP: 'XRP'>, <Currency.USDT: 'USDT'>): {'ask': 0.51003000, 'bid': 0.50960000, 'ask_vol': 195.000, 'bid_vol': 30.000},
+                },
+                Exchange.BINANCE: {
+                    ...
+                },
+            }
+            """
+            requests = {}
+            data = {exch: {} for exch in exchanges}
+            stale = {exch: [] for exch in exchanges}
+            for exch in exchanges:
+                for requestPairs in ([list(pairs)] if batch and not depth else [[pair] for pair in pairs]):
+                    key = (exch, tuple(requestPairs))
+                    if key in self._inFlight:
+                        if not self._inFlight[key].done():
+                            stale[exch].extend(requestPairs)
+                            continue
+                        del self._inFlight[key]
+                    future = self._tickerPools[exch].submit(self.fetchTickers, exch, requestPairs, batch, depth)
+                    requests[future] = (exch, requestPairs)
+
+            done, notDone = wait(requests, timeout=deadline)
+
+            for future in done:
+                exch, requestPairs = requests[future]
+                try:
+                    data[exch].update(future.result())
+                except Exception as e:
+                    log.warning("Failed to fetch %s on %s: %s", requestPairs, exch, e)
+                stale[exch].extend([pair for pair in requestPairs if pair not in data[exch]])
+            for future in notDone:
+                exch, requestPairs = requests[future]
+                if not future.cancel():         # already started, it will finish but we ignore what it returns
+                    self._inFlight[(exch, tuple(requestPairs))] = future
+                stale[exch].extend(requestPairs)
+
+            for exch, stalePairs in stale.items():
+                if stalePairs:
+                    (onStale or VirtualMarket.instance().markStale)(exch, stalePairs)
             return data
 
         
@@ -234,8 +419,8 @@ class MarketEngine():
         def _getTradeablePairsKraken(self):
             """
             Queries Kraken to get its tradeable pairs and filters that data down to just a list of pairs.
-            Kraken has wierd names for their pairs (XBT v. BTC) so convert our support currencies to the 
-            kraken names. Then find all the Kraken pairs that contain two of our supported currencies
+            Kraken has wierd names for their pairs (XBT v. BTC) so every symbol is resolved through the
+            Kraken symbol index, keeping the ones made of two of our supported currencies
             """
             if not self._kraken:
                 raise AttributeError('Kraken API instance has not been instanciated')
@@ -243,20 +428,39 @@ class MarketEngine():
             keyword = 'result'
             if not keyword in resp:
                 raise ApiError('Kraken api did not return a valid response')
-            assetPairInfo = resp[keyword]
-            rawAssetPairs = [pair for pair in assetPairInfo.keys()]
-            krakenFormattedSupportedCurrencies = list(map(nTOk.get, self.supportedCurrenciesString()))
-            validKrakenPair = partial(validPair, krakenFormattedSupportedCurrencies)
-            krakenPairs = list(filter(validKrakenPair, rawAssetPairs))
-            krakenPairs = list(filter(lambda x: '.d' not in x, krakenPairs))    # remove the "dark market" stuff
-
+            supported = set(self._supportedCurrencies)
             formattedPairs = []
-            for pair in krakenPairs:
-                first, second = splitPair(krakenFormattedSupportedCurrencies, pair)
-                formattedPairs.append((Currency[kTOn[first]], Currency[kTOn[second]]))
+            for krakenPair in resp[keyword].keys():
+                # Symbols that aren't exactly two of our currencies, like the ".d" dark market ones, don't resolve
+                pair = resolveSymbol(Exchange.KRAKEN, krakenPair, supported)
+                if pair:
+                    formattedPairs.append(pair)
 
             return formattedPairs
 
+        def _tradeablePairsKey(self) -> str:
+            return 'pairs.{0}.{1}'.format(Exchange.KRAKEN.value, ','.join(sorted(self.supportedCurrenciesString())))
+
+        def _refreshTradeablePairs(self):
+            """ Looks up the tradeable pairs and caches them for our supported currencies """
+            pairs = self._getTradeablePairsKraken()
+            self._cache.put(self._tradeablePairsKey(), [[first.value, second.value] for first, second in pairs])
+            return pairs
+
+        def _getTradeablePairsCached(self):
+            """
+            Returns the tradeable pairs for our supported currencies from the cache, or looks them up if they
+            aren't cached. If the cached pairs are past their TTL they are refreshed in the background for
+            the next start, the graphs are already built around the pairs we return so they can't change now
+            """
+            cached = self._cache.get(self._tradeablePairsKey())
+            if cached is None:
+                return self._refreshTradeablePairs()
+            pairs, fresh = cached
+            if not fresh:
+                self._pool.submit(self._refreshTradeablePairs)
+            return [(Currency(first), Currency(second)) for first, second in pairs]
+
     # ======== Make Trades ========
 
         def _makeTradeKraken(self, order: Order):
@@ -319,41 +523,49 @@ class MarketEngine():
             #    'timestamp': str(timestamp(TimeUnit.Milliseconds))
             #}
 
+        @tracing.traced('makeUnsafeTrade')
         def makeUnsafeTrade(self, order: Order, updateBookKeeper: bool = True):
             """
-            Given an Order object, will post a trade to the market.
+            Given an Order object, will post a trade to the market, and unless updateBookKeeper is False record
+            it with the BookKeeper.
             WARNING: Ignores all safety standards and does not check BookKeeper for our current assets
             """
             resp = None
             if order.exchange is Exchange.KRAKEN:
                 resp = self._makeTradeKraken(order)
-                BookKeeper.instance().reportOrder(order=order)
-                return resp
-            if order.exchange is Exchange.BINANCE:
+            elif order.exchange is Exchange.BINANCE:
                 resp = self._makeTradeBinance(order)
-                BookKeeper.instance().reportOrder(order=order)
-                return resp
             else:
                 raise NotImplementedError('make trade is not implemented for {}'.format(order.exchange))
+            if updateBookKeeper:
+                BookKeeper.instance().addOrder(trade=order)
+                BookKeeper.instance().reportOrder(order=order)
+            return resp
 
+        @tracing.traced('createSafeTrades')
         def createSafeTrades(self, orders: List[Order], updateBookKeeper: bool = True):
             """
             Given a list of trades, will convert them to safe trades
             -> AKA trades that:
                 - Below our maximum
                 - Make sure we have enough assets to complete the trade
+
+            Every order is scaled down by the same factor, so the legs of a path keep the sizes pathToOrders
+            walked them to. Returns None if the smallest order would end up below our minimum
             """
             safe_orders = []
-            
-            max_vol = min([VirtualMarket.instance().convertCurrency(
+
+            values = [VirtualMarket.instance().convertCurrency(
                 exch=order.exchange,
                 amt=order.volume,
                 start=order.pair[0],
                 end=Currency.USDT
-            ) for order in orders])
-
-            max_vol = min(max_vol, float(SafetyValues.MaximumOrderValueUSD.value))
+            ) for order in orders]
+            if not values or min(values) <= 0:
+                log.debug("Couldn't value orders in USD: %s", orders)
+                return None
 
+            available = []
             for order in orders:
                 required_currency = None
                 if order.buyOrSell == BS.BUY:
@@ -365,22 +577,18 @@ class MarketEngine():
                     exch=order.exchange,
                     curr=required_currency,
                 )
-                max_vol = min(max_vol, available_assets.amt_usd * 0.8)
-
-
-                if max_vol < SafetyValues.MinimumOrderValueUSD.value:
-                    print("Max Vol: {}".format(max_vol))
-                    return None
+                available.append(available_assets.amt_usd)
 
-            max_vol = VirtualMarket.instance().convertCurrency(
-                                exch=order.exchange,
-                                amt=max_vol,
-                                start=Currency.USDT,
-                                end=order.pair[0]
-                            )
-            max_vol = float(self._binance.amount_to_precision("{0}/{1}".format(order.pair[0].value, order.pair[1].value), max_vol))
+            scale = getSafeScale(values, available,
+                                 maximum=float(SafetyValues.MaximumOrderValueUSD.value),
+                                 minimum=SafetyValues.MinimumOrderValueUSD.value)
+            if scale is None:
+                log.debug("Orders too small once scaled: %s", orders)
+                return None
 
             for order in orders:
+                client = self._kraken if order.exchange is Exchange.KRAKEN else self._binance
+                volume = float(client.amount_to_precision("{0}/{1}".format(order.pair[0].value, order.pair[1].value), order.volume * scale))
                 safe_orders.append(
                     Order(
                         exchange=order.exchange,
@@ -388,7 +596,7 @@ class MarketEngine():
                         orderType=order.orderType,
                         pair=order.pair,
                         price=(order.price*0.999),
-                        volume=max_vol,
+                        volume=volume,
                     )
                 )
 
@@ -443,14 +651,14 @@ class MarketEngine():
             Method that returns a list of currency pairs supported by the Market Engine
             """
             if not self._supportedCurrencyPairs:
-                self._supportedCurrencyPairs = self._getTradeablePairsKraken()
+                self._supportedCurrencyPairs = self._getTradeablePairsCached()
             return self._supportedCurrencyPairs
 
 
     INSTANCE = None
     @classmethod
-    def initialize(cls, currencies, exchanges, pairs):
-        MarketEngine.INSTANCE = cls._MarketEngine(currencies, exchanges, pairs)
+    def initialize(cls, currencies, exchanges, pairs, cache: MarketCache = None):
+        MarketEngine.INSTANCE = cls._MarketEngine(currencies, exchanges, pairs, cache)
 
 
     @classmethod
@@ -0,0 +1,292 @@
+"""
+Record and replay market data. The recorder appends every batch of tickers we fetch to a compact binary
+log, and the replay driver feeds a log back through the Virtual Market, either at the speed it was
+recorded or as fast as possible, so the arbitrage pipeline can be measured offline.
+
+Log format, all little endian:
+    header:     b'MMSR', version (uint16)
+    record:     timestamp (double), exchange (uint8), number of pairs (uint16)
+    pair:       first currency (uint8), second currency (uint8), ask, bid, ask_vol, bid_vol (double),
+                number of ask levels (uint16), number of bid levels (uint16)
+    level:      price, vol (double)
+Exchanges and currencies are stored as their position in the Exchange and Currency enums, so new members
+must only ever be added to the end of those enums. Version 1 logs, which stored the level counts as
+uint8, can still be read but not appended to. A log cut off partway through a record, by a crash
+while it was being written, reads back up to the last complete record.
+
+Author: Parker Timmerman
+"""
+import logging
+import logs
+import os
+import struct
+import sys
+import threading
+
+from constants import Currency, Exchange
+from time import monotonic, sleep, time
+from utils import monotonicMs
+from virtual_market import VirtualMarket
+
+log = logs.getLogger(__name__)
+
+MAGIC = b'MMSR'
+VERSION = 2
+
+_FILE_HEADER = struct.Struct('<4sH')
+_RECORD = struct.Struct('<dBH')
+_PAIRS = {
+    1: struct.Struct('<BBddddBB'),
+    2: struct.Struct('<BBddddHH'),
+}
+_LEVEL = struct.Struct('<dd')
+
+_EXCHANGES = list(Exchange)
+_CURRENCIES = list(Currency)
+
+class MarketRecorder():
+    """ Appends market data to a binary log, safe to call from multiple threads """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_FILE_HEADER.pack(MAGIC, VERSION))
+        else:
+            with open(path, 'rb') as fs:
+                header = fs.read(_FILE_HEADER.size)
+            if len(header) < _FILE_HEADER.size or _FILE_HEADER.unpack(header) != (MAGIC, VERSION):
+                self._file.close()
+                raise ValueError('{} is not a version {} market log, it can\'t be appended to'.format(path, VERSION))
+        self._lock = threading.Lock()
+
+    def record(self, exch: Exchange, marketData, timestamp: float = None) -> None:
+        """
+        Given an exchange and market data in the format MarketEngine.fetchTickers returns, appends it to
+        the log stamped with the given timestamp, or now
+        """
+        if timestamp is None:
+            timestamp = time()
+        chunks = [_RECORD.pack(timestamp, _EXCHANGES.index(exch), len(marketData))]
+        for (first, second), values in marketData.items():
+            asks = values.get('asks', [])
+            bids = values.get('bids', [])
+            chunks.append(_PAIRS[VERSION].pack(
+                _CURRENCIES.index(first), _CURRENCIES.index(second),
+                values['ask'], values['bid'], values['ask_vol'], values['bid_vol'],
+                len(asks), len(bids)))
+            chunks.extend(_LEVEL.pack(price, vol) for price, vol in asks)
+            chunks.extend(_LEVEL.pack(price, vol) for price, vol in bids)
+        with self._lock:
+            self._file.write(b''.join(chunks))
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+class MarketReplay():
+    """ Reads a log written by MarketRecorder """
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def records(self):
+        """
+        Generator of (timestamp, exchange, marketData) for every record in the log, stopping at the last
+        complete record if the end of the log is torn
+        """
+        with open(self._path, 'rb') as fs:
+            data = fs.read()
+        if len(data) < _FILE_HEADER.size:
+            raise ValueError('{} is not a market log this version can read'.format(self._path))
+        magic, version = _FILE_HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version not in _PAIRS:
+            raise ValueError('{} is not a market log this version can read'.format(self._path))
+
+        pairStruct = _PAIRS[version]
+        offset = _FILE_HEADER.size
+        while offset < len(data):
+            record = self._readRecord(data, offset, pairStruct)
+            if record is None:
+                log.warning("%s ends with a torn record at byte %d, ignoring the last %d bytes",
+                            self._path, offset, len(data) - offset)
+                return
+            offset, timestamp, exch, marketData = record
+            yield (timestamp, exch, marketData)
+
+    @staticmethod
+    def _readRecord(data, offset, pairStruct):
+        """
+        Reads the record at offset, with pairs in the given format, returns (offset of the next record, timestamp, exchange, marketData) or
+        None if the data ends before the record does
+        """
+        if offset + _RECORD.size > len(data):
+            return None
+        timestamp, exch, numPairs = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        marketData = {}
+        for _ in range(numPairs):
+            if offset + pairStruct.size > len(data):
+                return None
+            first, second, ask, bid, ask_vol, bid_vol, numAsks, numBids = pairStruct.unpack_from(data, offset)
+            offset += pairStruct.size
+            values = {'ask': ask, 'bid': bid, 'ask_vol': ask_vol, 'bid_vol': bid_vol}
+            if numAsks or numBids:
+                if offset + (numAsks + numBids) * _LEVEL.size > len(data):
+                    return None
+                levels = [_LEVEL.unpack_from(data, offset + i * _LEVEL.size) for i in range(numAsks + numBids)]
+                offset += (numAsks + numBids) * _LEVEL.size
+                values['asks'] = levels[:numAsks]
+                values['bids'] = levels[numAsks:]
+            marketData[(_CURRENCIES[first], _CURRENCIES[second])] = values
+        return (offset, timestamp, _EXCHANGES[exch], marketData)
+
+    def ticks(self):
+        """
+        Generator of (timestamp, marketData) where market data is in the format VirtualMarket.updateMarket
+        takes. Records are grouped into a tick until an exchange shows up twice.
+        """
+        tick = {}
+        tickTimestamp = None
+        for timestamp, exch, marketData in self.records():
+            if exch in tick:
+                yield (tickTimestamp, tick)
+                tick = {}
+            if not tick:
+                tickTimestamp = timestamp
+            tick[exch] = marketData
+        if tick:
+            yield (tickTimestamp, tick)
+
+    def latest(self):
+        """ Returns the most recent market data for every exchange in the log """
+        latest = {}
+        for _, exch, marketData in self.records():
+            latest.setdefault(exch, {}).update(marketData)
+        return latest
+
+    def replay(self, realtime: bool = False, speed: float = 1.0, onTick=None):
+        """
+        Feeds every tick of the log through the Virtual Market, calling onTick() after each one.
+
+        With realtime set ticks are spaced out like they were recorded, sped up by speed, otherwise they
+        are replayed as fast as possible. Returns (number of ticks, seconds taken, ticks per second)
+        """
+        count = 0
+        start = time()
+        startMs = monotonicMs()
+        firstTimestamp = None
+        for timestamp, marketData in self.ticks():
+            if firstTimestamp is None:
+                firstTimestamp = timestamp
+            if realtime:
+                delay = (timestamp - firstTimestamp) / speed - (time() - start)
+                if delay > 0:
+                    sleep(delay)
+            # Edges are stamped on the monotonic clock, so the log is replayed as if it started now
+            VirtualMarket.instance().updateMarket(marketData=marketData, timestamp=startMs + int((timestamp - firstTimestamp) * 1000))
+            if onTick:
+                onTick()
+            count += 1
+        elapsed = time() - start
+        return (count, elapsed, count / elapsed if elapsed else float('inf'))
+
+def saveSnapshot(path: str, marketData, timestamp: float = None) -> None:
+    """
+    Writes market data in the format VirtualMarket.updateMarket takes to a log holding just that one tick,
+    replacing the file atomically so a crash never leaves a half written snapshot behind. Pairs with a
+    monotonic 'timestamp' are recorded at the wall clock time they were quoted, the rest at timestamp or now
+    """
+    tmp = '{}.tmp'.format(path)
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    recorder = MarketRecorder(tmp)
+    now = time()
+    nowMs = monotonicMs()
+    for exch, data in marketData.items():
+        quoted = {}
+        for pair, values in data.items():
+            quoted.setdefault(values.get('timestamp'), {})[pair] = values
+        for quotedMs, group in quoted.items():
+            recorder.record(exch=exch, marketData=group,
+                            timestamp=timestamp if quotedMs is None else now - (nowMs - quotedMs) / 1000)
+    recorder.close()
+    os.replace(tmp, path)
+
+class SnapshotSaver():
+    """
+    Keeps the newest quote for every pair it is given and saves them with saveSnapshot at most once every
+    interval seconds, so the next run can be seeded from a snapshot that is never more than interval old
+    when we go down. Safe to call from multiple threads
+    """
+
+    def __init__(self, path: str, interval: float):
+        self._path = path
+        self._interval = interval
+        self._latest = {}
+        self._lastSave = monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, exch: Exchange, marketData) -> None:
+        """ Given market data for an exchange, in the format VirtualMarket.updateExchange takes, saves it when due """
+        with self._lock:
+            self._latest.setdefault(exch, {}).update(marketData)
+            due = monotonic() - self._lastSave >= self._interval
+        if due:
+            self.save()
+
+    def save(self) -> None:
+        """ Saves every quote now """
+        with self._lock:
+            self._lastSave = monotonic()
+            if not self._latest:
+                return
+            try:
+                saveSnapshot(self._path, self._latest)
+            except OSError as e:
+                log.warning("Saving the market snapshot to %s failed: %s", self._path, e)
+
+def loadSnapshot(path: str, maxAge: float = None):
+    """
+    Returns a list of (timestamp, exchange, marketData) for every exchange in a snapshot written by
+    saveSnapshot, leaving out any recorded more than maxAge seconds ago. Returns an empty list if there
+    is no snapshot
+    """
+    if not os.path.exists(path):
+        return []
+    now = time()
+    return [(timestamp, exch, marketData) for timestamp, exch, marketData in MarketReplay(path).records()
+            if maxAge is None or now - timestamp <= maxAge]
+
+def replayPipeline(path: str):
+    """
+    Replays a log as fast as possible through the Virtual Market and the Arbitrage Engine's cycle
+    detection, and logs how many ticks per second the pipeline handles
+    """
+    from arbitrage_engine import ArbitrageEngine
+
+    replay = MarketReplay(path)
+    latest = replay.latest()
+    exchanges = list(latest.keys())
+    pairs = sorted({pair for marketData in latest.values() for pair in marketData.keys()}, key=lambda p: (p[0].value, p[1].value))
+    currencies = sorted({currency for pair in pairs for currency in pair}, key=lambda c: c.value)
+
+    VirtualMarket.initialize(currencies, exchanges, pairs)
+    ArbitrageEngine.initialize(currencies, exchanges, pairs)
+
+    def scan():
+        ArbitrageEngine.instance().updateUnifiedGraph()
+        ArbitrageEngine.instance().findArbitrageIncremental(unified=True)
+
+    count, elapsed, rate = replay.replay(onTick=scan)
+    log.info("Replayed %d ticks in %.3fs, %.1f ticks per second", count, elapsed, rate)
+
+if __name__ == '__main__':
+    logs.configure(level=logging.INFO)
+    try:
+        replayPipeline(sys.argv[1])
+    finally:
+        logs.shutdown()
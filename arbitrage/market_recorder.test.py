@@ -0,0 +1,106 @@
+import os
+import struct
+import tempfile
+import unittest
+from constants import Currency, Exchange
+from market_recorder import MarketRecorder, MarketReplay, SnapshotSaver, loadSnapshot, saveSnapshot
+from time import time
+from utils import monotonicMs
+from virtual_market import VirtualMarket
+
+XRPUSDT = (Currency.XRP, Currency.USDT)
+ETHUSDT = (Currency.ETH, Currency.USDT)
+
+class TestMarketRecorder(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_roundTrip(self):
+        kraken = {XRPUSDT: {'ask': 0.51, 'bid': 0.5, 'ask_vol': 195.0, 'bid_vol': 30.0}}
+        binance = {
+            XRPUSDT: {'ask': 0.52, 'bid': 0.49, 'ask_vol': 10.0, 'bid_vol': 20.0,
+                      'asks': [(0.52, 10.0), (0.53, 5.0)], 'bids': [(0.49, 20.0)]},
+            ETHUSDT: {'ask': 201.0, 'bid': 200.0, 'ask_vol': 1.0, 'bid_vol': 2.0},
+        }
+        recorder = MarketRecorder(self.path)
+        recorder.record(Exchange.KRAKEN, kraken, timestamp=1.0)
+        recorder.record(Exchange.BINANCE, binance, timestamp=1.5)
+        recorder.record(Exchange.KRAKEN, kraken, timestamp=2.0)
+        recorder.close()
+
+        records = list(MarketReplay(self.path).records())
+        self.assertEqual(records[0], (1.0, Exchange.KRAKEN, kraken))
+        self.assertEqual(records[1], (1.5, Exchange.BINANCE, binance))
+        ticks = list(MarketReplay(self.path).ticks())
+        self.assertEqual([timestamp for timestamp, _ in ticks], [1.0, 2.0])
+
+    def test_tornTail(self):
+        tick = {XRPUSDT: {'ask': 0.51, 'bid': 0.5, 'ask_vol': 1.0, 'bid_vol': 1.0,
+                          'asks': [(0.51 + i * 0.01, 1.0) for i in range(300)], 'bids': [(0.5, 1.0)]}}
+        recorder = MarketRecorder(self.path)
+        recorder.record(Exchange.KRAKEN, tick, timestamp=1.0)
+        recorder.record(Exchange.KRAKEN, tick, timestamp=2.0)
+        recorder.close()
+        self.assertEqual(list(MarketReplay(self.path).records())[0], (1.0, Exchange.KRAKEN, tick))
+
+        size = os.path.getsize(self.path)
+        for cut in (1, 8, 300 * 16):
+            with open(self.path, 'r+b') as fs:
+                fs.truncate(size - cut)
+            records = list(MarketReplay(self.path).records())
+            self.assertEqual([timestamp for timestamp, _, _ in records], [1.0])
+
+    def test_readsVersion1(self):
+        with open(self.path, 'wb') as fs:
+            fs.write(struct.pack('<4sH', b'MMSR', 1))
+            fs.write(struct.pack('<dBH', 1.0, 0, 1))
+            fs.write(struct.pack('<BBddddBB', list(Currency).index(Currency.XRP), list(Currency).index(Currency.USDT),
+                                 0.51, 0.5, 1.0, 1.0, 1, 0))
+            fs.write(struct.pack('<dd', 0.51, 1.0))
+        records = list(MarketReplay(self.path).records())
+        self.assertEqual(records[0][2][XRPUSDT]['asks'], [(0.51, 1.0)])
+        with self.assertRaises(ValueError):
+            MarketRecorder(self.path)
+
+    def test_replay(self):
+        recorder = MarketRecorder(self.path)
+        for i in range(5):
+            recorder.record(Exchange.KRAKEN, {XRPUSDT: {'ask': 0.51 + i, 'bid': 0.5 + i, 'ask_vol': 1.0, 'bid_vol': 1.0}}, timestamp=i + 1)
+        recorder.close()
+
+        VirtualMarket.initialize([Currency.XRP, Currency.USDT], [Exchange.KRAKEN], [XRPUSDT])
+        count, _, _ = MarketReplay(self.path).replay()
+        self.assertEqual(count, 5)
+        edge = VirtualMarket.instance().getMarketData(Exchange.KRAKEN).getEdge(*XRPUSDT)
+        self.assertEqual(edge.getExchangeRate(), 4.5)
+
+    def test_snapshot(self):
+        self.assertEqual(loadSnapshot(self.path), [])
+        tick = {Exchange.KRAKEN: {XRPUSDT: {'ask': 0.51, 'bid': 0.5, 'ask_vol': 1.0, 'bid_vol': 1.0}}}
+        saveSnapshot(self.path, tick, timestamp=1.0)
+        saveSnapshot(self.path, tick)           # replaces, rather than appends to, the old snapshot
+        snapshot = loadSnapshot(self.path, maxAge=60)
+        self.assertEqual([(exch, data) for _, exch, data in snapshot], list(tick.items()))
+        self.assertEqual(loadSnapshot(self.path, maxAge=-1), [])
+
+    def test_snapshotSaver(self):
+        saver = SnapshotSaver(self.path, interval=3600)
+        saver.update(Exchange.KRAKEN, {XRPUSDT: {'ask': 0.51, 'bid': 0.5, 'ask_vol': 1.0, 'bid_vol': 1.0}})
+        self.assertFalse(os.path.exists(self.path))            # not due yet
+        quoted = monotonicMs() - 3000
+        saver.update(Exchange.KRAKEN, {ETHUSDT: {'ask': 201.0, 'bid': 200.0, 'ask_vol': 1.0, 'bid_vol': 1.0, 'timestamp': quoted}})
+        saver.save()
+
+        snapshot = loadSnapshot(self.path)
+        self.assertEqual({pair for _, _, data in snapshot for pair in data}, {XRPUSDT, ETHUSDT})
+        ages = {pair: time() - timestamp for timestamp, _, data in snapshot for pair in data}
+        self.assertLess(ages[XRPUSDT], 1)
+        self.assertAlmostEqual(ages[ETHUSDT], 3, delta=0.5)     # recorded when it was quoted, not when it was saved
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+"""
+Market snapshot in shared memory, so the processes fetching from exchanges and the processes looking for
+arbitrage don't have to share an interpreter.
+
+For every exchange the block holds three (V, V) arrays indexed by currency, the exchange rate, volume and
+timestamp of the edge from one currency to another, timestamps being milliseconds on the monotonic clock
+which every process on the machine shares, laid out like a Graph: rates[i, j] is the bid of
+(i, j) and rates[j, i] is 1 / its ask, a rate of 0 means no quote. Each exchange has one writer, the
+process fetching it, and any number of readers.
+
+Consistency comes from a seqlock, a sequence number per exchange at the front of the block. The writer
+makes it odd before changing that exchange's arrays and even again once it's done. A reader notes the
+sequence, reads the arrays in place, and only keeps what it read if the sequence is still the same even
+number afterwards, otherwise it reads again. Readers never block the writer and never copy the arrays.
+This relies on stores becoming visible to other processes in order, which holds on x86.
+
+Block layout, native byte order:
+    sequences   uint64[E]
+    exchange e  rates float64[V, V], vols float64[V, V], timestamps float64[V, V]
+
+Author: Parker Timmerman
+"""
+import logs
+import math
+import numpy as np
+
+from multiprocessing import shared_memory
+from time import monotonic, sleep
+from utils import monotonicMs
+
+log = logs.getLogger(__name__)
+
+POLL_INTERVAL = 0.0005                  # seconds between checks while waiting on a writer
+
+class MarketSnapshot():
+    """
+    Shared memory market for a fixed list of currencies and exchanges. Leave name out to create a block,
+    the creator should unlink() it once every process is done, or give the name of one to attach to it
+    """
+
+    def __init__(self, currencies, exchanges, name: str = None):
+        self._currencies = list(currencies)
+        self._exchanges = list(exchanges)
+        self._currencyIndex = {currency: idx for idx, currency in enumerate(self._currencies)}
+        self._exchangeIndex = {exch: idx for idx, exch in enumerate(self._exchanges)}
+
+        numNodes = len(self._currencies)
+        numExchanges = len(self._exchanges)
+        matrixBytes = numNodes * numNodes * 8
+        size = numExchanges * 8 + numExchanges * 3 * matrixBytes
+        if name is None:
+            self._block = shared_memory.SharedMemory(create=True, size=max(size, 8))
+            self._block.buf[:size] = bytes(size)
+        else:
+            try:
+                self._block = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                self._block = shared_memory.SharedMemory(name=name)     # before 3.13 every attach is tracked
+
+        self._sequences = np.ndarray((numExchanges,), dtype=np.uint64, buffer=self._block.buf)
+        self._arrays = []
+        offset = numExchanges * 8
+        for _ in self._exchanges:
+            rates, vols, timestamps = [np.ndarray((numNodes, numNodes), dtype=np.float64, buffer=self._block.buf,
+                                                  offset=offset + k * matrixBytes) for k in range(3)]
+            self._arrays.append((rates, vols, timestamps))
+            offset += 3 * matrixBytes
+
+    @property
+    def name(self) -> str:
+        """ Name to attach to this block from another process """
+        return self._block.name
+
+    def sequence(self, exch) -> int:
+        """ Sequence number of an exchange, it changes every time the exchange is written to """
+        return int(self._sequences[self._exchangeIndex[exch]])
+
+    def write(self, exch, marketData, timestamp: float = None) -> None:
+        """
+        Writes market data, in the format VirtualMarket.updateExchange takes, for an exchange, stamped with
+        timestamp in monotonic milliseconds or now. Only the exchange's own fetcher may write to it. Pairs
+        with a currency we don't track are skipped, and so are pairs whose quote isn't a positive price and
+        volume, which are logged.
+
+        Every value is converted before the sequence is touched, so nothing can fail while it's odd
+        """
+        e = self._exchangeIndex[exch]
+        rates, vols, timestamps = self._arrays[e]
+        timestamp = timestamp or monotonicMs()
+        quotes = []
+        for pair, values in marketData.items():
+            i = self._currencyIndex.get(pair[0])
+            j = self._currencyIndex.get(pair[1])
+            if i is None or j is None:
+                continue
+            try:
+                bid, ask, bidVol, askVol = (float(values[key]) for key in ('bid', 'ask', 'bid_vol', 'ask_vol'))
+            except (KeyError, TypeError, ValueError) as err:
+                log.warning("Skipping %s %s, its quote is malformed: %r", exch, pair, err)
+                continue
+            if not all(math.isfinite(x) and x >= 0 for x in (bid, ask, bidVol, askVol)) or not (bid and ask):
+                log.warning("Skipping %s %s, its quote isn't a positive price and volume: %s", exch, pair, values)
+                continue
+            quotes.append((i, j, bid, 1 / ask, bidVol, askVol))
+
+        self._sequences[e] += 1                 # odd, readers will retry until we're done
+        try:
+            for i, j, bid, inverseAsk, bidVol, askVol in quotes:
+                rates[i, j] = bid
+                rates[j, i] = inverseAsk
+                vols[i, j] = bidVol
+                vols[j, i] = askVol
+                timestamps[i, j] = timestamps[j, i] = timestamp
+        finally:
+            self._sequences[e] += 1             # even again no matter what, or every reader would spin forever
+
+    def read(self, exch, fn):
+        """
+        Calls fn(rates, vols, timestamps) with the exchange's arrays in place and returns what it returns,
+        retrying until fn ran without the exchange being written to. fn must not keep the arrays, or
+        anything that is a view of them, since they may change as soon as read returns
+        """
+        e = self._exchangeIndex[exch]
+        while True:
+            before = self._sequences[e]
+            if before % 2:
+                sleep(0)
+                continue
+            result = fn(*self._arrays[e])
+            if self._sequences[e] == before:
+                return result
+
+    def marketData(self, exch, pairs, since: float = 0):
+        """
+        Returns a consistent copy of the given pairs of an exchange in the format VirtualMarket.updateExchange
+        takes, leaving out any pair that hasn't been written since the given time. Each pair's values also
+        have the 'timestamp' it was written at, which the Virtual Market stamps its edges with, and the newest
+        one can be passed as since next time
+        """
+        indices = [(pair, self._currencyIndex[pair[0]], self._currencyIndex[pair[1]]) for pair in pairs]
+
+        def collect(rates, vols, timestamps):
+            data = {}
+            for pair, i, j in indices:
+                if timestamps[i, j] > since and rates[i, j] and rates[j, i]:
+                    data[pair] = {
+                        'ask': 1 / float(rates[j, i]),
+                        'bid': float(rates[i, j]),
+                        'ask_vol': float(vols[j, i]),
+                        'bid_vol': float(vols[i, j]),
+                        'timestamp': float(timestamps[i, j]),
+                    }
+            return data
+        return self.read(exch, collect)
+
+    def waitForUpdate(self, seen, timeout: float = None):
+        """
+        Given a dictionary of exchange -> the last sequence we read, waits until any exchange has moved
+        past it and returns those exchanges, or an empty list if timeout seconds pass first
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            updated = [exch for exch in self._exchanges if self.sequence(exch) != seen.get(exch)]
+            if updated or (deadline is not None and monotonic() >= deadline):
+                return updated
+            sleep(POLL_INTERVAL)
+
+    def close(self) -> None:
+        """ Detaches this process from the block """
+        self._sequences = None
+        self._arrays = []
+        self._block.close()
+
+    def unlink(self) -> None:
+        """ Frees the block, for the process that created it once every other process has closed it """
+        self._block.unlink()
+
+def runFetcher(name: str, currencies, exchanges, exch, pairs, interval: float, stop, logSettings=None) -> None:
+    """
+    Target for an exchange's fetcher process. Brings up a Market Engine in the process and writes every
+    batch of tickers for the exchange into the snapshot until stop, a multiprocessing Event, is set.
+
+    The process must be spawned rather than forked, a fork would copy the parent's threads' locks but not
+    the threads. logSettings, from logs.settings(), configures logging in the process like the parent's
+    """
+    from market_engine import MarketEngine
+
+    logs.configure(**(logSettings or {}))
+    snapshot = MarketSnapshot(currencies, exchanges, name=name)
+    MarketEngine.initialize(currencies, [exch], pairs)
+    try:
+        while not stop.is_set():
+            try:
+                snapshot.write(exch, MarketEngine.instance().fetchTickers(exch=exch, pairs=pairs))
+            except Exception as e:
+                log.exception("Fetching %s failed: %s", exch, e)
+            stop.wait(interval)
+    finally:
+        snapshot.close()
+        logs.shutdown()                 # a process target exits without running atexit
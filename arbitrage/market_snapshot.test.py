@@ -0,0 +1,66 @@
+import multiprocessing
+import numpy as np
+import unittest
+from constants import Currency, Exchange
+from market_snapshot import MarketSnapshot
+
+CURRENCIES = [Currency.BTC, Currency.ETH, Currency.USDT]
+EXCHANGES = [Exchange.KRAKEN, Exchange.BINANCE]
+PAIRS = [(Currency.ETH, Currency.BTC), (Currency.BTC, Currency.USDT), (Currency.ETH, Currency.USDT)]
+
+def writeRepeatedly(name, count):
+    """ Writes every pair with the same price, so a consistent read always sees a single price """
+    snapshot = MarketSnapshot(CURRENCIES, EXCHANGES, name=name)
+    for k in range(1, count + 1):
+        snapshot.write(Exchange.KRAKEN, {pair: {'ask': k, 'bid': k, 'ask_vol': k, 'bid_vol': k} for pair in PAIRS})
+    snapshot.close()
+
+class TestMarketSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = MarketSnapshot(CURRENCIES, EXCHANGES)
+
+    def tearDown(self):
+        self.snapshot.close()
+        self.snapshot.unlink()
+
+    def test_roundTrip(self):
+        quote = {'ask': '0.0352', 'bid': '0.0350', 'ask_vol': '2.0', 'bid_vol': '3.0'}
+        self.snapshot.write(Exchange.KRAKEN, {PAIRS[0]: quote, (Currency.XRP, Currency.BTC): quote}, timestamp=10)
+        self.assertEqual(self.snapshot.sequence(Exchange.KRAKEN), 2)
+        self.assertEqual(self.snapshot.sequence(Exchange.BINANCE), 0)
+
+        attached = MarketSnapshot(CURRENCIES, EXCHANGES, name=self.snapshot.name)
+        data = attached.marketData(Exchange.KRAKEN, PAIRS)
+        self.assertEqual(list(data.keys()), [PAIRS[0]])
+        self.assertAlmostEqual(data[PAIRS[0]]['ask'], 0.0352)
+        self.assertEqual(data[PAIRS[0]]['bid_vol'], 3.0)
+        self.assertEqual(data[PAIRS[0]]['timestamp'], 10)
+        self.assertEqual(attached.marketData(Exchange.KRAKEN, PAIRS, since=10), {})
+        self.assertEqual(attached.waitForUpdate({Exchange.KRAKEN: 2, Exchange.BINANCE: 0}, timeout=0.01), [])
+        attached.close()
+
+    def test_badQuotesAreSkipped(self):
+        good = {'ask': 2.0, 'bid': 1.0, 'ask_vol': 1.0, 'bid_vol': 1.0}
+        self.snapshot.write(Exchange.KRAKEN, {
+            PAIRS[0]: good,
+            PAIRS[1]: dict(good, ask=0),
+            PAIRS[2]: dict(good, bid='nan'),
+        }, timestamp=1)
+        self.snapshot.write(Exchange.KRAKEN, {PAIRS[0]: {'ask': 'abc', 'bid': 1.0}}, timestamp=2)
+        self.assertEqual(self.snapshot.sequence(Exchange.KRAKEN), 4)      # even, no reader is left waiting
+        data = self.snapshot.marketData(Exchange.KRAKEN, PAIRS)
+        self.assertEqual(list(data.keys()), [PAIRS[0]])
+        self.assertEqual(data[PAIRS[0]]['timestamp'], 1)
+
+    def test_readsAreConsistent(self):
+        writer = multiprocessing.Process(target=writeRepeatedly, args=(self.snapshot.name, 2000))
+        writer.start()
+        bidEdges = ([1, 0, 1], [0, 2, 2])       # ETH -> BTC, BTC -> USDT and ETH -> USDT
+        while writer.is_alive():
+            bids = self.snapshot.read(Exchange.KRAKEN, lambda rates, vols, timestamps: np.unique(rates[bidEdges]).tolist())
+            self.assertEqual(len(bids), 1)
+        writer.join()
+        self.assertEqual(self.snapshot.sequence(Exchange.KRAKEN), 4000)
+
+if __name__ == '__main__':
+    unittest.main()
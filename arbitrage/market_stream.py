@@ -0,0 +1,268 @@
+"""
+Push based market data. Subscribes to the exchanges' websocket book streams, keeps a local copy of each
+order book up to date from the diffs, and pushes the new top of the book straight into the Virtual Market
+as soon as it changes. Includes a replay server which plays back recorded messages so the whole thing
+can be run offline.
+
+Author: Parker Timmerman
+"""
+import asyncio
+import heapq
+import json
+import logs
+import websockets
+
+from constants import Exchange
+from symbol_index import krakenAltName
+from utils import monotonicMs
+from virtual_market import VirtualMarket
+
+KRAKEN_WS_URL = 'wss://ws.kraken.com'
+BINANCE_WS_URL = 'wss://stream.binance.com:9443/stream'
+
+log = logs.getLogger(__name__)
+
+class OrderBook():
+    """
+    Local copy of the book for a single pair, price -> volume for each side. With a depth only that many
+    levels of each side are kept, the exchange stops sending updates for a level once it falls out of the
+    depth we subscribed to, so anything past it would go stale
+    """
+
+    def __init__(self, depth: int = None):
+        self.asks = {}
+        self.bids = {}
+        self._depth = depth
+
+    def apply(self, asks, bids):
+        """ Apply a diff to the book, a level with a volume of 0 is removed """
+        for side, levels in ((self.asks, asks), (self.bids, bids)):
+            for level in levels:
+                price = float(level[0])
+                vol = float(level[1])
+                if vol == 0.0:
+                    side.pop(price, None)
+                else:
+                    side[price] = vol
+        if self._depth:
+            if len(self.asks) > self._depth:
+                self.asks = {price: self.asks[price] for price in heapq.nsmallest(self._depth, self.asks)}
+            if len(self.bids) > self._depth:
+                self.bids = {price: self.bids[price] for price in heapq.nlargest(self._depth, self.bids)}
+
+    def replace(self, asks, bids):
+        """ Replace the whole book with a snapshot """
+        self.asks = {}
+        self.bids = {}
+        self.apply(asks, bids)
+
+    def top(self, depth: int = 10):
+        """
+        Returns the top depth levels of the book in the format the Virtual Market expects, or None if a
+        side is empty
+        """
+        if not self.asks or not self.bids:
+            return None
+        asks = sorted(self.asks.items())[:depth]
+        bids = sorted(self.bids.items(), reverse=True)[:depth]
+        return {
+            'ask': asks[0][0],
+            'bid': bids[0][0],
+            'ask_vol': asks[0][1],
+            'bid_vol': bids[0][1],
+            'asks': asks,
+            'bids': bids,
+        }
+
+class KrakenFeed():
+    """ Speaks Kraken's websocket book protocol """
+    exchange = Exchange.KRAKEN
+    url = KRAKEN_WS_URL
+
+    def __init__(self, pairs, depth: int = 10):
+        self.depth = depth
+        # Kraken's websocket names drop the X/Z prefix from their REST names, i.e. XXBT -> XBT
+        self._names = {'{0}/{1}'.format(krakenAltName(first), krakenAltName(second)): (first, second)
+                       for first, second in pairs}
+
+    def subscribeMessages(self):
+        return [{
+            'event': 'subscribe',
+            'pair': list(self._names.keys()),
+            'subscription': {'name': 'book', 'depth': self.depth},
+        }]
+
+    def parse(self, message):
+        """
+        Returns a list of (pair, isSnapshot, asks, bids) tuples for a message
+
+        Example snapshot:
+        [0, {"as": [["0.5100", "195.0", "1534614057.3"]], "bs": [["0.5096", "30.0", "1534614057.3"]]}, "book-10", "XRP/USD"]
+        Example update:
+        [0, {"a": [["0.5101", "0.0", "1534614248.1"]]}, {"b": [["0.5097", "12.0", "1534614248.1"]]}, "book-10", "XRP/USD"]
+        """
+        if not isinstance(message, list):
+            return []                           # heartbeats and subscription statuses
+        pair = self._names.get(message[-1])
+        if not pair:
+            return []
+        updates = []
+        for payload in message[1:-2]:
+            if 'as' in payload or 'bs' in payload:
+                updates.append((pair, True, payload.get('as', []), payload.get('bs', [])))
+            else:
+                updates.append((pair, False, payload.get('a', []), payload.get('b', [])))
+        return updates
+
+class BinanceFeed():
+    """ Speaks Binance's combined book ticker stream """
+    exchange = Exchange.BINANCE
+    depth = 1                                   # book tickers are only the top of the book
+
+    def __init__(self, pairs):
+        self._symbols = {'{0}{1}'.format(first.value, second.value): (first, second) for first, second in pairs}
+        self.url = '{0}?streams={1}'.format(
+            BINANCE_WS_URL,
+            '/'.join('{}@bookTicker'.format(symbol.lower()) for symbol in self._symbols.keys()))
+
+    def subscribeMessages(self):
+        return []                               # subscriptions are part of the url
+
+    def parse(self, message):
+        """
+        Returns a list of (pair, isSnapshot, asks, bids) tuples for a message, every book ticker message is
+        a complete top of the book so it is treated as a snapshot
+
+        Example message:
+        {"stream": "xrpusdt@bookTicker", "data": {"u": 400900217, "s": "XRPUSDT", "b": "0.5096", "B": "30.0", "a": "0.5100", "A": "195.0"}}
+        """
+        data = message.get('data', message) if isinstance(message, dict) else None
+        if not data or 's' not in data:
+            return []
+        pair = self._symbols.get(data['s'])
+        if not pair:
+            return []
+        return [(pair, True, [(data['a'], data['A'])], [(data['b'], data['B'])])]
+
+FEEDS = {
+    Exchange.KRAKEN: KrakenFeed,
+    Exchange.BINANCE: BinanceFeed,
+}
+
+class MarketStream():
+    """
+    Subscribes to an exchange's book stream and keeps the Virtual Market up to date
+
+    onUpdate(exch, marketData) is called with the new top of the book for every pair that changed, and
+    defaults to writing it into the Virtual Market. onChange() is called once per message that changed
+    anything, which is where an arbitrage scan should be triggered.
+    """
+
+    def __init__(self, exch: Exchange, pairs, onUpdate=None, onChange=None, url=None, reconnectDelay: float = 5.0):
+        if exch not in FEEDS:
+            raise NotImplementedError('streaming is not implemented for {}'.format(exch))
+        self._exchange = exch
+        self._feed = FEEDS[exch](pairs)
+        self._url = url or self._feed.url
+        self._books = {pair: OrderBook(depth=self._feed.depth) for pair in pairs}
+        self._tops = {}
+        self._onUpdate = onUpdate or self._updateVirtualMarket
+        self._onChange = onChange
+        self._reconnectDelay = reconnectDelay
+        self._running = False
+
+    def _updateVirtualMarket(self, exch: Exchange, marketData):
+        VirtualMarket.instance().updateExchange(exch=exch, marketData=marketData)
+
+    def handleMessage(self, raw) -> bool:
+        """
+        Applies a raw message from the stream, returns whether the top of any book changed. Changed pairs
+        are stamped with the time the message was applied
+        """
+        message = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+        received = monotonicMs()
+        marketData = {}
+        for pair, isSnapshot, asks, bids in self._feed.parse(message):
+            book = self._books[pair]
+            if isSnapshot:
+                book.replace(asks, bids)
+            else:
+                book.apply(asks, bids)
+            top = book.top()
+            if top and top != self._tops.get(pair):
+                self._tops[pair] = top
+                marketData[pair] = dict(top, timestamp=received)
+
+        if not marketData:
+            return False
+        self._onUpdate(self._exchange, marketData)
+        if self._onChange:
+            self._onChange()
+        return True
+
+    async def run(self):
+        """
+        Connects and applies messages until stop() is called, reconnecting if the connection drops or the
+        handshake is rejected. Messages that can't be parsed are logged and skipped
+        """
+        self._running = True
+        while self._running:
+            try:
+                async with websockets.connect(self._url) as ws:
+                    self._ws = ws
+                    for message in self._feed.subscribeMessages():
+                        await ws.send(json.dumps(message))
+                    async for raw in ws:
+                        try:
+                            self.handleMessage(raw)
+                        except (ValueError, KeyError, IndexError, TypeError) as e:
+                            # One bad message shouldn't take the stream down, skip it and carry on
+                            log.warning("%s stream sent a message we couldn't parse: %s %r", self._exchange, e, raw)
+            except (OSError, websockets.WebSocketException) as e:
+                if not self._running:
+                    break
+                log.warning("%s stream disconnected: %s, reconnecting in %ss", self._exchange, e, self._reconnectDelay)
+                await asyncio.sleep(self._reconnectDelay)
+            else:
+                if self._running:
+                    await asyncio.sleep(self._reconnectDelay)
+
+    async def stop(self):
+        self._running = False
+        ws = getattr(self, '_ws', None)
+        if ws:
+            await ws.close()
+
+async def streamAll(streams):
+    """ Runs a list of market streams together until they are all stopped """
+    await asyncio.gather(*(stream.run() for stream in streams))
+
+class ReplayServer():
+    """
+    Local stand in for an exchange's websocket server. Every client that connects gets the recorded
+    messages played back in order, interval seconds apart, and anything the client sends is ignored.
+    """
+
+    def __init__(self, messages, host: str = 'localhost', port: int = 0, interval: float = 0.0):
+        self._messages = messages
+        self._host = host
+        self._port = port
+        self._interval = interval
+        self._server = None
+
+    async def _handler(self, ws):
+        for message in self._messages:
+            await ws.send(message if isinstance(message, str) else json.dumps(message))
+            if self._interval:
+                await asyncio.sleep(self._interval)
+        await ws.wait_closed()
+
+    async def start(self) -> str:
+        """ Starts serving and returns the url to connect to """
+        self._server = await websockets.serve(self._handler, self._host, self._port)
+        port = self._server.sockets[0].getsockname()[1]
+        return 'ws://{0}:{1}'.format(self._host, port)
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
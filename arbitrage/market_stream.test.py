@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+from constants import Currency, Exchange
+from market_stream import MarketStream, OrderBook, ReplayServer
+from virtual_market import VirtualMarket
+
+PAIRS = [(Currency.XRP, Currency.USDT)]
+KRAKEN_MESSAGES = [
+    {'event': 'systemStatus', 'status': 'online'},
+    [0, {'as': [['0.5100', '195.0', '1'], ['0.5110', '20.0', '1']], 'bs': [['0.5096', '30.0', '1']]}, 'book-10', 'XRP/USD'],
+    [0, {'a': [['0.5100', '0.0', '2']]}, 'book-10', 'XRP/USD'],
+    [0, {'b': [['0.5098', '12.0', '3']]}, 'book-10', 'XRP/USD'],
+]
+
+class TestOrderBook(unittest.TestCase):
+    def test_keepsSubscribedDepth(self):
+        book = OrderBook(depth=2)
+        book.replace(asks=[('0.51', '1.0'), ('0.52', '2.0')], bids=[('0.50', '1.0'), ('0.49', '2.0')])
+        # A better level pushes 0.52 out of the depth, the exchange won't tell us when it changes
+        book.apply(asks=[('0.505', '3.0')], bids=[('0.48', '4.0')])
+        self.assertEqual(book.asks, {0.505: 3.0, 0.51: 1.0})
+        self.assertEqual(book.bids, {0.50: 1.0, 0.49: 2.0})
+        book.apply(asks=[('0.505', '0.0')], bids=[])
+        self.assertEqual(book.top()['asks'], [(0.51, 1.0)])
+
+class TestMarketStream(unittest.TestCase):
+    def setUp(self):
+        VirtualMarket.initialize([Currency.XRP, Currency.USDT], [Exchange.KRAKEN], PAIRS)
+
+    def test_appliesDiffs(self):
+        stream = MarketStream(exch=Exchange.KRAKEN, pairs=PAIRS)
+        for message in KRAKEN_MESSAGES:
+            stream.handleMessage(message)
+        graph = VirtualMarket.instance().getMarketData(Exchange.KRAKEN)
+        self.assertEqual(graph.getEdge(Currency.XRP, Currency.USDT).getExchangeRate(), 0.5098)
+        self.assertAlmostEqual(graph.getEdge(Currency.USDT, Currency.XRP).getExchangeRate(), 1 / 0.5110)
+
+    def test_replayServer(self):
+        changes = []
+
+        async def replay():
+            server = ReplayServer(KRAKEN_MESSAGES[:1] + ['not json'] + KRAKEN_MESSAGES[1:])   # bad messages are skipped
+            url = await server.start()
+            stream = MarketStream(exch=Exchange.KRAKEN, pairs=PAIRS, url=url, onChange=lambda: changes.append(1))
+            task = asyncio.ensure_future(stream.run())
+            while len(changes) < 3:
+                await asyncio.sleep(0.01)
+            await stream.stop()
+            await task
+            await server.close()
+
+        asyncio.run(asyncio.wait_for(replay(), timeout=5))
+        self.assertEqual(len(changes), 3)
+
+if __name__ == '__main__':
+    unittest.main()
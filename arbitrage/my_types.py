@@ -1,6 +1,8 @@
 from collections import namedtuple
 
 class ValuePair(object):
+    __slots__ = ('amt', 'amt_usd')
+
     def __init__(
         self,
         amt,
@@ -13,6 +15,8 @@ class ValuePair(object):
         return "Amount: {0} Amount USD: {1}".format(self.amt, self.amt_usd)
 
 class Order(object):
+    __slots__ = ('exchange', 'buyOrSell', 'orderType', 'pair', 'price', 'volume')
+
     def __init__(
         self,
         exchange,
@@ -0,0 +1,131 @@
+"""
+Searches for negative cycles on a pool of worker processes, so a large multi-exchange graph can use every
+core instead of one thread under the GIL.
+
+The weight matrix is copied once per search into a block of shared memory which every worker maps, so
+tasks only carry the name of the block, the size of the matrix, and which start nodes to search from.
+Each worker enumerates the cycles whose lowest indexed node is one of its starts (see cycle_enumerator),
+so no two workers find the same loop, and the results are merged, deduplicated and sorted by weight.
+
+A search blocks until every worker is done, so the shared matrix is never rewritten while it is being read.
+
+Workers come from a forkserver rather than being forked from the engine, which by then has threads of its
+own that a fork would copy mid flight. The forkserver preloads this module, so a worker starts without
+importing numpy again, and the whole pool is started up front so the first search doesn't pay for it.
+
+Author: Parker Timmerman
+"""
+import logs
+import multiprocessing
+import numpy as np
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from cycle_enumerator import enumerateNegativeCycles
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+log = logs.getLogger(__name__)
+
+SHARDS_PER_WORKER = 4                   # more shards than workers evens out starts that take longer
+STARTUP_TIMEOUT = 60                    # seconds to wait for every worker to come up
+
+_attached = {}                          # shared memory blocks a worker has mapped, by name
+_started = None                         # barrier every worker waits at once, so the pool starts all of them
+
+def _initWorker(started):
+    global _started
+    _started = started
+
+def _waitForPool():
+    """ Worker task, returns once every worker of the pool is running one of these """
+    _started.wait(timeout=STARTUP_TIMEOUT)
+    return os.getpid()
+
+def _attach(name: str):
+    """ Maps a shared memory block in a worker, once per process, closing any block mapped for an older search """
+    block = _attached.get(name)
+    if block is None:
+        for stale in list(_attached):
+            _attached.pop(stale).close()
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before 3.13 attaching always registers the block, but workers share the parent's resource
+            # tracker which already has it, so that is harmless and the parent still unlinks it
+            block = shared_memory.SharedMemory(name=name)
+        _attached[name] = block
+    return block
+
+def _searchShard(name: str, numNodes: int, starts: List[int], maxLength: int, tolerance: float):
+    """ Worker task, enumerates the negative cycles starting from the given nodes of the shared matrix """
+    block = _attach(name)
+    weights = np.ndarray((numNodes, numNodes), dtype=np.float64, buffer=block.buf)
+    return enumerateNegativeCycles(weights, maxLength, starts=starts, tolerance=tolerance)
+
+def shardStarts(numNodes: int, numShards: int) -> List[List[int]]:
+    """
+    Splits the start nodes into shards. Low indexed starts have the most nodes above them to search, so
+    the starts are dealt out in a snake, 0 1 2 2 1 0 0 1 2 ..., to give every shard a similar mix
+    """
+    shards = [[] for _ in range(max(1, min(numShards, numNodes)))]
+    for start in range(numNodes):
+        turn, offset = divmod(start, len(shards))
+        shards[offset if turn % 2 == 0 else len(shards) - 1 - offset].append(start)
+    return [shard for shard in shards if shard]
+
+class ParallelCycleSearch():
+    """ Pool of worker processes sharing one weight matrix, call close() once done with it """
+
+    def __init__(self, workers: int = None):
+        self._workers = workers or os.cpu_count() or 1
+        self._block = None
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        started = context.Barrier(self._workers)
+        self._pool = ProcessPoolExecutor(max_workers=self._workers, mp_context=context,
+                                         initializer=_initWorker, initargs=(started,))
+        # The pool only starts a worker when a task is waiting and none are idle, so hold every worker at
+        # the barrier until they are all up
+        pids = {future.result(timeout=STARTUP_TIMEOUT) for future in
+                [self._pool.submit(_waitForPool) for _ in range(self._workers)]}
+        log.debug("Started %d search workers", len(pids))
+
+    def _share(self, weights):
+        """ Copies the weight matrix into shared memory, growing the block if it doesn't fit """
+        if self._block is None or self._block.size < weights.nbytes:
+            self._release()
+            self._block = shared_memory.SharedMemory(create=True, size=max(weights.nbytes, 8))
+        shared = np.ndarray(weights.shape, dtype=np.float64, buffer=self._block.buf)
+        shared[:] = weights
+        return self._block.name
+
+    def search(self, weights, maxLength: int, tolerance: float = 0.0) -> List[Tuple[List[int], float]]:
+        """
+        Same as enumerateNegativeCycles(weights, maxLength, tolerance=tolerance) but split across the pool.
+        Returns the (cycle, weight) tuples lightest first
+        """
+        numNodes = weights.shape[0]
+        if not numNodes:
+            return []
+        name = self._share(np.ascontiguousarray(weights, dtype=np.float64))
+        futures = [self._pool.submit(_searchShard, name, numNodes, starts, maxLength, tolerance)
+                   for starts in shardStarts(numNodes, self._workers * SHARDS_PER_WORKER)]
+
+        cycles = {}
+        for future in futures:
+            for cycle, weight in future.result():
+                cycles.setdefault(tuple(cycle), weight)
+        log.debug("Parallel search found %d cycles across %d shards", len(cycles), len(futures))
+        return sorted(((list(cycle), weight) for cycle, weight in cycles.items()), key=lambda x: x[1])
+
+    def _release(self):
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    def close(self) -> None:
+        """ Shuts the workers down and frees the shared memory """
+        self._pool.shutdown(wait=True)
+        self._release()
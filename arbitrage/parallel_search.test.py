@@ -0,0 +1,33 @@
+import numpy as np
+import unittest
+from cycle_enumerator import enumerateNegativeCycles
+from parallel_search import ParallelCycleSearch, shardStarts
+
+def randomWeights(numNodes, seed):
+    rng = np.random.default_rng(seed)
+    weights = rng.normal(0.0, 0.1, (numNodes, numNodes))
+    weights[rng.random((numNodes, numNodes)) < 0.4] = np.inf
+    np.fill_diagonal(weights, np.inf)
+    return weights
+
+class TestParallelSearch(unittest.TestCase):
+    def test_shardStarts(self):
+        shards = shardStarts(10, 3)
+        self.assertEqual(shards[0][:2], [0, 5])
+        self.assertEqual(sorted(start for shard in shards for start in shard), list(range(10)))
+        self.assertEqual(shardStarts(2, 8), [[0], [1]])
+
+    def test_matchesSerial(self):
+        search = ParallelCycleSearch(workers=2)
+        try:
+            for seed, numNodes in enumerate([1, 6, 12, 9]):       # the block grows, then gets reused
+                weights = randomWeights(numNodes, seed)
+                expected = sorted(enumerateNegativeCycles(weights, 4), key=lambda x: x[1])
+                found = search.search(weights, 4)
+                self.assertEqual([cycle for cycle, weight in found], [cycle for cycle, weight in expected])
+                self.assertTrue(np.allclose([weight for cycle, weight in found], [weight for cycle, weight in expected]))
+        finally:
+            search.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,83 @@
+import asyncio
+import logging
+import logs
+import multiprocessing
+import tracing
+
 from arbitrage_engine import ArbitrageEngine
 from book_keeper import BookKeeper
+from concurrent.futures import ThreadPoolExecutor
 from market_engine import MarketEngine
+from market_snapshot import MarketSnapshot, runFetcher
+from market_stream import MarketStream, streamAll
+from scheduler import ArbitrageScheduler
 from constants import Exchange, Currency, SafetyValues
+from journal import TradeJournal
+from market_recorder import SnapshotSaver, loadSnapshot, saveSnapshot
+from time import monotonic, sleep
+from utils import hasTransfer, monotonicMs, wallToMonotonicMs
 from virtual_market import VirtualMarket
 
-from pprint import pprint
-from time import sleep
+log = logs.getLogger(__name__)
+
+JOURNAL_DIR = 'journal'
+LOG_PATH = 'moneyman.log'
+MARKET_SNAPSHOT = 'market.snapshot'
+MAX_EDGE_AGE = 10000                    # milliseconds, quotes older than this are left out of the search
+MAX_SNAPSHOT_AGE = 300                  # seconds, older snapshots are too far off the market to value our books with
+SNAPSHOT_INTERVAL = 5                   # seconds between saves of the market snapshot, well inside MAX_EDGE_AGE
+FETCH_INTERVAL = 0.5                    # minimum seconds between ticker batches, so we stay under the rate limits
+BOOK_DEPTH = 10                         # levels of the book fetched for the pairs of a cycle before it is sized, 0 sizes it from the top
+METRICS_PORT = 9100
+SEARCH_WORKERS = 0                      # processes to enumerate cycles on, 0 searches on the scan thread
+
+def seedMarket(exchanges, pairs) -> bool:
+    """
+    Loads the market snapshot saved by the last run into the Virtual Market, stamped with the time it was
+    quoted so anything we fetch replaces it. Returns whether every exchange was seeded with quotes younger
+    than MAX_EDGE_AGE, so the search can use them. Older snapshots, up to MAX_SNAPSHOT_AGE, still seed
+    the market but their edges have expired, they're only good for valuing the books
+    """
+    fresh = set()
+    for timestamp, exchange, marketData in loadSnapshot(MARKET_SNAPSHOT, maxAge=MAX_SNAPSHOT_AGE):
+        if exchange not in exchanges:
+            continue
+        marketData = {pair: values for pair, values in marketData.items() if pair in pairs}
+        seededAt = wallToMonotonicMs(timestamp)
+        VirtualMarket.instance().updateExchange(exch=exchange, marketData=marketData, timestamp=seededAt)
+        if marketData and monotonicMs() - seededAt < MAX_EDGE_AGE:
+            fresh.add(exchange)
+    return fresh == set(exchanges)
+
+
+def fetchInitialTickers(exchanges, pairs):
+    """ Fetches every ticker into the Virtual Market, saves them as the next run's snapshot and revalues our books """
+    marketData = MarketEngine.instance().fetchTickersConcurrent(
+        exchanges=exchanges,
+        pairs=pairs)
+    VirtualMarket.instance().updateMarket(marketData=marketData)
+    saveSnapshot(MARKET_SNAPSHOT, marketData)
+    BookKeeper.instance().revalue()
+
+    log.info("Market Initialized!")
+    if log.isEnabledFor(logging.DEBUG):
+        for exchange, graph in VirtualMarket.instance()._market.items():
+            log.debug("%s:\n%s", exchange, graph.toString())
+
+
+def _logFailure(future):
+    if future.exception():
+        log.error("Startup task failed! %s", future.exception())
+
 
 def initializeEverything():
+    """
+    Brings everything up as quickly as possible. Both exchange clients are built and load their markets
+    at once, the Virtual Market is seeded from the last run's snapshot, and the books are recovered from
+    the journal. Then the first tickers and every balance are fetched together. If the market was seeded
+    with quotes young enough to search we don't wait on the tickers, and if the books were recovered we
+    don't wait on the balances, so the first scan can run straight away.
+    """
     currencies = [
         Currency.BTC,
         Currency.ETH,
@@ -18,86 +88,227 @@ def initializeEverything():
         Exchange.BINANCE,
         Exchange.KRAKEN
     ]
-    MarketEngine.initialize(currencies, exchanges, None)
-    pairs = MarketEngine.instance().supportedCurrencyPairs()
-    
-    ArbitrageEngine.initialize(currencies, exchanges, pairs)
-    BookKeeper.initialize(currencies, exchanges)
-    VirtualMarket.initialize(currencies, exchanges, pairs)
-
     try:
-        marketData = {}
-        for exchange in exchanges:
-            marketData[exchange] = MarketEngine.instance().fetchTickers(
-                exch=exchange, 
-                pairs=pairs)
-        VirtualMarket.instance().updateMarket(marketData=marketData)
-
-        print("Market Initialized!")
-        for key,value in VirtualMarket.instance()._market.items():
-            pprint(value.print())
-
-        for exchange in exchanges:
-            MarketEngine.instance().fetchBalance(exch=exchange)
-        
-        print("Book Keeper Initialized!")
-        pprint(BookKeeper.instance()._balances)
+        MarketEngine.initialize(currencies, exchanges, None)
+        pairs = MarketEngine.instance().supportedCurrencyPairs()
+
+        ArbitrageEngine.initialize(currencies, exchanges, pairs)
+        ArbitrageEngine.instance().setParallelSearch(SEARCH_WORKERS)
+        ArbitrageEngine.instance().setMaxEdgeAge(MAX_EDGE_AGE)
+        BookKeeper.initialize(currencies, exchanges)
+        VirtualMarket.initialize(currencies, exchanges, pairs)
+
+        seeded = seedMarket(exchanges, pairs)
+        journal = TradeJournal(JOURNAL_DIR)
+        replayed = BookKeeper.instance().recover(journal)
+        recovered = bool(replayed or journal.loadSnapshot())
+        if seeded:
+            log.info("Market seeded from %s, not waiting for the first tickers", MARKET_SNAPSHOT)
+        if recovered:
+            log.info("Book Keeper recovered from the journal, replayed %s entries", replayed)
+
+        startup = ThreadPoolExecutor(max_workers=1 + len(exchanges), thread_name_prefix='startup')
+        tickers = startup.submit(fetchInitialTickers, exchanges, pairs)
+        balances = [startup.submit(MarketEngine.instance().fetchBalance, exch=exchange) for exchange in exchanges]
+        startup.shutdown(wait=False)
+        for future in [tickers] + balances:
+            future.add_done_callback(_logFailure)
+
+        if not seeded:
+            tickers.result()
+        if not recovered:
+            for future in balances:
+                future.result()
+
+        log.info("Book Keeper Initialized! %s", BookKeeper.instance().getPositions())
 
     except Exception as e:
-        print("Initialization failed!")
-        pprint(e)
+        log.exception("Initialization failed! %s", e)
         return
 
     return (exchanges, pairs)
 
 
+def findSafeOrders():
+    """
+    Pulls the latest market data into the unified arbitrage graph, where every exchange keeps its own
+    nodes, and looks for a cycle. If it is good enough returns the safe orders to exploit it, otherwise None.
+    We can't withdraw from an exchange yet, so cycles that transfer between exchanges are skipped
+    """
+    ArbitrageEngine.instance().updateUnifiedGraph()
+    graph = ArbitrageEngine.instance()._unifiedGraph
+    arbitrage_path = ArbitrageEngine.instance().findArbitrageIncremental(unified=True)
+    if arbitrage_path:
+        # Something changed enough to create a cycle, rank every cycle in the graph and take the best
+        opportunities = ArbitrageEngine.instance().findAllArbitrage(graph=graph, transfers=False)
+        if opportunities:
+            arbitrage_path = opportunities[0][0]
+        elif hasTransfer(arbitrage_path, graph):
+            arbitrage_path = None
+
+    if not arbitrage_path:
+        log.debug("No arbitrage opportunity found!")
+        return None
+
+    percentGrowth = ArbitrageEngine.instance().verifyArbitrage(path=arbitrage_path, graph=graph)
+    if percentGrowth < SafetyValues.MinimumOpportunity.value:
+        return None
+    if BOOK_DEPTH:
+        if not fetchPathDepth(arbitrage_path, graph):
+            log.info("Couldn't fetch the books along %s", arbitrage_path)
+            return None
+        # The top of the book may have moved since it was polled
+        percentGrowth = ArbitrageEngine.instance().verifyArbitrage(path=arbitrage_path, graph=graph)
+        if percentGrowth < SafetyValues.MinimumOpportunity.value:
+            return None
+    log.info("Arbitrage found: %s", arbitrage_path,
+             extra={'fields': {'growth': percentGrowth, 'edge_ages_ms': graph.pathAges(arbitrage_path)}})
+    orders = ArbitrageEngine.instance().pathToOrders(
+        path=arbitrage_path,
+        graph=graph)
+    log.info("Orders: %s", orders)
+    return MarketEngine.instance().createSafeTrades(orders)
+
+
+def fetchPathDepth(path, graph) -> bool:
+    """
+    Fetches BOOK_DEPTH levels of the book for every pair along a path into the Virtual Market and the
+    unified graph. The market is only polled at the top of the book, one batched request per exchange,
+    a request per pair is only worth it for a cycle we're about to size. Returns whether every edge of
+    the path came back
+    """
+    edges = [graph.getEdge(path[idx], path[idx + 1]) for idx in range(len(path) - 1)]
+    trades = [edge for edge in edges if edge.getAskOrBid() != 'transfer']
+    exchanges = list({edge.getExchange() for edge in trades})
+    pairs = list({edge.getPair() for edge in trades})
+    marketData = MarketEngine.instance().fetchTickersConcurrent(
+        exchanges=exchanges,
+        pairs=pairs,
+        depth=BOOK_DEPTH)
+    # We're on the scan thread, so these land in order with everything the scheduler applies
+    VirtualMarket.instance().updateMarket(marketData=marketData)
+    ArbitrageEngine.instance().updateUnifiedGraph()
+    return not any(graph.getEdge(path[idx], path[idx + 1]).isStale() for idx in range(len(path) - 1))
+
+
+def executeOrders(safe_orders):
+    """ Places every order in a list of safe orders """
+    log.info("Safe Orders: %s", safe_orders)
+    for order in safe_orders:
+        resp = MarketEngine.instance().makeUnsafeTrade(order=order)
+        log.info("Executed Order: %s", order.toStringShort(), extra={'fields': {'response': resp}})
+
+    log.info("Balances: %s", BookKeeper.instance().getPositions(), extra={'fields': {'total_usd': BookKeeper.instance().getTotalUSD()}})
+
+
 def run():
+    """
+    Polls the top of every exchange's books at most once every FETCH_INTERVAL seconds and hands the market
+    data to the scheduler, which scans for arbitrage as soon as it lands. Time spent in each stage is served at
+    http://localhost:9100/metrics
+
+    In every mode the market snapshot is saved every SNAPSHOT_INTERVAL seconds and on the way down, so a
+    quick restart can scan straight away
+    """
+    tracing.enable()
+    metrics = tracing.serve(port=METRICS_PORT)
     exchanges, pairs = initializeEverything()
+    scheduler = ArbitrageScheduler(scan=findSafeOrders, execute=executeOrders)
+    scheduler.start()
+    saver = SnapshotSaver(MARKET_SNAPSHOT, SNAPSHOT_INTERVAL)
 
     searchForOpportunities = True
 
-    while searchForOpportunities:
-        try:
-            marketData = {}
-            for exchange in exchanges:
-                marketData[exchange] = MarketEngine.instance().fetchTickers(
-                    exch=exchange, 
-                    pairs=pairs)
-            VirtualMarket.instance().updateMarket(marketData=marketData)
-
-            ArbitrageEngine.instance().updateGraph()
-            ArbitrageEngine.instance()._graph.print()
-            arbitrage_path = ArbitrageEngine.instance().findArbitrage(
-                graph=ArbitrageEngine.instance()._graph,
-                src=Currency.USDT,
-            )
-
-            if arbitrage_path:
-                percentGrowth = ArbitrageEngine.instance().verifyArbitrage(path=arbitrage_path)
-                if percentGrowth >= SafetyValues.MinimumOpportunity.value:
-                    orders = ArbitrageEngine.instance().pathToOrders(
-                        path=arbitrage_path,
-                        graph=ArbitrageEngine.instance()._graph)
-                    pprint(orders)
-                    safe_orders = MarketEngine.instance().createSafeTrades(orders)
-                    if safe_orders:
-                        print('\n{0}Safe Orders:{1}'.format('\033[92m', '\033[0m'))
-                        pprint(safe_orders)
-                        print('\n\n')
-                        for order in safe_orders:
-                            pprint(MarketEngine.instance().makeUnsafeTrade(order=order))
-                            print("Executed Order: {}".format(order.toStringShort()))
-
-                        pprint(BookKeeper.instance()._balances)
-
-            else:
-                print("{0}No arbitrage opportunity found!{1}\n".format('\033[91m','\033[0m'))
-
-            sleep(5)
-
-        except Exception as e:
-            pprint(e)
-            break
+    try:
+        while searchForOpportunities:
+            started = monotonic()
+            try:
+                marketData = MarketEngine.instance().fetchTickersConcurrent(
+                    exchanges=exchanges,
+                    pairs=pairs,
+                    onStale=scheduler.markStale)
+                for exchange, data in marketData.items():
+                    scheduler.submit(exch=exchange, marketData=data)
+                    saver.update(exch=exchange, marketData=data)
+
+            except Exception as e:
+                log.exception("Fetching market data failed: %s", e)
+                break
+            sleep(max(FETCH_INTERVAL - (monotonic() - started), 0))
+    finally:
+        saver.save()
+        scheduler.stop()
+        metrics.shutdown()
+    log.info("Tick to decision latency p50: %ss p99: %ss", scheduler.latency.percentile(50), scheduler.latency.percentile(99))
+
+
+def runStreaming():
+    """
+    Instead of polling, subscribe to every exchange's book stream and hand every change to the scheduler
+    """
+    tracing.enable()
+    metrics = tracing.serve(port=METRICS_PORT)
+    exchanges, pairs = initializeEverything()
+    scheduler = ArbitrageScheduler(scan=findSafeOrders, execute=executeOrders)
+    scheduler.start()
+    saver = SnapshotSaver(MARKET_SNAPSHOT, SNAPSHOT_INTERVAL)
+
+    def onUpdate(exch, marketData):
+        scheduler.submit(exch=exch, marketData=marketData)
+        saver.update(exch=exch, marketData=marketData)
+
+    streams = [MarketStream(exch=exchange, pairs=pairs, onUpdate=onUpdate) for exchange in exchanges]
+    try:
+        asyncio.run(streamAll(streams))
+    finally:
+        saver.save()
+        scheduler.stop()
+        metrics.shutdown()
+
+def runMultiprocess():
+    """
+    Every exchange is polled by its own process, which writes into a shared memory market snapshot. This
+    process only reads the snapshot, handing the scheduler the pairs of an exchange that were written since
+    we last read it, so fetching never competes with scanning for the interpreter
+    """
+    tracing.enable()
+    metrics = tracing.serve(port=METRICS_PORT)
+    exchanges, pairs = initializeEverything()
+    currencies = ArbitrageEngine.instance()._supported_currencies
+    snapshot = MarketSnapshot(currencies, exchanges)
+    # Spawned, not forked, we already have logging, journal and pool threads a fork wouldn't bring along
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    fetchers = [context.Process(target=runFetcher, name='fetch-{}'.format(exchange.value),
+                                args=(snapshot.name, currencies, exchanges, exchange, pairs, FETCH_INTERVAL, stop, logs.settings()))
+                for exchange in exchanges]
+    for fetcher in fetchers:
+        fetcher.start()
+
+    scheduler = ArbitrageScheduler(scan=findSafeOrders, execute=executeOrders)
+    scheduler.start()
+    saver = SnapshotSaver(MARKET_SNAPSHOT, SNAPSHOT_INTERVAL)
+    seen = {exchange: snapshot.sequence(exchange) for exchange in exchanges}
+    since = {exchange: 0 for exchange in exchanges}     # newest timestamp we've read from each exchange
+    try:
+        while True:
+            for exchange in snapshot.waitForUpdate(seen, timeout=1.0):
+                seen[exchange] = snapshot.sequence(exchange)
+                marketData = snapshot.marketData(exchange, pairs, since=since[exchange])
+                if marketData:
+                    since[exchange] = max(values['timestamp'] for values in marketData.values())
+                    scheduler.submit(exch=exchange, marketData=marketData)
+                    saver.update(exch=exchange, marketData=marketData)
+    finally:
+        saver.save()
+        stop.set()
+        for fetcher in fetchers:
+            fetcher.join()
+        scheduler.stop()
+        metrics.shutdown()
+        snapshot.close()
+        snapshot.unlink()
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    logs.configure(level=logging.INFO, path=LOG_PATH, jsonLines=True)
+    run()
@@ -0,0 +1,185 @@
+"""
+Event driven arbitrage loop. Market data updates are queued and coalesced per edge, cycle detection runs as
+soon as a batch lands, and orders are placed on their own worker so a slow exchange call never holds up
+the next scan.
+
+Author: Parker Timmerman
+"""
+import logs
+import threading
+import tracing
+
+from bisect import bisect_left
+from collections import defaultdict
+from constants import SafetyValues
+from queue import Queue
+from time import monotonic
+from virtual_market import VirtualMarket
+
+log = logs.getLogger(__name__)
+
+class LatencyHistogram():
+    """ Histogram of latencies in seconds, with fixed buckets that double in size from 100 microseconds """
+
+    def __init__(self, smallest: float = 0.0001, buckets: int = 20):
+        self._bounds = [smallest * 2 ** i for i in range(buckets)]
+        self._counts = [0] * (buckets + 1)     # the last bucket holds everything above the largest bound
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._counts[bisect_left(self._bounds, seconds)] += 1
+            self._total += 1
+
+    def count(self) -> int:
+        return self._total
+
+    def percentile(self, percent: float) -> float:
+        """ Returns the upper bound of the bucket the given percentile falls in """
+        with self._lock:
+            if not self._total:
+                return 0.0
+            target = self._total * percent / 100
+            seen = 0
+            for idx, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return self._bounds[idx] if idx < len(self._bounds) else float('inf')
+        return float('inf')
+
+    def buckets(self):
+        """ Returns a list of (upper bound in seconds, count) tuples """
+        with self._lock:
+            return list(zip(self._bounds + [float('inf')], self._counts))
+
+class ArbitrageScheduler():
+    """
+    Runs scan() every time new market data lands and hands whatever orders it returns to execute(orders)
+    on a separate worker thread.
+
+    Updates submitted while a scan is running are coalesced, only the newest values for each
+    (exchange, pair) are applied. Pairs marked stale go through the same queue, so a stale mark is never
+    undone by an older update that was still waiting. The time from the oldest update in a batch arriving
+    until the scan finishes is recorded in the latency histogram.
+    """
+
+    def __init__(self, scan, execute):
+        self._scan = scan
+        self._execute = execute
+        self._pending = {}                      # (exchange, pair) -> (values, time the first unapplied update arrived)
+        self._stale = set()                     # (exchange, pair) to mark stale
+        self._condition = threading.Condition()
+        self._orders = Queue()
+        self._openTrades = threading.BoundedSemaphore(SafetyValues.MaximumOpenTrades.value)
+        self._running = False
+        self._threads = []
+        self.latency = LatencyHistogram()
+
+    def submit(self, exch, marketData) -> None:
+        """
+        Queue market data for an exchange, in the same format VirtualMarket.updateExchange takes
+        """
+        now = monotonic()
+        with self._condition:
+            for pair, values in marketData.items():
+                key = (exch, pair)
+                arrived = self._pending[key][1] if key in self._pending else now
+                self._pending[key] = (values, arrived)
+                self._stale.discard(key)
+            self._condition.notify()
+
+    def markStale(self, exch, pairs) -> None:
+        """
+        Queue pairs of an exchange we failed to get fresh data for to be marked stale, see
+        VirtualMarket.markStale, dropping any update for them that hasn't been applied yet
+        """
+        with self._condition:
+            for pair in pairs:
+                key = (exch, pair)
+                self._pending.pop(key, None)
+                self._stale.add(key)
+            self._condition.notify()
+
+    def _takeBatch(self):
+        with self._condition:
+            while self._running and not self._pending and not self._stale:
+                self._condition.wait()
+            batch, stale = self._pending, self._stale
+            self._pending, self._stale = {}, set()
+            return batch, stale
+
+    def _apply(self, exch, marketData):
+        """
+        Applies market data for an exchange to the Virtual Market. If a malformed quote, like a zero ask,
+        can't be applied, the pairs are applied one at a time so only the bad ones are skipped
+        """
+        try:
+            VirtualMarket.instance().updateExchange(exch=exch, marketData=marketData)
+            return
+        except Exception:
+            pass
+        for pair, values in marketData.items():
+            try:
+                VirtualMarket.instance().updateExchange(exch=exch, marketData={pair: values})
+            except Exception as e:
+                log.warning("Skipping a bad quote for %s on %s %s: %s", pair, exch, values, e)
+
+    def _detectLoop(self):
+        while self._running:
+            batch, stale = self._takeBatch()
+
+            stalePairs = defaultdict(list)
+            for exch, pair in stale:
+                stalePairs[exch].append(pair)
+            for exch, pairs in stalePairs.items():
+                VirtualMarket.instance().markStale(exch=exch, pairs=pairs)
+            if not batch:
+                continue                        # nothing new, and losing edges can't create a cycle
+
+            marketData = defaultdict(dict)
+            for (exch, pair), (values, _) in batch.items():
+                marketData[exch][pair] = values
+            for exch, data in marketData.items():
+                self._apply(exch, data)
+
+            try:
+                with tracing.span('scan'):
+                    orders = self._scan()
+            except Exception as e:
+                log.exception("Scan failed: %s", e)
+                orders = None
+            self.latency.record(monotonic() - min(arrived for _, arrived in batch.values()))
+
+            # Never have more trades in flight than our safety values allow, drop the opportunity instead
+            if orders and self._openTrades.acquire(blocking=False):
+                self._orders.put(orders)
+
+    def _orderLoop(self):
+        while True:
+            orders = self._orders.get()
+            if orders is None:
+                return
+            try:
+                self._execute(orders)
+            except Exception as e:
+                log.exception("Executing orders failed: %s", e)
+            finally:
+                self._openTrades.release()
+
+    def start(self) -> None:
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._detectLoop, name='detector', daemon=True),
+            threading.Thread(target=self._orderLoop, name='orders', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._orders.put(None)
+        for thread in self._threads:
+            thread.join()
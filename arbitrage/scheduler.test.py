@@ -0,0 +1,105 @@
+import threading
+import unittest
+from constants import Currency, Exchange
+from scheduler import ArbitrageScheduler, LatencyHistogram
+from virtual_market import VirtualMarket
+
+PAIR = (Currency.XRP, Currency.USDT)
+OTHER = (Currency.ETH, Currency.USDT)
+
+def ticker(bid, pair=PAIR):
+    return {pair: {'ask': bid + 0.01, 'bid': bid, 'ask_vol': 1.0, 'bid_vol': 1.0}}
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentile(self):
+        histogram = LatencyHistogram(smallest=0.001, buckets=4)
+        for seconds in [0.0005, 0.0015, 0.0015, 0.05]:
+            histogram.record(seconds)
+        self.assertEqual(histogram.count(), 4)
+        self.assertEqual(histogram.percentile(50), 0.002)
+        self.assertEqual(histogram.percentile(100), float('inf'))
+
+class TestArbitrageScheduler(unittest.TestCase):
+    def setUp(self):
+        VirtualMarket.initialize([Currency.XRP, Currency.ETH, Currency.USDT], [Exchange.KRAKEN], [PAIR, OTHER])
+
+    def test_coalescesUpdates(self):
+        release = threading.Event()
+        scannedChanged = threading.Condition()
+        scanned = []
+        def scan():
+            with scannedChanged:
+                scanned.append(VirtualMarket.instance().getMarketData(Exchange.KRAKEN).getEdge(*PAIR).getExchangeRate())
+                scannedChanged.notify_all()
+            release.wait(timeout=5)
+            return None
+
+        scheduler = ArbitrageScheduler(scan=scan, execute=lambda orders: None)
+        scheduler.start()
+        scheduler.submit(Exchange.KRAKEN, ticker(0.5))
+        with scannedChanged:
+            self.assertTrue(scannedChanged.wait_for(lambda: scanned, timeout=5))
+        # These all land while the first scan is still running, so only the last one should be scanned
+        for bid in [0.6, 0.7, 0.8]:
+            scheduler.submit(Exchange.KRAKEN, ticker(bid))
+        release.set()
+        with scannedChanged:
+            self.assertTrue(scannedChanged.wait_for(lambda: len(scanned) >= 2, timeout=5))
+        scheduler.stop()
+        self.assertEqual(scanned, [0.5, 0.8])
+        self.assertEqual(scheduler.latency.count(), 2)
+
+    def test_staleMarksDropPendingUpdates(self):
+        release = threading.Event()
+        scannedChanged = threading.Condition()
+        scanned = []
+        def scan():
+            with scannedChanged:
+                scanned.append(VirtualMarket.instance().getMarketData(Exchange.KRAKEN).getEdge(*PAIR).isStale())
+                scannedChanged.notify_all()
+            release.wait(timeout=5)
+            return None
+
+        scheduler = ArbitrageScheduler(scan=scan, execute=lambda orders: None)
+        scheduler.start()
+        scheduler.submit(Exchange.KRAKEN, ticker(0.5))
+        with scannedChanged:
+            self.assertTrue(scannedChanged.wait_for(lambda: scanned, timeout=5))
+        # The fetch for PAIR timed out after an older quote for it was queued, the quote must not win
+        scheduler.submit(Exchange.KRAKEN, ticker(0.6))
+        scheduler.markStale(Exchange.KRAKEN, [PAIR])
+        scheduler.submit(Exchange.KRAKEN, ticker(2.0, pair=OTHER))
+        release.set()
+        with scannedChanged:
+            self.assertTrue(scannedChanged.wait_for(lambda: len(scanned) >= 2, timeout=5))
+        scheduler.stop()
+        self.assertEqual(scanned, [False, True])
+        self.assertEqual(VirtualMarket.instance().getMarketData(Exchange.KRAKEN).getEdge(*PAIR).getExchangeRate(), 0.5)
+
+    def test_badQuoteIsSkipped(self):
+        scannedChanged = threading.Condition()
+        scanned = []
+        def scan():
+            with scannedChanged:
+                market = VirtualMarket.instance().getMarketData(Exchange.KRAKEN)
+                scanned.append(tuple(edge.getExchangeRate() if edge else None for edge in (market.getEdge(*PAIR), market.getEdge(*OTHER))))
+                scannedChanged.notify_all()
+            return None
+
+        scheduler = ArbitrageScheduler(scan=scan, execute=lambda orders: None)
+        scheduler.start()
+        bad = ticker(0.5)
+        bad[PAIR]['ask'] = 0.0
+        bad.update(ticker(2.0, pair=OTHER))
+        scheduler.submit(Exchange.KRAKEN, bad)
+        with scannedChanged:
+            self.assertTrue(scannedChanged.wait_for(lambda: scanned, timeout=5))
+        # The detector has to survive the bad quote to see the next one
+        scheduler.submit(Exchange.KRAKEN, ticker(0.6))
+        with scannedChanged:
+            self.assertTrue(scannedChanged.wait_for(lambda: len(scanned) >= 2, timeout=5))
+        scheduler.stop()
+        self.assertEqual(scanned, [(None, 2.0), (0.6, 2.0)])
+
+if __name__ == '__main__':
+    unittest.main()
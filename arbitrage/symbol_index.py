@@ -0,0 +1,79 @@
+"""
+Resolves an exchange's symbol for a pair, like 'XETHXXBT', 'XBT/USD' or 'ETHBTC', to a (Currency, Currency)
+pair. Every name an exchange uses for a currency is put into a prefix trie once, so resolving a symbol is a
+single walk down the trie followed by a hash lookup of whatever is left over, O(len(symbol)), instead of
+trying every currency or every pair of currencies against it.
+
+Author: Parker Timmerman
+"""
+from constants import Currency, Exchange, nTOk
+
+SEPARATORS = '/-_'
+_END = ''                                       # trie key marking that a name ends at this node
+
+class SymbolIndex():
+    """ Index of names -> currency for one exchange's naming rules """
+
+    def __init__(self, names):
+        """ names is a dictionary of every name the exchange uses -> the currency it stands for """
+        self._names = dict(names)
+        self._trie = {}
+        for name, currency in self._names.items():
+            node = self._trie
+            for char in name:
+                node = node.setdefault(char, {})
+            node[_END] = currency
+
+    def currency(self, name: str):
+        """ Returns the currency an exchange name stands for, or None """
+        return self._names.get(name)
+
+    def resolve(self, symbol: str, currencies=None):
+        """
+        Returns the (first, second) currencies of an exchange symbol, or None if it isn't two names we know.
+        Symbols may separate the names with any of SEPARATORS. If currencies is given, a set of the
+        currencies we care about, pairs with anything else resolve to None
+        """
+        node = self._trie
+        for idx, char in enumerate(symbol):
+            node = node.get(char)
+            if node is None:
+                return None
+            if _END in node:
+                rest = symbol[idx + 1:]
+                if rest[:1] and rest[0] in SEPARATORS:
+                    rest = rest[1:]
+                second = self._names.get(rest)
+                if second is not None:
+                    pair = (node[_END], second)
+                    if currencies is None or (pair[0] in currencies and pair[1] in currencies):
+                        return pair
+        return None
+
+def krakenAltName(currency: Currency) -> str:
+    """ Kraken's short name for a currency, its REST name without the X/Z prefix, i.e. XXBT -> XBT """
+    symbol = nTOk[currency.value]
+    if len(symbol) == 4 and symbol[0] in 'XZ':
+        return symbol[1:]
+    return symbol
+
+def _krakenNames():
+    """
+    Every name Kraken uses for a currency. Its REST api names pairs with the full names, its websocket api
+    with the short ones, and some REST pairs mix the two, like XRPXBT
+    """
+    names = {}
+    for currency in Currency:
+        if currency.value in nTOk:
+            names[nTOk[currency.value]] = currency
+            names[krakenAltName(currency)] = currency
+    return names
+
+SYMBOLS = {
+    Exchange.KRAKEN: SymbolIndex(_krakenNames()),
+    Exchange.BINANCE: SymbolIndex({currency.value: currency for currency in Currency}),
+}
+
+def resolveSymbol(exch: Exchange, symbol: str, currencies=None):
+    """ Resolves a symbol with an exchange's index, see SymbolIndex.resolve """
+    return SYMBOLS[exch].resolve(symbol, currencies)
@@ -0,0 +1,39 @@
+import unittest
+from constants import Currency, Exchange
+from symbol_index import SymbolIndex, krakenAltName, resolveSymbol
+
+class TestSymbolIndex(unittest.TestCase):
+    def test_kraken(self):
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'XETHXXBT'), (Currency.ETH, Currency.BTC))
+        self.assertIsNone(resolveSymbol(Exchange.KRAKEN, 'XETHXXBT.d'))
+        self.assertIsNone(resolveSymbol(Exchange.KRAKEN, 'XETH'))
+
+    def test_binance(self):
+        self.assertEqual(resolveSymbol(Exchange.BINANCE, 'ETHBTC'), (Currency.ETH, Currency.BTC))
+        self.assertEqual(resolveSymbol(Exchange.BINANCE, 'ETH/BTC'), (Currency.ETH, Currency.BTC))
+
+    def test_currencies(self):
+        self.assertIsNone(resolveSymbol(Exchange.BINANCE, 'ETHBTC', {Currency.ETH}))
+        self.assertEqual(resolveSymbol(Exchange.BINANCE, 'ETHBTC', {Currency.ETH, Currency.BTC}),
+                         (Currency.ETH, Currency.BTC))
+
+    def test_sharedPrefix(self):
+        # 'AB' is a prefix of 'ABC', the walk has to keep going past it
+        index = SymbolIndex({'AB': 1, 'ABC': 2, 'D': 3, 'CD': 4})
+        self.assertEqual(index.resolve('ABCD'), (1, 4))
+        self.assertEqual(index.resolve('ABCD', {2, 3}), (2, 3))
+
+    def test_altName(self):
+        self.assertEqual(krakenAltName(Currency.BTC), 'XBT')
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'XETH/ZUSD'), (Currency.ETH, Currency.USDT))
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'XBT/USD'), (Currency.BTC, Currency.USDT))
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'XRPXBT'), (Currency.XRP, Currency.BTC))
+
+    def test_mixedNames(self):
+        # Some of Kraken's pair names mix a short and a full name
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'ETH/XXBT'), (Currency.ETH, Currency.BTC))
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'XXRPXBT'), (Currency.XRP, Currency.BTC))
+        self.assertEqual(resolveSymbol(Exchange.KRAKEN, 'LTCZUSD'), (Currency.LTC, Currency.USDT))
+
+if __name__ == '__main__':
+    unittest.main()
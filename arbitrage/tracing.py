@@ -0,0 +1,201 @@
+"""
+Lightweight tracing for the hot path. Each stage of a tick, fetching, updating the market, updating the
+graph, detecting cycles and placing trades, is wrapped in a span which times it with the monotonic clock.
+The most recent durations of every stage are kept in a fixed size ring buffer, and the aggregates can be
+written to a file or served in the Prometheus text format.
+
+Tracing is off until enable() is called, and while it is off span() hands back a shared no-op object so
+the instrumented code pays for little more than a function call.
+
+Usage:
+    tracing.enable()
+    with tracing.span('updateGraph'):
+        ...
+    tracing.serve(port=9100)        # or tracing.writeFile('metrics.prom')
+
+Author: Parker Timmerman
+"""
+import os
+import threading
+
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+DEFAULT_CAPACITY = 1024
+METRIC_NAME = 'moneyman_stage_seconds'
+
+class StageStats():
+    """ Ring buffer of the most recent durations of one stage, plus running totals over its lifetime """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._durations = [0.0] * capacity
+        self._capacity = capacity
+        self._next = 0
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._durations[self._next] = seconds
+            self._next = (self._next + 1) % self._capacity
+            self._count += 1
+            self._sum += seconds
+
+    def count(self) -> int:
+        return self._count
+
+    def total(self) -> float:
+        return self._sum
+
+    def percentile(self, percent: float) -> float:
+        """ Returns the given percentile of the durations currently in the buffer, in seconds """
+        with self._lock:
+            window = sorted(self._durations[:min(self._count, self._capacity)])
+        if not window:
+            return 0.0
+        idx = min(len(window) - 1, int(len(window) * percent / 100))
+        return window[idx]
+
+    def summary(self):
+        """ Returns a dictionary with the count, sum, p50, p99 and max of this stage """
+        with self._lock:
+            window = sorted(self._durations[:min(self._count, self._capacity)])
+            count = self._count
+            total = self._sum
+        if not window:
+            return {'count': count, 'sum': total, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'count': count,
+            'sum': total,
+            'p50': window[min(len(window) - 1, len(window) // 2)],
+            'p99': window[min(len(window) - 1, int(len(window) * 0.99))],
+            'max': window[-1],
+        }
+
+class _Span():
+    """ Times the block it wraps and records the duration against its stage """
+    __slots__ = ('_stats', '_start')
+
+    def __init__(self, stats: StageStats):
+        self._stats = stats
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._stats.record(perf_counter() - self._start)
+        return False
+
+class _NullSpan():
+    """ Stand in for a span while tracing is disabled """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+_enabled = False
+_capacity = DEFAULT_CAPACITY
+_stages = {}
+_stagesLock = threading.Lock()
+
+def enable(capacity: int = DEFAULT_CAPACITY) -> None:
+    """ Turn tracing on, capacity is the number of recent durations kept for each new stage """
+    global _enabled, _capacity
+    _capacity = capacity
+    _enabled = True
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+def isEnabled() -> bool:
+    return _enabled
+
+def reset() -> None:
+    """ Forget every stage recorded so far """
+    with _stagesLock:
+        _stages.clear()
+
+def stage(name: str) -> StageStats:
+    """ Returns the stats for a stage, creating them the first time the stage is seen """
+    stats = _stages.get(name)
+    if stats is None:
+        with _stagesLock:
+            stats = _stages.setdefault(name, StageStats(_capacity))
+    return stats
+
+def span(name: str):
+    """ Returns a context manager which times its block as the given stage, or a no-op if tracing is off """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(stage(name))
+
+def traced(name: str):
+    """ Decorator which times every call of a function as the given stage """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(stage(name)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summary():
+    """ Returns a dictionary of stage name -> summary for every stage recorded so far """
+    with _stagesLock:
+        stages = list(_stages.items())
+    return {name: stats.summary() for name, stats in sorted(stages)}
+
+def exportText() -> str:
+    """ Returns every stage's aggregates in the Prometheus text exposition format """
+    lines = [
+        '# HELP {} Time spent in each stage of the trade pipeline'.format(METRIC_NAME),
+        '# TYPE {} summary'.format(METRIC_NAME),
+    ]
+    for name, stats in summary().items():
+        lines.append('{0}{{stage="{1}",quantile="0.5"}} {2:.9f}'.format(METRIC_NAME, name, stats['p50']))
+        lines.append('{0}{{stage="{1}",quantile="0.99"}} {2:.9f}'.format(METRIC_NAME, name, stats['p99']))
+        lines.append('{0}_sum{{stage="{1}"}} {2:.9f}'.format(METRIC_NAME, name, stats['sum']))
+        lines.append('{0}_count{{stage="{1}"}} {2}'.format(METRIC_NAME, name, stats['count']))
+    return '\n'.join(lines) + '\n'
+
+def writeFile(path: str) -> None:
+    """ Writes exportText() to a file, replacing it atomically so a reader never sees half a file """
+    tmp = '{}.tmp'.format(path)
+    with open(tmp, 'w') as fs:
+        fs.write(exportText())
+    os.replace(tmp, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = exportText().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass                                    # scrapes shouldn't flood the console
+
+def serve(port: int = 9100, host: str = 'localhost'):
+    """
+    Serves exportText() at /metrics on a background thread, returns the server so it can be shut down.
+    Pass port 0 to pick any free port, server.server_address has the one chosen
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import tracing
+import unittest
+from urllib.request import urlopen
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        tracing.reset()
+        tracing.enable(capacity=4)
+
+    def tearDown(self):
+        tracing.disable()
+        tracing.reset()
+
+    def test_disabledSpansRecordNothing(self):
+        tracing.disable()
+        with tracing.span('fetch'):
+            pass
+        self.assertEqual(tracing.summary(), {})
+
+    def test_ringBufferKeepsMostRecent(self):
+        stats = tracing.stage('detect')
+        for seconds in [10.0, 1.0, 2.0, 3.0, 4.0]:
+            stats.record(seconds)
+        summary = stats.summary()
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['sum'], 20.0)
+        self.assertEqual(summary['max'], 4.0)          # 10.0 has been overwritten
+        self.assertEqual(summary['p50'], 3.0)
+
+    def test_tracedDecorator(self):
+        @tracing.traced('updateGraph')
+        def work(x):
+            return x * 2
+        self.assertEqual(work(3), 6)
+        self.assertEqual(tracing.summary()['updateGraph']['count'], 1)
+
+    def test_export(self):
+        with tracing.span('fetch'):
+            pass
+        text = tracing.exportText()
+        self.assertIn('moneyman_stage_seconds_count{stage="fetch"} 1', text)
+
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.prom')
+        tracing.writeFile(path)
+        with open(path) as fs:
+            self.assertEqual(fs.read(), text)
+
+        server = tracing.serve(port=0)
+        try:
+            body = urlopen('http://localhost:{}/metrics'.format(server.server_address[1])).read().decode('utf-8')
+        finally:
+            server.shutdown()
+        self.assertIn('quantile="0.99"', body)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,9 @@
-from constants import TimeUnit
+import numpy as np
+
+from constants import feeMap, TimeUnit
 from functools import partial
 from math import floor
-from time import time
+from time import monotonic, time
 
 def timestamp(unit: TimeUnit = TimeUnit.Seconds):
     """ 
@@ -11,6 +13,14 @@ def timestamp(unit: TimeUnit = TimeUnit.Seconds):
     ts = time() if unit is TimeUnit.Seconds else time() * 1000
     return floor(ts)
 
+def monotonicMs() -> int:
+    """ Milliseconds on the monotonic clock, what edges are stamped with so their ages can't jump with the wall clock """
+    return int(monotonic() * 1000)
+
+def wallToMonotonicMs(ts: float) -> int:
+    """ Converts a wall clock time in seconds, like one saved to disk, to the monotonic milliseconds it corresponds to """
+    return monotonicMs() - int((time() - ts) * 1000)
+
 def loadKeys(path):
     """ Helper method to load API keys from file """
     with open(path) as fs:
@@ -22,30 +32,16 @@ def loadKeys(path):
 loadKrakenKeys = partial(loadKeys, 'keys/kraken.key')
 loadBinanceKeys = partial(loadKeys, 'keys/binance.key')
 
-def splitPair(currencies, pair) -> (str, str):
-    """ Given a list of currencies, splits a given pair """
-    for currency in currencies:
-        if pair.startswith(currency):
-            return (pair[:len(currency)], pair[len(currency):])
-
-def validPair(currencies, pair):
-    """
-    Given a list of currencies we support trading on, determins if the pair is valid
-    """
-    for i in range(len(currencies)):
-        for j in range(i + 1, len(currencies)):
-            if currencies[i] in pair and currencies[j] in pair:
-                return True
-    return False
-
 def trimArbitragePath(path):
     """
     Sometimes Bellman Ford can result in extra currencies being appended to the end of the path
-    Remove currencies until we find the one that we start with.
+    Cut the path off after the last time we get back to the one that we start with.
     """
     start = path[0]
-    while not path[-1] == start:
-        path.remove(path[-1])
+    end = len(path)
+    while path[end - 1] != start:
+        end -= 1
+    del path[end:]
     return path
 
 def getMinimumVolumeOfPath(path, graph):
@@ -60,3 +56,88 @@ def getMinimumVolumeOfPath(path, graph):
         volumes.append(graph.getEdge(first, second).getVolume())
     return min(volumes)
 
+UNLIMITED = 1e18                # stand in for the volume of edges without a book, like transfers
+
+def nodeCurrency(node):
+    """ Nodes of the unified graph are (Exchange, Currency), returns just the currency of any node """
+    return node[1] if isinstance(node, tuple) else node
+
+def hasTransfer(path, graph) -> bool:
+    """ Whether any edge of the path moves funds from one exchange to another """
+    return any(graph.getEdge(path[idx], path[idx + 1]).getAskOrBid() == 'transfer' for idx in range(len(path) - 1))
+
+def _fillCurve(src, edge, fees):
+    """
+    Given the source node of an edge, returns (cumIn, cumOut) arrays describing how much of the source
+    currency each level of the book absorbs and how much comes out the other side after fees.
+    Volumes are in terms of the edge's volume symbol, so for an ask edge they get converted to the
+    amount of the source currency needed to buy them.
+    """
+    levels = edge.getLevels()
+    rates = levels[:, 0]
+    vols = levels[:, 1]
+    capacity = vols if edge.getVolumeSymbol() == nodeCurrency(src) else vols / rates
+    capacity = np.where(np.isfinite(capacity), capacity, UNLIMITED)
+    fee = (fees or {}).get(edge.getExchange(), feeMap.get(edge.getExchange(), (0.0, 0.0))[1])
+    cumIn = np.concatenate(([0.0], np.cumsum(capacity)))
+    cumOut = np.concatenate(([0.0], np.cumsum(capacity * rates))) * (1 - fee)
+    return cumIn, cumOut
+
+def getOptimalVolumeOfPath(path, graph, fees=None):
+    """
+    Given a path, walks the levels of the book along every edge and finds the amount of the starting
+    currency to put in that maximises the absolute profit after fees.
+
+    The amount that comes out of a path is a concave, piecewise linear function of the amount put in,
+    so the best amount is always at a point where one of the edges moves on to its next level. Those
+    points get mapped back to the starting currency and the profit is evaluated at all of them at once.
+
+    fees is a dictionary of exchange to fee, exchanges missing from it are charged the taker fee from feeMap.
+    Returns (volume, profit) both in terms of the starting currency
+    """
+    curves = [_fillCurve(path[idx], graph.getEdge(path[idx], path[idx + 1]), fees) for idx in range(len(path) - 1)]
+
+    candidates = [np.zeros(1)]
+    for k, (cumIn, _) in enumerate(curves):
+        amount = cumIn
+        for prevIn, prevOut in reversed(curves[:k]):
+            amount = np.interp(amount, prevOut, prevIn)
+        candidates.append(amount)
+    candidates = np.unique(np.concatenate(candidates))
+
+    amount = candidates
+    feasible = np.ones(len(candidates), dtype=bool)
+    for cumIn, cumOut in curves:
+        feasible &= amount <= cumIn[-1] * (1 + 1e-9)
+        amount = np.interp(amount, cumIn, cumOut)
+    profit = np.where(feasible, amount - candidates, -np.inf)
+
+    best = np.argmax(profit)
+    return (float(candidates[best]), float(profit[best]))
+
+def walkPath(path, graph, amount: float, fees=None):
+    """
+    Given an amount of the starting currency, walks it along the path through the levels of the book on
+    every edge. Returns the amount that goes into each edge followed by the amount that comes out the end,
+    each in terms of the currency of the node it leaves from. Anything past the depth of a book is dropped
+    """
+    amounts = [amount]
+    for idx in range(len(path) - 1):
+        cumIn, cumOut = _fillCurve(path[idx], graph.getEdge(path[idx], path[idx + 1]), fees)
+        amount = float(np.interp(min(amount, cumIn[-1]), cumIn, cumOut))
+        amounts.append(amount)
+    return amounts
+
+def getSafeScale(values, available, maximum: float, minimum: float):
+    """
+    Given the USD value of every order of a path, and the USD value of what we hold of the currency each
+    one spends, returns the single factor every order gets scaled by so that none is worth more than
+    maximum or more than 80% of what it spends. Returns None if the smallest order would then be worth
+    less than minimum
+    """
+    scale = min(1.0, maximum / max(values))
+    for value, held in zip(values, available):
+        scale = min(scale, held * 0.8 / value)
+    if min(values) * scale < minimum:
+        return None
+    return scale
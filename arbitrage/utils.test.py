@@ -0,0 +1,106 @@
+import unittest
+from graph import Graph
+from math import log
+from utils import getOptimalVolumeOfPath, getSafeScale, walkPath
+
+NO_FEES = {'test': 0.0}
+
+def buildBook(books):
+    """ Builds a graph from a map of (src, dest) -> (volume symbol, [(xrate, vol), ...] best level first) """
+    graph = Graph()
+    for (src, dest) in books.keys():
+        for node in (src, dest):
+            if node not in graph.getNodes():
+                graph.addNode(node)
+    for (src, dest), (volSymbol, levels) in books.items():
+        xrate, vol = levels[0]
+        graph.addEdge(src, dest, xrate, -log(xrate, 2), vol, volSymbol, (src, dest), 'bid', 'test', 0, levels)
+    return graph
+
+class TestOptimalVolume(unittest.TestCase):
+    def test_walksEveryProfitableLevel(self):
+        graph = buildBook({
+            ('A', 'B'): ('A', [(2.0, 5.0), (1.5, 10.0)]),
+            ('B', 'A'): ('B', [(0.8, 100.0)]),
+        })
+        # 5 A at 2.0 come back as 8 A, the next 10 A at 1.5 as 12 A, both levels are worth taking
+        volume, profit = getOptimalVolumeOfPath(['A', 'B', 'A'], graph, NO_FEES)
+        self.assertAlmostEqual(volume, 15.0)
+        self.assertAlmostEqual(profit, 5.0)
+
+    def test_smallerSizeBeatsFullDepth(self):
+        graph = buildBook({
+            ('A', 'B'): ('A', [(2.0, 5.0), (1.0, 10.0)]),
+            ('B', 'A'): ('B', [(0.8, 100.0)]),
+        })
+        # The second level loses 20% on the way round, so we stop at the end of the first
+        volume, profit = getOptimalVolumeOfPath(['A', 'B', 'A'], graph, NO_FEES)
+        self.assertAlmostEqual(volume, 5.0)
+        self.assertAlmostEqual(profit, 3.0)
+        amounts = walkPath(['A', 'B', 'A'], graph, 15.0, NO_FEES)
+        self.assertLess(amounts[-1] - amounts[0], profit)
+
+    def test_limitedByALaterEdge(self):
+        graph = buildBook({
+            ('A', 'B'): ('A', [(2.0, 100.0)]),
+            ('B', 'A'): ('B', [(0.8, 4.0), (0.3, 100.0)]),
+        })
+        # Only 4 B can be sold at 0.8, which is what 2 A buys
+        volume, profit = getOptimalVolumeOfPath(['A', 'B', 'A'], graph, NO_FEES)
+        self.assertAlmostEqual(volume, 2.0)
+        self.assertAlmostEqual(profit, 1.2)
+
+    def test_fees(self):
+        graph = buildBook({
+            ('A', 'B'): ('A', [(2.0, 5.0)]),
+            ('B', 'A'): ('B', [(0.8, 100.0)]),
+        })
+        volume, profit = getOptimalVolumeOfPath(['A', 'B', 'A'], graph, {'test': 0.1})
+        self.assertAlmostEqual(volume, 5.0)
+        self.assertAlmostEqual(profit, 5.0 * (2.0 * 0.9 * 0.8 * 0.9 - 1))
+
+    def test_unprofitablePathTradesNothing(self):
+        graph = buildBook({
+            ('A', 'B'): ('A', [(2.0, 5.0)]),
+            ('B', 'A'): ('B', [(0.4, 100.0)]),
+        })
+        self.assertEqual(getOptimalVolumeOfPath(['A', 'B', 'A'], graph, NO_FEES), (0.0, 0.0))
+
+class TestWalkPath(unittest.TestCase):
+    def test_walksLevels(self):
+        graph = buildBook({
+            ('A', 'B'): ('A', [(2.0, 5.0), (1.5, 10.0)]),
+            ('B', 'A'): ('B', [(0.8, 100.0)]),
+        })
+        amounts = walkPath(['A', 'B', 'A'], graph, 7.0, NO_FEES)
+        self.assertAlmostEqual(amounts[0], 7.0)
+        self.assertAlmostEqual(amounts[1], 5.0 * 2.0 + 2.0 * 1.5)
+        self.assertAlmostEqual(amounts[2], 13.0 * 0.8)
+
+    def test_volumeInTheDestinationCurrency(self):
+        # Buying B with A, the book's volumes are in B so 10 B at 2.0 only takes 5 A
+        graph = buildBook({
+            ('A', 'B'): ('B', [(2.0, 10.0)]),
+            ('B', 'A'): ('B', [(0.8, 100.0)]),
+        })
+        amounts = walkPath(['A', 'B', 'A'], graph, 100.0, NO_FEES)
+        self.assertAlmostEqual(amounts[1], 10.0)
+        self.assertAlmostEqual(amounts[2], 8.0)
+
+class TestSafeScale(unittest.TestCase):
+    def test_scalesEveryOrderByTheSameFactor(self):
+        # The biggest order is capped at the maximum, which scales down the others with it
+        self.assertAlmostEqual(getSafeScale([200.0, 100.0], [1000.0, 1000.0], maximum=50.0, minimum=1.0), 0.25)
+
+    def test_limitedByWhatWeHold(self):
+        # Only 80% of the 50 USD the second order spends can go
+        self.assertAlmostEqual(getSafeScale([20.0, 100.0], [1000.0, 50.0], maximum=1000.0, minimum=1.0), 0.4)
+
+    def test_neverScalesUp(self):
+        self.assertEqual(getSafeScale([20.0, 10.0], [1000.0, 1000.0], maximum=1000.0, minimum=1.0), 1.0)
+
+    def test_tooSmall(self):
+        self.assertIsNone(getSafeScale([200.0, 10.0], [1000.0, 1000.0], maximum=50.0, minimum=5.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,15 @@ Singleton object that is a virtual representation of the market
 Author: Parker Timmerman
 """
 
-from constants import Currency, Exchange
+import numpy as np
+import tracing
+
+from constants import Currency, Exchange, FeeType, feeMap, feeTypeMap
 from graph import Graph, Edge
 from math import log
-from time import time
+from utils import monotonicMs
+
+MAX_CONVERSION_HOPS = 3                         # most trades convertCurrency will chain together
 
 class VirtualMarket():
     class _VirtualMarket():
@@ -32,6 +37,15 @@ class VirtualMarket():
             self._supportedCurrencyPairs = pairs
             self._initMarket()
 
+            # log2(1 - fee) for each exchange, added to the log of every rate so edge weights are what we can execute at
+            self._feeTypes = {exch: feeTypeMap.get(exch, FeeType.TAKER) for exch in self._supportedExchanges}
+            self._logFees = {}
+            for exchange in self._supportedExchanges:
+                self._cacheFee(exchange)
+
+            # Exchange -> (graph version, (V, V) matrix of best conversion rates), rebuilt when the graph changes
+            self._conversions = {}
+
         def _initMarket(self):
             for exchange in self._supportedExchanges:
                 graph = Graph()
@@ -39,6 +53,26 @@ class VirtualMarket():
                     graph.addNode(currency)
                 self._market[exchange] = graph
 
+        def _cacheFee(self, exch: Exchange):
+            self._logFees[exch] = log(1 - self.getFee(exch), 2)
+
+        def getFee(self, exch: Exchange) -> float:
+            """ Returns the fee we expect to pay on the given exchange, as a fraction """
+            return feeMap.get(exch, (0.0, 0.0))[self._feeTypes[exch].value]
+
+        def getFees(self):
+            """ Returns a dictionary of exchange to the fee we expect to pay on it """
+            return {exch: self.getFee(exch) for exch in self._supportedExchanges}
+
+        def setFeeType(self, exch: Exchange, feeType: FeeType):
+            """
+            Choose whether we expect to pay maker or taker fees on an exchange, takes effect for edges added
+            from here on
+            """
+            self._feeTypes[exch] = feeType
+            self._cacheFee(exch)
+
+        @tracing.traced('updateExchange')
         def updateExchange(self, exch: Exchange, marketData, timestamp = None):
             """
             Given an exchange, and market data in the form of:
@@ -46,13 +80,20 @@ class VirtualMarket():
                 (<Currency.XRP: 'XRP'>, <Currency.USDT: 'USDT'>): {'ask': '0.51003000', 'bid': '0.50960000', 'ask_vol': '195.000', 'bid_vol': '30.000'},
                 (<Currency.EOS: 'EOS'>, <Currency.USDT: 'USDT'>): {'ask': '0.51003000', 'bid': '0.50960000', 'ask_vol': '195.000', 'bid_vol': '30.000'}
             }
-            Update the graph for the given exchange
+            Update the graph for the given exchange. Each pair may also have 'asks' and 'bids', lists of
+            (price, vol) for every level of the book, best first
+
+            Edge weights include the exchange's fee, so they reflect the rate we could actually execute at.
+            Exchange rates are left as the raw market prices. timestamp is in milliseconds on the monotonic
+            clock, see utils.monotonicMs, and defaults to now. A pair with its own 'timestamp' is stamped
+            with that instead, for data that was quoted a while before it got here.
             """
             if not exch in self._market:
                 raise TypeError('{} is not in the market representation, it must not be supported!')
             else:
                 if not timestamp:
-                    timestamp = int(time())  # Stamp each request with the local time which we requested it
+                    timestamp = monotonicMs()   # Stamp each request with the local time which we requested it
+                logFee = self._logFees[exch]
                 for pairInfo in marketData.items():
                     pair = pairInfo[0]
 
@@ -60,14 +101,31 @@ class VirtualMarket():
                     bid = pairInfo[1]['bid']
                     ask_vol = pairInfo[1]['ask_vol']
                     bid_vol = pairInfo[1]['bid_vol']
+                    quoted = pairInfo[1].get('timestamp', timestamp)
+
+                    weight1 = -(log(bid, 2) + logFee)
+                    weight2 = -(log((1/ask), 2) + logFee)
 
-                    weight1 = -(log(bid, 2))
-                    weight2 = -(log((1/ask), 2))
+                    # Deeper levels of the book are optional, without them each edge only has the top of the book
+                    bidLevels = [(price, vol) for price, vol in pairInfo[1].get('bids', [(bid, bid_vol)])]
+                    askLevels = [(1/price, vol) for price, vol in pairInfo[1].get('asks', [(ask, ask_vol)])]
 
-                    self._market[exch].addEdge(pair[0], pair[1], bid, weight1, bid_vol, pair[0], pair, 'bid', exch, timestamp)
-                    self._market[exch].addEdge(pair[1], pair[0], 1/ask, weight2, ask_vol, pair[0], pair, 'ask', exch, timestamp)
+                    self._market[exch].addEdge(pair[0], pair[1], bid, weight1, bid_vol, pair[0], pair, 'bid', exch, quoted, bidLevels)
+                    self._market[exch].addEdge(pair[1], pair[0], 1/ask, weight2, ask_vol, pair[0], pair, 'ask', exch, quoted, askLevels)
 
-        def updateMarket(self, marketData):
+        def markStale(self, exch: Exchange, pairs):
+            """
+            Given an exchange and a list of pairs we failed to get fresh data for, flags both edges of each
+            pair as stale so they are ignored by cycle detection until they are updated again
+            """
+            if not exch in self._market:
+                raise TypeError('{} is not in the market representation, it must not be supported!'.format(exch))
+            for pair in pairs:
+                self._market[exch].markStale(pair[0], pair[1])
+                self._market[exch].markStale(pair[1], pair[0])
+
+        @tracing.traced('updateMarket')
+        def updateMarket(self, marketData, timestamp = None):
             """
             Given market data in the form of:
             {
@@ -81,7 +139,8 @@ class VirtualMarket():
                 },
             }
             """
-            timestamp = int(time())
+            if not timestamp:
+                timestamp = monotonicMs()
             for exchange in marketData.keys():
                 self.updateExchange(exch=exchange, marketData=marketData[exchange], timestamp=timestamp)
 
@@ -102,19 +161,66 @@ class VirtualMarket():
             """
             return self._market[exch]
 
+        def _conversionTable(self, exch: Exchange):
+            """
+            Returns a (V, V) matrix where [i][j] is the best rate we can get converting currency i into currency
+            j on the given exchange, through at most MAX_CONVERSION_HOPS trades, or 0 if there is no way to.
+
+            Rates are chained by summing their -log2, the table is a bounded min-plus closure of that matrix.
+            It is only recomputed when the exchange's graph has changed since the last time it was built.
+            """
+            graph = self._market[exch]
+            version = graph.version()
+            cached = self._conversions.get(exch)
+            if cached and cached[0] == version:
+                return cached[1]
+
+            with np.errstate(divide='ignore'):
+                costs = -np.log2(graph.xrateMatrix())
+            best = costs.copy()
+            np.fill_diagonal(best, 0.0)
+            for _ in range(MAX_CONVERSION_HOPS - 1):
+                best = np.minimum(best, (best[:, :, None] + costs[None, :, :]).min(axis=1))
+                np.fill_diagonal(best, 0.0)     # converting a currency to itself is never a trade
+            table = np.exp2(-best)
+            self._conversions[exch] = (version, table)
+            return table
+
+        def getConversionRate(self, exch: Exchange, start: Currency, end: Currency) -> float:
+            """ Returns the best rate to convert start into end on an exchange, or 0 if there is no way to """
+            graph = self._market[exch]
+            try:
+                i = graph.indexOf(start)
+                j = graph.indexOf(end)
+            except KeyError:
+                return 0.0
+            return float(self._conversionTable(exch)[i, j])
+
+        def getConversionRates(self, exch: Exchange, currencies, end: Currency):
+            """
+            Given an exchange and a list of currencies, returns an array of the best rate to convert each of
+            them into end, 0 for any that can't be converted
+            """
+            graph = self._market.get(exch)
+            if graph is None or not graph.hasNode(end):
+                return np.zeros(len(currencies))
+            column = self._conversionTable(exch)[:, graph.indexOf(end)]
+            return np.array([column[graph.indexOf(curr)] if graph.hasNode(curr) else 0.0 for curr in currencies])
+
         def convertCurrency(self, exch: Exchange, amt: float, start: Currency, end: Currency):
             """
             Given an exchange, an amount, starting currency, and an ending currency, will convert
-            the amount in terms of the start currency to an amount in terms of the end currency
+            the amount in terms of the start currency to an amount in terms of the end currency.
+            Currencies without a direct pair are converted through the best path of up to
+            MAX_CONVERSION_HOPS trades, if there is no path at all returns -1
             """
             if (start == end):
                 return amt
-                
-            exchangeGraph = self._market[exch]
-            pairEdge = exchangeGraph.getEdge(start, end)
-            if not pairEdge:
+
+            rate = self.getConversionRate(exch, start, end)
+            if not rate:
                 return -1
-            return amt * pairEdge.getExchangeRate()
+            return amt * rate
                 
 
 
@@ -0,0 +1,51 @@
+import unittest
+from constants import Currency, Exchange
+from virtual_market import VirtualMarket
+
+CURRENCIES = [Currency.BTC, Currency.ETH, Currency.XRP, Currency.USDT, Currency.LTC]
+PAIRS = [(Currency.BTC, Currency.USDT), (Currency.ETH, Currency.BTC), (Currency.XRP, Currency.ETH)]
+
+def ticker(pair, price):
+    return {pair: {'ask': price, 'bid': price, 'ask_vol': 1.0, 'bid_vol': 1.0}}
+
+class TestConvertCurrency(unittest.TestCase):
+    def setUp(self):
+        VirtualMarket.initialize(CURRENCIES, [Exchange.KRAKEN], PAIRS)
+        marketData = {}
+        marketData.update(ticker((Currency.BTC, Currency.USDT), 10000.0))
+        marketData.update(ticker((Currency.ETH, Currency.BTC), 0.05))
+        marketData.update(ticker((Currency.XRP, Currency.ETH), 0.001))
+        VirtualMarket.instance().updateExchange(exch=Exchange.KRAKEN, marketData=marketData, timestamp=1)
+
+    def test_direct(self):
+        self.assertAlmostEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 2, Currency.BTC, Currency.USDT), 20000.0)
+        self.assertAlmostEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 10000, Currency.USDT, Currency.BTC), 1.0)
+
+    def test_multiHop(self):
+        # XRP -> ETH -> BTC -> USDT
+        self.assertAlmostEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 1000, Currency.XRP, Currency.USDT), 500.0)
+
+    def test_unreachable(self):
+        self.assertEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 1, Currency.LTC, Currency.USDT), -1)
+
+    def test_invalidatedByUpdate(self):
+        self.assertAlmostEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 1, Currency.ETH, Currency.USDT), 500.0)
+        VirtualMarket.instance().updateExchange(exch=Exchange.KRAKEN, marketData=ticker((Currency.BTC, Currency.USDT), 20000.0), timestamp=2)
+        self.assertAlmostEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 1, Currency.ETH, Currency.USDT), 1000.0)
+
+    def test_staleEdgesAreSkipped(self):
+        VirtualMarket.instance().markStale(Exchange.KRAKEN, [(Currency.ETH, Currency.BTC)])
+        self.assertEqual(VirtualMarket.instance().convertCurrency(Exchange.KRAKEN, 1, Currency.ETH, Currency.USDT), -1)
+
+    def test_pairTimestamps(self):
+        marketData = ticker((Currency.BTC, Currency.USDT), 20000.0)
+        marketData[(Currency.BTC, Currency.USDT)]['timestamp'] = 5
+        marketData.update(ticker((Currency.ETH, Currency.BTC), 0.05))
+        VirtualMarket.instance().updateExchange(exch=Exchange.KRAKEN, marketData=marketData, timestamp=7)
+        graph = VirtualMarket.instance().getMarketData(Exchange.KRAKEN)
+        self.assertEqual(graph.getEdge(Currency.BTC, Currency.USDT).getTimestamp(), 5)
+        self.assertEqual(graph.getEdge(Currency.USDT, Currency.BTC).getTimestamp(), 5)
+        self.assertEqual(graph.getEdge(Currency.ETH, Currency.BTC).getTimestamp(), 7)
+
+if __name__ == '__main__':
+    unittest.main()